@@ -0,0 +1,167 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: admission.py
+Description: Admission control of the default local DNS server. Under overload
+             the server answers requests it won't resolve right away with the
+             busy response code (0xBB) instead of queueing them without bound:
+             requests from connections beyond --max-clients, cache misses beyond
+             --max-upstream resolved at once, and requests of a client id (PC1,
+             PC2, ...) or peer address over its --rate-limit token bucket.
+             Cache hits keep being answered while the upstream limit is reached.
+'''
+
+import time
+import threading
+import batch
+
+BUSY_CODE = '0xBB' # response code of a request shed or throttled instead of resolved
+DEFAULT_BURST = 50 # requests a client id or peer may send at once over its rate
+DEFAULT_MAX_KEYS = 10000 # client ids or peers tracked by a rate limiter
+
+class Busy(Exception):
+    '''
+    Raised in every request waiting on a cache miss that would have gone over
+    the limit of outstanding upstream requests.
+    '''
+    pass
+
+class RateLimiter(object):
+    '''
+    Token buckets keyed by client id or peer address: every key gets rate
+    tokens per second up to burst, and a request takes one token per query.
+    When max_keys buckets are tracked, the least recently used half is
+    dropped, which only lets those keys start again with a full bucket.
+    '''
+
+    def __init__(self, rate, burst=DEFAULT_BURST, max_keys=DEFAULT_MAX_KEYS, clock=time.time):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.max_keys = max(1, max_keys)
+        self.clock = clock
+        self.buckets = {} # key -> [tokens, time of the last request]
+        self.lock = threading.Lock()
+
+    def allow(self, key, cost=1):
+        '''
+        Function that takes cost tokens from the bucket of key and returns
+        True, or returns False if it doesn't hold that many. A batch larger
+        than the burst passes when the bucket is full.
+        '''
+        cost = min(cost, self.burst)
+        now = self.clock()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:
+                    self.prune()
+                bucket = self.buckets[key] = [self.burst, now]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < cost:
+                bucket[0] = tokens
+                return False
+            bucket[0] = tokens - cost
+            return True
+
+    def prune(self):
+        by_age = sorted(self.buckets, key=lambda key: self.buckets[key][1])
+        for key in by_age[:len(by_age) // 2 + 1]:
+            del self.buckets[key]
+
+class Admission(object):
+    '''
+    The connection, upstream and rate limits of a server process. A limit of
+    0 disables it; a rate of 0 disables rate limiting.
+    '''
+
+    def __init__(self, max_clients=0, max_upstream=0, rate=0, burst=DEFAULT_BURST):
+        self.max_clients = max_clients
+        self.max_upstream = max_upstream
+        self.client_ids = RateLimiter(rate, burst) if rate > 0 else None
+        self.peers = RateLimiter(rate, burst) if rate > 0 else None
+        self.upstream = 0 # cache misses being resolved upstream
+        self.lock = threading.Lock()
+        self.stats = {'shed_clients': 0, 'shed_upstream': 0,
+                      'throttled_client_id': 0, 'throttled_peer': 0}
+
+    def count(self, outcome):
+        with self.lock:
+            self.stats[outcome] += 1
+
+    def admit_client(self, connected):
+        '''
+        Function that returns whether a new connection, making connected
+        clients in all, is served. Requests of a connection that isn't are
+        answered busy.
+        '''
+        return not self.max_clients or connected <= self.max_clients
+
+    def allow(self, client_msg, peer, admitted=True):
+        '''
+        Function that returns True if a request message received from peer (ip
+        address) on an admitted connection is to be resolved, and counts why
+        it isn't otherwise.
+        '''
+        if not admitted:
+            self.count('shed_clients')
+            return False
+        if self.client_ids is None:
+            return True
+        client_id, cost = request_key(client_msg)
+        if not self.peers.allow(peer, cost):
+            self.count('throttled_peer')
+            return False
+        if not self.client_ids.allow(client_id, cost):
+            self.count('throttled_client_id')
+            return False
+        return True
+
+    def acquire_upstream(self):
+        '''
+        Function that reserves one of the max_upstream outstanding upstream
+        requests and returns True, or returns False when all of them are taken.
+        '''
+        with self.lock:
+            if self.max_upstream and self.upstream >= self.max_upstream:
+                self.stats['shed_upstream'] += 1
+                return False
+            self.upstream += 1
+            return True
+
+    def release_upstream(self):
+        with self.lock:
+            self.upstream -= 1
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['upstream'] = self.upstream
+        return stats
+
+def settings_from_args(args):
+    '''
+    Function that returns the Admission given on the command line.
+    '''
+    return Admission(args.max_clients, args.max_upstream, args.rate_limit, args.rate_burst)
+
+def request_key(client_msg):
+    '''
+    Function that returns the client id of a request or batch request and the
+    number of queries it holds.
+    '''
+    if batch.is_batch(client_msg):
+        header = client_msg.split('\n', 1)[0]
+        return header[len(batch.BATCH_KEYWORD) + 1:], client_msg.count('\n')
+    return client_msg.split(", ", 1)[0], 1
+
+def busy_response(server_id):
+    return BUSY_CODE + ', ' + server_id + ', Server busy'
+
+def busy_reply(client_msg, server_id):
+    '''
+    Function that returns the response to a request that isn't resolved: the
+    busy response, or for a batch request a batch of them.
+    '''
+    return batch.answer_all(client_msg, server_id, busy_response(server_id))
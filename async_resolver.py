@@ -0,0 +1,645 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: async_resolver.py
+Description: asyncio mode of the default local DNS server (Python 3.7+). Every
+             client connection, root/TLD lookup and cache access runs as a
+             coroutine on a single event loop instead of one OS thread per
+             client, using the same wire protocol and response codes as the
+             threaded mode in default_server.py.
+
+             The cache and log files are shared with threads (cache refreshes)
+             and, with a shared cache, other processes. A cache lookup or log
+             line that would wait for one of their locks, or for room in the log
+             queue, is handed to the default executor instead, as are cache
+             updates, so the event loop never waits on them.
+'''
+
+import time
+import signal
+import asyncio
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+import admission
+import batch
+import deadlines
+import framing
+import log_writer
+import metrics
+import query
+import replica_set
+import resolver_cache
+import single_flight
+import tracing
+import zone_reload
+
+local = None # the default_server module whose cache, logs and settings are used
+clients = set() # stream writers of the connected clients
+framed_clients = set() # stream writers of the clients speaking the framed protocol
+
+class AsyncPooledConnection(object):
+    '''
+    A framed asyncio stream connection to an upstream server.
+    '''
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.frames = framing.FrameReader()
+        self.next_id = 1
+
+    def healthy(self):
+        return not self.reader.at_eof() and not self.writer.is_closing()
+
+    async def request(self, msg):
+        '''
+        Function that sends a framed request and returns the message of the
+        reply with the same request id, or '' if the connection closed. Frames
+        with request id 0 are server notices such as 'shutdown' and are returned
+        in place of the reply, as upstream_pool.PooledConnection does.
+        '''
+        request_id = self.next_id
+        self.next_id = (self.next_id % 0xFFFFFFFF) + 1
+        self.writer.write(framing.encode_frame(request_id, tracing.attach(msg)))
+        await self.writer.drain()
+        while True:
+            data = await self.reader.read(framing.RECV_SIZE)
+            if not data:
+                return ''
+            for reply_id, reply in self.frames.feed(data):
+                if reply_id == request_id or reply_id == framing.NOTICE_ID:
+                    return reply
+
+    def close(self):
+        self.writer.close()
+
+class AsyncConnectionPool(object):
+    '''
+    Pool of long-lived asyncio stream connections keyed by upstream (ip, port),
+    with at most max_size connections in use per upstream at a time. Requests
+    time out and are hedged like upstream_pool.ConnectionPool's.
+    '''
+
+    def __init__(self, max_size, hedging=None):
+        self.max_size = max(1, max_size)
+        self.hedging = hedging
+        self.idle = {}  # (ip, port) -> list of idle AsyncPooledConnections
+        self.slots = {} # (ip, port) -> semaphore limiting connections in use
+        self.stats = {'hits': 0, 'misses': 0, 'reconnects': 0, 'discarded': 0,
+                      'timeouts': 0, 'hedged': 0, 'hedge_wins': 0}
+
+    def take_idle(self, addr):
+        '''
+        Function that returns a healthy idle connection to addr, or None.
+        '''
+        idle = self.idle.setdefault(addr, [])
+        while idle:
+            conn = idle.pop()
+            if conn.healthy():
+                self.stats['hits'] += 1
+                return conn
+            conn.close()
+            self.stats['discarded'] += 1
+        return None
+
+    def slot(self, addr):
+        return self.slots.setdefault(addr, asyncio.Semaphore(self.max_size))
+
+    async def request(self, addr, msg, deadline=None, hedge_addr=None, on_hedge=None):
+        '''
+        Coroutine version of upstream_pool.ConnectionPool.request: the response
+        to msg from the upstream server at addr, sent again to hedge_addr
+        (default: addr) when it is still unanswered after its hedging delay.
+        deadlines.DeadlineExceeded is raised if no response came in time.
+        '''
+        delay = self.hedging.delay(addr) if self.hedging is not None else None
+        started = time.time()
+        try:
+            if delay is None:
+                response = await asyncio.wait_for(self.send(addr, msg, deadline),
+                                                  deadlines.seconds_left(deadline))
+                answered_by_addr = True
+            else:
+                response, answered_by_addr = await self.hedged_request(addr, msg, deadline, delay,
+                                                                       hedge_addr or addr,
+                                                                       on_hedge)
+        except (asyncio.TimeoutError, deadlines.DeadlineExceeded):
+            self.stats['timeouts'] += 1
+            raise deadlines.DeadlineExceeded('No response from upstream server ' + str(addr) +
+                                             ' before the deadline')
+        if self.hedging is not None: # the latency of addr, not of its hedge
+            elapsed = time.time() - started
+            if not answered_by_addr: # the hedge answered first, addr took at least this long
+                elapsed = max(elapsed, delay)
+            self.hedging.record(addr, elapsed)
+        return response
+
+    async def hedged_request(self, addr, msg, deadline, delay, hedge_addr, on_hedge=None):
+        '''
+        Coroutine that sends msg to addr and, if no response has come delay
+        seconds later and a connection to hedge_addr is free, to hedge_addr
+        too. The first response and whether it came from addr rather than
+        hedge_addr are returned, and the other request is cancelled. on_hedge
+        is called as for upstream_pool.ConnectionPool.request.
+        '''
+        first = asyncio.ensure_future(self.send(addr, msg, deadline))
+        pending = set([first])
+        try:
+            remaining = deadlines.seconds_left(deadline)
+            done, pending = await asyncio.wait(
+                pending, timeout=delay if remaining is None else min(delay, remaining))
+            if not done and not self.slot(hedge_addr).locked():
+                hedge = asyncio.ensure_future(self.send(hedge_addr, msg, deadline))
+                pending.add(hedge)
+                self.stats['hedged'] += 1
+                if on_hedge is not None:
+                    hedge_done = on_hedge()
+                    hedge.add_done_callback(lambda task: hedge_done())
+            error = None
+            while pending or done:
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.stats['hedge_wins'] += 1
+                        return task.result(), task is first
+                    error = task.exception()
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending,
+                                                   timeout=deadlines.seconds_left(deadline),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def send(self, addr, msg, deadline=None):
+        '''
+        Coroutine that sends a request message to the upstream server at addr
+        over a pooled connection and returns its response. A broken pooled
+        connection is replaced and the request retried once.
+        '''
+        waited = time.time() if self.slot(addr).locked() else None
+        async with self.slot(addr):
+            if waited is not None:
+                tracing.record('pool-wait', waited)
+            for attempt in range(2):
+                conn = self.take_idle(addr)
+                if conn is None:
+                    self.stats['misses'] += 1
+                    reader, writer = await asyncio.open_connection(addr[0], addr[1])
+                    conn = AsyncPooledConnection(reader, writer)
+                try:
+                    response = await conn.request(deadlines.attach(msg, deadline))
+                except (OSError, ConnectionError, framing.FramingError):
+                    response = ''
+                except asyncio.CancelledError: # timed out, or a hedged request answered first
+                    conn.close()
+                    self.stats['discarded'] += 1
+                    raise
+                if response:
+                    self.idle[addr].append(conn)
+                    return response
+                conn.close()
+                self.stats['discarded'] += 1
+                if attempt == 0:
+                    self.stats['reconnects'] += 1
+        raise ConnectionError('Upstream server ' + str(addr) + ' closed the connection')
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['open'] = dict((str(addr[0]) + ':' + str(addr[1]), len(conns))
+                             for addr, conns in self.idle.items())
+        return stats
+
+    def close_all(self):
+        for addr in self.idle:
+            for conn in self.idle[addr]:
+                conn.close()
+            self.idle[addr] = []
+
+class AsyncSingleFlight(object):
+    '''
+    Coroutine counterpart of single_flight.SingleFlight: the first coroutine to
+    miss the cache for a key does the work and concurrent callers with the same
+    key await its result or exception. If the first coroutine is cancelled
+    the others fail with SingleFlightTimeout rather than wait out the timeout.
+    '''
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.flights = {}
+        self.stats = {'leaders': 0, 'coalesced': 0, 'timeouts': 0, 'errors': 0}
+
+    async def do(self, key, coro_fn):
+        flight = self.flights.get(key)
+        if flight is not None:
+            self.stats['coalesced'] += 1
+            try:
+                return await asyncio.wait_for(asyncio.shield(flight), self.timeout)
+            except asyncio.TimeoutError:
+                self.stats['timeouts'] += 1
+                raise single_flight.SingleFlightTimeout(
+                    'Timed out waiting for in-flight request ' + str(key))
+        flight = self.flights[key] = asyncio.get_running_loop().create_future()
+        self.stats['leaders'] += 1
+        try:
+            result = await coro_fn()
+        except Exception as e:
+            self.stats['errors'] += 1
+            flight.set_exception(e)
+            flight.exception() # mark retrieved when nobody else is waiting
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            del self.flights[key]
+            if not flight.done(): # the leader was cancelled: its waiters fail now
+                flight.set_exception(single_flight.SingleFlightTimeout(
+                    'In-flight request ' + str(key) + ' was cancelled'))
+                flight.exception()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['in_flight'] = len(self.flights)
+        return stats
+
+upstreams = None # AsyncConnectionPool created when the server starts
+in_flight = None # AsyncSingleFlight created when the server starts
+
+async def run_blocking(function, *args):
+    '''
+    Coroutine that calls a function of default_server that may wait for a lock
+    or the log queue in the default executor and returns its result.
+    '''
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+async def write_to_file(filename, content, is_client_msg):
+    '''
+    Coroutine version of default_server.write_to_file, which writes the line
+    on the event loop unless it would have to wait.
+    '''
+    if not local.write_to_file(filename, content, is_client_msg, False):
+        await run_blocking(local.write_to_file, filename, content, is_client_msg)
+
+async def get_cached_mapping(q):
+    '''
+    Coroutine version of default_server.get_cached_mapping.
+    '''
+    response = local.get_cached_mapping(q, False)
+    if response is resolver_cache.LOCKED:
+        response = await run_blocking(local.get_cached_mapping, q)
+    return response
+
+async def cached_referral(q):
+    '''
+    Coroutine version of default_server.cached_referral.
+    '''
+    root_msg = local.cached_referral(q, False)
+    if root_msg is resolver_cache.LOCKED:
+        root_msg = await run_blocking(local.cached_referral, q)
+    return root_msg
+
+async def request_dns_server(addr, msg, deadline, referred=True):
+    '''
+    Coroutine version of default_server.request_dns_server.
+    '''
+    sent = time.time()
+    with tracing.span('tld'):
+        response = await request_replicas(addr, msg, deadline, referred)
+    metrics.observe_upstream('tld', sent)
+    return response
+
+async def request_replicas(addr, msg, deadline, referred):
+    '''
+    Coroutine that sends a request to the DNS server at addr or, when addr is
+    a replica of a domain, to the replica chosen and then the other replicas
+    until one answers.
+    '''
+    replicas = replica_set.find_replica_set(local.replicas, addr)
+    if replicas is None:
+        return await upstreams.request(addr, msg, deadline)
+    tried = []
+    error = None
+    while True:
+        replica = replicas.choose(tried, addr if referred else None)
+        if replica is None:
+            raise ConnectionError('No replica of ' + replicas.domain + ' answered: ' + str(error))
+        tried.append(replica.addr)
+        hedge = replicas.choose(tried, count=False) or replica
+        started = replicas.clock()
+        try:
+            response = await upstreams.request(replica.addr, msg, deadline, hedge.addr,
+                                               lambda hedge=hedge: replicas.hedge_sent(hedge))
+        except (OSError, framing.FramingError) as e:
+            replicas.finish(replica, started, False)
+            error = e
+            continue
+        except deadlines.DeadlineExceeded:
+            replicas.finish(replica, started, None)
+            raise
+        replicas.finish(replica, started, True)
+        return response
+
+async def resolve_query(q, client_msg, root_msg, server_id, filename, referred=True):
+    '''
+    Coroutine version of default_server.resolve_query: an iterative request is
+    sent on to the DNS server the root server referred to, a recursive request
+    is answered by the root server's response.
+    '''
+    if q.iterative and root_msg.startswith('0x01'):
+        root_msg_arr = root_msg.split(", ")
+        ip = root_msg_arr[2]
+        port = int(root_msg_arr[3])
+        await write_to_file(filename, client_msg, False)
+        log_writer.echo('Message sent to DNS server port ' + str(port) + ': ' + client_msg)
+        response = await request_dns_server((ip, port), client_msg, q.deadline, referred)
+        log_writer.echo('Response received from DNS server: ' + response)
+        await write_to_file(filename, response, False)
+        return response
+    return root_msg
+
+async def talk_with_server(q, server_id, filename):
+    '''
+    Coroutine version of default_server.talk_with_server that asks the root
+    server how to resolve query q, unless its referral is cached.
+    '''
+    client_msg = q.message(server_id)
+    root_msg = await cached_referral(q)
+    if root_msg is not None:
+        log_writer.echo('Cached root referral used: ' + root_msg)
+        try:
+            return await resolve_query(q, client_msg, root_msg, server_id, filename, False)
+        except OSError: # ask the root server again
+            await run_blocking(local.referrals.discard, local.referral_key(q))
+    await write_to_file(filename, client_msg, False)
+    log_writer.echo('Message sent to root DNS server: ' + client_msg)
+    started = time.time()
+    with tracing.span('root'):
+        root_msg = await upstreams.request(local.ROOT_SERVER, client_msg, q.deadline)
+    metrics.observe_upstream('root', started)
+    log_writer.echo('Response received from root DNS server: ' + root_msg)
+    await write_to_file(filename, root_msg, False)
+    await run_blocking(local.remember_referral, q, root_msg)
+    return await resolve_query(q, client_msg, root_msg, server_id, filename)
+
+async def resolve_uncached(q, server_id, filename):
+    '''
+    Coroutine version of default_server.resolve_uncached.
+    '''
+    led = []
+    async def resolve():
+        led.append(True)
+        if not local.limits.acquire_upstream():
+            raise admission.Busy('Outstanding upstream request limit reached')
+        try:
+            response = await talk_with_server(q, server_id, filename)
+        finally:
+            local.limits.release_upstream()
+        response = local.format_message(False, response, server_id)
+        await run_blocking(local.cache_mapping, q, response)
+        return response
+    started = time.time()
+    try:
+        return await in_flight.do((q.name, q.iterative), resolve)
+    finally:
+        if not led:
+            tracing.record('coalesced', started)
+
+async def talk_with_server_batch(queries, server_id, filename):
+    '''
+    Coroutine version of default_server.talk_with_server_batch.
+    '''
+    deadline = queries[0].deadline
+    responses, ask = await run_blocking(local.route_batch, queries)
+    if ask:
+        request = batch.encode_request(server_id, query.entries([queries[i] for i in ask]))
+        await write_to_file(filename, request, False)
+        log_writer.echo('Batch of ' + str(len(ask)) + ' queries sent to root DNS server')
+        started = time.time()
+        with tracing.span('root'):
+            reply = await upstreams.request(local.ROOT_SERVER, request, deadline)
+        metrics.observe_upstream('root', started)
+        await write_to_file(filename, reply, False)
+        failure = deadlines.failure_response(server_id)
+        for i, root_msg in zip(ask, batch.response_lines(reply, len(ask), failure)):
+            responses[i] = root_msg
+        def remember_referrals():
+            for i in ask:
+                local.remember_referral(queries[i], responses[i])
+        await run_blocking(remember_referrals)
+    asked = set(ask)
+
+    async def ask_dns_server(addr, indexes):
+        from_cache = [i for i in indexes if i not in asked]
+        request = batch.encode_request(server_id, query.entries([queries[i] for i in indexes]))
+        await write_to_file(filename, request, False)
+        try:
+            reply = await request_dns_server(addr, request, deadline, not from_cache)
+        except OSError:
+            if not from_cache:
+                raise
+            await run_blocking(local.forget_referrals, queries, from_cache) # ask the root server again
+            return await talk_with_server_batch([queries[i] for i in indexes], server_id, filename)
+        await write_to_file(filename, reply, False)
+        return batch.response_lines(reply, len(indexes), deadlines.failure_response(server_id))
+
+    # the DNS servers are asked concurrently
+    groups = local.group_referrals(queries, responses)
+    replies = await asyncio.gather(*[ask_dns_server(addr, groups[addr]) for addr in groups])
+    for addr, replies_of_addr in zip(groups, replies):
+        for i, response in zip(groups[addr], replies_of_addr):
+            responses[i] = response
+    return responses
+
+async def respond(client_msg, server_id, filename):
+    '''
+    Coroutine version of default_server.respond.
+    '''
+    if zone_reload.is_invalidation(client_msg):
+        return await run_blocking(local.handle_invalidation, client_msg)
+    started = time.time()
+    trace, client_msg = tracing.begin(client_msg)
+    deadline = deadlines.start(local.request_deadline)
+    await write_to_file(filename, client_msg, True)
+    if batch.is_batch(client_msg):
+        log_writer.echo('Batch of ' + str(client_msg.count('\n')) + ' queries recieved from client')
+        with tracing.span('cache'):
+            responses, misses = await run_blocking(local.prepare_batch, client_msg, server_id,
+                                                   deadline)
+        forwarded = []
+        if misses:
+            if local.limits.acquire_upstream():
+                try:
+                    forwarded = await talk_with_server_batch([q for q, indexes in misses],
+                                                             server_id, filename)
+                except local.UPSTREAM_FAILURES as e:
+                    log_writer.echo('Batch failed upstream: ' + str(e))
+                    forwarded = deadlines.failure_response(server_id)
+                finally:
+                    local.limits.release_upstream()
+            else:
+                forwarded = admission.busy_response(server_id)
+        response = await run_blocking(local.finish_batch, responses, misses, forwarded,
+                                      server_id)
+    else:
+        log_writer.echo('Message recieved from client: ' + client_msg)
+        q = query.parse(client_msg, deadline)
+        if not q.valid:
+            response = '0xEE, ' + server_id + ', Invalid format'
+        else:
+            with tracing.span('cache'):
+                response = await get_cached_mapping(q)
+            if not response:
+                try:
+                    response = await resolve_uncached(q, server_id, filename)
+                except admission.Busy:
+                    response = admission.busy_response(server_id)
+                except local.UPSTREAM_FAILURES as e:
+                    log_writer.echo('Request failed upstream: ' + str(e))
+                    response = deadlines.failure_response(server_id)
+    await write_to_file(filename, response, False)
+    metrics.record_response(response, started)
+    tracing.end(trace, client_msg, response)
+    return response
+
+async def respond_to_frame(writer, request_id, client_msg, server_id, filename):
+    '''
+    Coroutine run as its own task for every framed request so that pipelined
+    requests are resolved concurrently and answered as soon as each is ready.
+    '''
+    response = await respond(client_msg, server_id, filename)
+    if not writer.is_closing():
+        writer.write(framing.encode_frame(request_id, response))
+        log_writer.echo('Response sent to client: ' + response + '\n')
+
+async def new_client(reader, writer, server_id, filename):
+    '''
+    Coroutine that talks with the client to recieve requests and respond with
+    the correct response message, in either the framed or unframed protocol.
+    '''
+    clients.add(writer)
+    peer = writer.get_extra_info('peername')
+    admitted = local.limits.admit_client(len(clients))
+    log_writer.echo('Connected to client ' + str(peer))
+    framed = None
+    frame_reader = framing.FrameReader()
+    tasks = set() # responses to framed requests still being resolved
+    try:
+        shutdown = False
+        while not shutdown:
+            data = await reader.read(framing.RECV_SIZE)
+            if not data:
+                break
+            if framed is None:
+                framed = framing.is_framed(data)
+                if framed:
+                    framed_clients.add(writer)
+            frames = frame_reader.feed(data) if framed else [(0, data.decode('utf-8'))]
+            for request_id, client_msg in frames:
+                if (client_msg == 'shutdown'): # recieve broadcast message from another server
+                    local.has_been_closed = True
+                    shutdown = True
+                    break
+                local.has_been_closed = False
+                busy = local.shed(client_msg, peer[0], admitted, server_id)
+                if busy is not None:
+                    writer.write(framing.encode_frame(request_id, busy) if framed
+                                 else busy.encode('utf-8'))
+                elif framed:
+                    task = asyncio.ensure_future(
+                        respond_to_frame(writer, request_id, client_msg, server_id, filename))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                else:
+                    response = await respond(client_msg, server_id, filename)
+                    writer.write(response.encode('utf-8'))
+                    log_writer.echo('Response sent to client: ' + response + '\n')
+            await writer.drain()
+            if not admitted:
+                break
+        if tasks: # let pipelined requests finish before the connection closes
+            await asyncio.wait(tasks)
+    except (OSError, ConnectionError, framing.FramingError, UnicodeDecodeError):
+        pass
+    finally:
+        clients.discard(writer)
+        framed_clients.discard(writer)
+        writer.close()
+        log_writer.echo('Client socket closed')
+
+def raise_open_file_limit():
+    '''
+    Function that raises the soft limit on open files to the hard limit, since
+    every client connection holds a file descriptor.
+    '''
+    if resource is not None:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+async def serve(server_id, server_port, backlog, sock=None):
+    filename = server_id + '.log'
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+        if sock is not None: # a worker process is stopped by its supervisor
+            loop.add_signal_handler(signal.SIGTERM, stop.set)
+    except NotImplementedError: # event loops without signal support
+        pass
+    serve_client = lambda reader, writer: new_client(reader, writer, server_id, filename)
+    metrics.registry.collect('dns_active_connections', 'gauge', 'Connected clients',
+                             lambda: len(clients))
+    metrics.collect_admission(lambda: local.limits.get_stats())
+    metrics.collect_pool(lambda: upstreams.get_stats())
+    metrics.registry.collect('dns_tasks', 'gauge', 'asyncio tasks of the event loop',
+                             lambda: len(asyncio.all_tasks(loop)))
+    if sock is None:
+        srv = await asyncio.start_server(serve_client, '127.0.0.1', int(server_port),
+                                         backlog=backlog, reuse_address=True)
+        print('Default local DNS Server started! (asyncio mode)')
+        print('Waiting for clients...')
+    else:
+        srv = await asyncio.start_server(serve_client, sock=sock, backlog=backlog)
+    await stop.wait()
+
+    # user has manually indicated server shutdown
+    print('\nCommencing default local server shutdown')
+    srv.close()
+    for writer in list(clients):
+        if writer in framed_clients:
+            writer.write(framing.encode_frame(0, 'shutdown'))
+        else:
+            writer.write('shutdown'.encode('utf-8'))
+        writer.close()
+    if sock is None: # a worker leaves the broadcast to its supervisor
+        local.broadcast_shutdown()
+    upstreams.close_all()
+    local.logs.close()
+    tracing.close()
+    local.save_snapshot()
+    local.print_stats(upstreams, in_flight)
+    print('Default local DNS server socket closed')
+
+def server(default_server, server_id, server_port, backlog, pool_size, sock=None):
+    '''
+    Main function of the asyncio mode. default_server is the module providing
+    the cache, log files, message helpers and settings. A worker process passes
+    the listening socket it serves as sock.
+    '''
+    global local, upstreams, in_flight
+    local = default_server
+    upstreams = AsyncConnectionPool(pool_size, local.upstreams.hedging)
+    in_flight = AsyncSingleFlight(local.in_flight.timeout)
+    if sock is None: # the supervisor of a worker resets the log files once
+        local.reset_log_files(server_id + '.log')
+    raise_open_file_limit()
+    asyncio.run(serve(server_id, server_port, backlog, sock))
@@ -0,0 +1,84 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: batch.py
+Description: Batch message type that carries many hostnames in one message
+             through the default local, root and .com, .org, .gov DNS servers.
+
+             A batch request is a 'BATCH <id>' header line followed by one
+             'hostname, mode' line per query. The batch response is a
+             'BATCH <id>' header line followed by one ordinary response line
+             ('0x00, <id>, ip', '0xFF, <id>, Host not found', ...) per query, in
+             the same order as the request. Batches are large, so they are meant
+             to be sent over the framed protocol (framing.py).
+'''
+
+BATCH_KEYWORD = 'BATCH'
+
+def is_batch(msg):
+    '''
+    Function that returns True if msg is a batch request or response.
+    '''
+    return msg.startswith(BATCH_KEYWORD + ' ')
+
+def encode_request(sender_id, entries):
+    '''
+    Function that returns the batch request message for a list of
+    (hostname, mode) pairs.
+    '''
+    lines = [BATCH_KEYWORD + ' ' + sender_id]
+    lines.extend(hostname + ', ' + mode for hostname, mode in entries)
+    return '\n'.join(lines)
+
+def decode_request(msg):
+    '''
+    Function that returns the sender id and list of (hostname, mode) pairs of a
+    batch request. A line that isn't a 'hostname, mode' pair is returned as
+    (line, '') so that it is answered as an invalid query.
+    '''
+    lines = msg.split('\n')
+    entries = []
+    for line in lines[1:]:
+        fields = line.split(', ')
+        if len(fields) == 2:
+            entries.append((fields[0], fields[1]))
+        else:
+            entries.append((line, ''))
+    return lines[0][len(BATCH_KEYWORD) + 1:], entries
+
+def answer_all(msg, sender_id, response):
+    '''
+    Function that returns response as the answer to request msg, or for a
+    batch request a batch response giving it to every query.
+    '''
+    if is_batch(msg):
+        return encode_response(sender_id, [response] * msg.count('\n'))
+    return response
+
+def encode_response(sender_id, responses):
+    '''
+    Function that returns the batch response message for a list of response
+    lines.
+    '''
+    return '\n'.join([BATCH_KEYWORD + ' ' + sender_id] + list(responses))
+
+def decode_response(msg):
+    '''
+    Function that returns the sender id and list of response lines of a batch
+    response.
+    '''
+    lines = msg.split('\n')
+    return lines[0][len(BATCH_KEYWORD) + 1:], lines[1:]
+
+def response_lines(msg, count, failure):
+    '''
+    Function that returns the count response lines of batch response msg, or
+    failure for every query if msg isn't a batch response with that many lines
+    (e.g. a 'shutdown' notice returned in place of the reply).
+    '''
+    if is_batch(msg):
+        lines = decode_response(msg)[1]
+        if len(lines) == count:
+            return lines
+    return [failure] * count
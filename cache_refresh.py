@@ -0,0 +1,79 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: cache_refresh.py
+Description: Background refresh of popular cache entries in the default local DNS
+             server. The cache schedules an entry that keeps being hit when it is
+             about to expire, and a few refresher threads resolve it again, so
+             clients keep getting cache hits for popular names instead of one of
+             them waiting on the root and DNS servers every TTL.
+'''
+
+import threading
+try:
+    import Queue as queue
+except ImportError: # Python 3
+    import queue
+
+DEFAULT_WINDOW = 10 # seconds before expiry in which a hit schedules a refresh
+DEFAULT_MIN_HITS = 3 # hits an entry needs before it is worth refreshing
+DEFAULT_CONCURRENCY = 2 # refreshes running at the same time
+DEFAULT_MAX_PENDING = 1000 # scheduled refreshes waiting for a refresher thread
+
+class Refresher(object):
+    '''
+    Runs refresh(hostname) for scheduled hostnames in at most concurrency
+    threads, which are started with the first refresh. When max_pending
+    refreshes are already waiting, newly scheduled ones are dropped and the
+    entries simply expire.
+    '''
+
+    def __init__(self, refresh, concurrency=DEFAULT_CONCURRENCY, max_pending=DEFAULT_MAX_PENDING):
+        self.refresh = refresh
+        self.concurrency = max(1, concurrency)
+        self.pending = queue.Queue(max_pending)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.stats = {'scheduled': 0, 'refreshed': 0, 'failed': 0, 'dropped': 0}
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.concurrency):
+                t = threading.Thread(target=self.run)
+                t.daemon = True
+                t.start()
+                self.threads.append(t)
+
+    def schedule(self, hostname):
+        '''
+        Function called by the cache with a hostname due for a refresh.
+        '''
+        self.start()
+        try:
+            self.pending.put_nowait(hostname)
+            outcome = 'scheduled'
+        except queue.Full:
+            outcome = 'dropped'
+        with self.lock:
+            self.stats[outcome] += 1
+
+    def run(self):
+        while True:
+            hostname = self.pending.get()
+            try:
+                self.refresh(hostname)
+                outcome = 'refreshed'
+            except Exception as e: # the old entry stays until it expires
+                print('Refreshing ' + hostname + ' failed: ' + str(e))
+                outcome = 'failed'
+            with self.lock:
+                self.stats[outcome] += 1
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['pending'] = self.pending.qsize()
+        return stats
@@ -0,0 +1,138 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: cache_snapshot.py
+Description: Persistence of the default local DNS server's cache across restarts.
+             The cache is saved periodically (and on shutdown) to a snapshot file
+             and loaded back on startup, with every entry keeping what was left
+             of its TTL, so a restarted server doesn't begin with a cold cache.
+
+             Snapshot format: the 8 byte magic 'DNSCACHE' and the entry count,
+             then for every entry its expiry time, the lengths of its hostname
+             and response, and the utf-8 hostname and response. Entries whose
+             hostname or response is too long for a 16 bit length aren't saved.
+
+             mapping.log is kept across restarts as an append-only journal of
+             resolved names, compacted on startup to the last line of every name.
+'''
+
+import os
+import time
+import struct
+import threading
+from collections import OrderedDict
+
+SNAPSHOT_MAGIC = b'DNSCACHE'
+SNAPSHOT_HEADER = struct.Struct('<8sI') # magic, number of entries
+SNAPSHOT_ENTRY = struct.Struct('<dHH')  # expiry time, hostname length, response length
+MAX_FIELD_SIZE = 0xFFFF # longest hostname or response a snapshot entry holds, in bytes
+DEFAULT_INTERVAL = 60 # seconds between snapshots of the cache
+
+def save_snapshot(cache, filename):
+    '''
+    Function that writes every live entry of cache to filename and returns how
+    many were written. The file is replaced in one step, so a crash while
+    saving leaves the previous snapshot in place.
+    '''
+    entries = [(hostname.encode('utf-8'), response.encode('utf-8'), expiry)
+               for hostname, response, expiry in cache.export()]
+    entries = [entry for entry in entries
+               if len(entry[0]) <= MAX_FIELD_SIZE and len(entry[1]) <= MAX_FIELD_SIZE]
+    tmp = filename + '.tmp'
+    f = open(tmp, 'wb')
+    try:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(entries)))
+        for hostname, response, expiry in entries:
+            f.write(SNAPSHOT_ENTRY.pack(expiry, len(hostname), len(response)))
+            f.write(hostname)
+            f.write(response)
+    finally:
+        f.close()
+    os.rename(tmp, filename)
+    return len(entries)
+
+def load_snapshot(cache, filename, clock=time.time):
+    '''
+    Function that puts the entries of a snapshot file that haven't expired
+    back in cache, for what is left of their TTL, and returns how many were
+    restored. A missing file restores nothing and a damaged one is read up to
+    the damage.
+    '''
+    try:
+        f = open(filename, 'rb')
+    except IOError:
+        return 0
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    restored = 0
+    try:
+        magic, count = SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('not a cache snapshot')
+        offset = SNAPSHOT_HEADER.size
+        now = clock()
+        for i in range(count):
+            expiry, hostname_len, response_len = SNAPSHOT_ENTRY.unpack_from(data, offset)
+            offset += SNAPSHOT_ENTRY.size
+            hostname = data[offset:offset + hostname_len].decode('utf-8')
+            offset += hostname_len
+            response = data[offset:offset + response_len].decode('utf-8')
+            offset += response_len
+            if offset > len(data):
+                raise ValueError('truncated entry')
+            if expiry > now:
+                response_arr = response.split(", ")
+                ip = response_arr[2] if len(response_arr) > 2 else ''
+                cache.put(hostname, ip, response, response_arr[0] == '0xFF', expiry - now)
+                restored += 1
+    except (struct.error, ValueError) as e:
+        print('Stopped reading cache snapshot ' + filename + ': ' + str(e))
+    return restored
+
+def snapshot_forever(cache, filename, interval=DEFAULT_INTERVAL):
+    '''
+    Function that starts a thread saving cache to filename every interval
+    seconds.
+    '''
+    def snapshot():
+        while True:
+            time.sleep(interval)
+            try:
+                save_snapshot(cache, filename)
+            except (IOError, OSError) as e:
+                print('Could not save cache snapshot ' + filename + ': ' + str(e))
+    t = threading.Thread(target=snapshot)
+    t.daemon = True
+    t.start()
+
+def compact_journal(filename):
+    '''
+    Function that rewrites the 'hostname ip' journal filename (mapping.log) so
+    it keeps only the latest line of every hostname, in the order they were
+    last written. The number of lines kept is returned.
+    '''
+    try:
+        f = open(filename, 'r')
+    except IOError:
+        return 0
+    latest = OrderedDict()
+    try:
+        for line in f:
+            line = line.strip("\n").strip("\r")
+            if line:
+                hostname = line.split(" ")[0]
+                latest.pop(hostname, None)
+                latest[hostname] = line
+    finally:
+        f.close()
+    tmp = filename + '.tmp'
+    f = open(tmp, 'w')
+    try:
+        f.write('\n'.join(latest.values()))
+    finally:
+        f.close()
+    os.rename(tmp, filename)
+    return len(latest)
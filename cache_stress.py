@@ -0,0 +1,113 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: cache_stress.py
+Description: Stress test for the default local DNS server cache. Many threads
+             call get_cached_mapping and cache_mapping at the same time, then the
+             cache and mapping log file are checked for consistency and the
+             throughput is reported.
+'''
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+def expected_ip(hostname):
+    '''
+    Function that returns the ip address every thread caches for hostname, so
+    any lookup returning a different address reveals a corrupted entry.
+    '''
+    number = sum(ord(c) for c in hostname)
+    return '10.' + str(number % 256) + '.' + str(len(hostname)) + '.' + str(number % 97)
+
+def hammer(default_server, hostnames, operations, errors, seed):
+    '''
+    Function run by every stress thread that mixes cache lookups and inserts.
+    '''
+    rand = random.Random(seed)
+    for i in range(operations):
+        hostname = rand.choice(hostnames)
+        q = default_server.query.Query('default_local', hostname, 'I')
+        response = default_server.get_cached_mapping(q)
+        if response is None:
+            if hostname.startswith('missing'):
+                response = '0xFF, default_local, Host not found'
+            else:
+                response = '0x00, default_local, ' + expected_ip(hostname)
+            default_server.cache_mapping(q, response)
+        elif not hostname.startswith('missing') and \
+                response != '0x00, default_local, ' + expected_ip(hostname):
+            errors.append(hostname + ' -> ' + response)
+
+def check_mapping_log(default_server, errors):
+    '''
+    Function that checks every line of the mapping log file is a whole
+    'hostname ip' record written by exactly one thread. The background log
+    writer is closed first, so every queued line is in the file.
+    '''
+    default_server.logs.close()
+    f = open('mapping.log', 'r')
+    try:
+        lines = f.read().split('\n')
+    finally:
+        f.close()
+    for line in lines:
+        fields = line.split(' ')
+        if len(fields) != 2 or fields[1] != expected_ip(fields[0]):
+            errors.append('corrupted mapping.log line: ' + repr(line))
+    return len(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='Default local DNS server cache stress test')
+    parser.add_argument('--threads', type=int, default=64)
+    parser.add_argument('--operations', type=int, default=20000,
+                        help='cache operations performed by every thread')
+    parser.add_argument('--hostnames', type=int, default=5000)
+    parser.add_argument('--cache-entries', type=int, default=2000,
+                        help='kept below --hostnames so eviction is exercised too')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import default_server
+    import resolver_cache
+    os.chdir(tempfile.mkdtemp()) # keep the generated mapping.log out of the way
+    default_server.cached_mappings = resolver_cache.ShardedResolverCache(args.cache_entries)
+
+    hostnames = ['www.host' + str(i) + '.com' for i in range(args.hostnames)]
+    hostnames += ['missing' + str(i) + '.org' for i in range(args.hostnames // 10)]
+    errors = []
+    threads = [threading.Thread(target=hammer,
+                                args=(default_server, hostnames, args.operations, errors, i))
+               for i in range(args.threads)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    stats = default_server.cached_mappings.get_stats()
+    if stats['entries'] > args.cache_entries:
+        errors.append('cache holds ' + str(stats['entries']) + ' entries, limit is ' +
+                      str(args.cache_entries))
+    if stats['hits'] + stats['misses'] != args.threads * args.operations:
+        errors.append('lookup counters lost updates: ' + str(stats))
+    log_lines = check_mapping_log(default_server, errors)
+
+    total = args.threads * args.operations
+    print('Operations: ' + str(total) + ' in ' + str(round(elapsed, 3)) + 's (' +
+          str(int(total / elapsed)) + ' ops/s)')
+    print('Cache stats: ' + str(stats))
+    print('mapping.log lines: ' + str(log_lines))
+    for error in errors[:20]:
+        print('ERROR: ' + error)
+    print('FAILED' if errors else 'OK')
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,44 +7,118 @@ Description: Program encompasses the functionality of the client program that
              receives user input requests to resolve.
 '''
 
-import sys
 import socket
+import argparse
+import batch
+import framing
+import log_writer
+try:
+    read_input = raw_input
+except NameError: # Python 3
+    read_input = input
 
 has_written = False # keeps track if something has been written to the log file
+logs = log_writer.LogWriter() # appends log lines to the log file in the background
 
 def write_to_file(filename, input, output):
     '''
     Function that writes client request message and server response message
-    to the appropriate client log file.
+    to the appropriate client log file, through the background log writer.
     '''
     if (input != 'q') and (output != 'closed'):
-        f = open(filename,'a')
         global has_written
         if has_written:
-            f.write('\n\n' + input + '\n')
+            logs.write(filename, '\n\n' + input + '\n' + output)
         else:
-            f.write(input + '\n')
+            logs.write(filename, input + '\n' + output)
             has_written = True
-        f.write(output)
-        f.close();
 
 def clean_message(msg):
     '''
     Function that returns message with removed leading and trailing whitespaces
     from the client id, hostname and request fields.
     '''
-    cleaned_msg = ''
-    msg_arr = msg.split(",")
-    for i in range(len(msg_arr)):
-        cleaned_msg += msg_arr[i].strip()
-        if (i != len(msg_arr) - 1):
-            cleaned_msg += ', '
-    return cleaned_msg
+    return ', '.join([field.strip() for field in msg.split(",")])
 
-def client(client_id, server_ip, server_port):
+def read_requests(requests_file):
+    '''
+    Function that returns the non-blank request messages in requests_file.
+    '''
+    f = open(requests_file, 'r')
+    try:
+        return [line.strip() for line in f if line.strip()]
+    finally:
+        f.close()
+
+def send_batches(s, filename, client_id, requests_file, batch_size):
+    '''
+    Function that resolves every request message in requests_file using batch
+    requests of up to batch_size hostnames each. The batches are pipelined on
+    the framed protocol and every response is written to the client log file.
+    '''
+    msgs = read_requests(requests_file)
+    entries = []
+    for msg in msgs:
+        cleaned_msg = clean_message(msg)
+        msg_arr = cleaned_msg.split(", ")
+        if len(msg_arr) == 3:
+            entries.append((msg_arr[1], msg_arr[2]))
+        else: # answered as an invalid query by the server
+            entries.append((cleaned_msg, ''))
+    batch_size = max(1, batch_size)
+    chunks = [entries[i:i + batch_size] for i in range(0, len(entries), batch_size)]
+    s.sendall(b''.join(framing.encode_frame(i + 1, batch.encode_request(client_id, chunk))
+                       for i, chunk in enumerate(chunks)))
+    reader = framing.FrameReader()
+    replies = {}
+    while len(replies) < len(chunks):
+        frames = framing.recv_frames(s, reader)
+        if not frames:
+            break
+        for request_id, reply in frames:
+            if request_id == 0: # server notice such as 'shutdown'
+                print('Response received from default DNS server: ' + reply + '\n')
+                return
+            replies[request_id] = batch.decode_response(reply)[1]
+    for i, chunk in enumerate(chunks):
+        responses = replies.get(i + 1, [])
+        for msg, response in zip(msgs[i * batch_size:], responses):
+            write_to_file(filename, msg, response)
+    print(str(sum(len(r) for r in replies.values())) + ' of ' + str(len(msgs)) +
+          ' requests resolved in ' + str(len(chunks)) + ' batches')
+
+def pipeline(s, filename, requests_file):
+    '''
+    Function that sends every request message in requests_file back-to-back
+    over the framed protocol without waiting for replies, then matches the
+    replies (which may arrive in any order) to their requests by request id.
+    '''
+    msgs = read_requests(requests_file)
+    s.sendall(b''.join(framing.encode_frame(i + 1, clean_message(msg))
+                       for i, msg in enumerate(msgs)))
+    reader = framing.FrameReader()
+    responses = {}
+    while len(responses) < len(msgs):
+        frames = framing.recv_frames(s, reader)
+        if not frames:
+            break
+        for request_id, response in frames:
+            if request_id == 0: # server notice such as 'shutdown'
+                print('Response received from default DNS server: ' + response + '\n')
+                return
+            responses[request_id] = response
+    for i, msg in enumerate(msgs):
+        response = responses.get(i + 1)
+        if response is not None:
+            write_to_file(filename, msg, response)
+            log_writer.echo(msg + ' -> ' + response)
+
+def client(client_id, server_ip, server_port, legacy=False, requests_file=None,
+           batch_file=None, batch_size=1000):
     '''
     Main function where user requests are accepted and resolved by contacting
-    the default local DNS server.
+    the default local DNS server. Requests are framed unless legacy is set, in
+    which case the original unframed text protocol is used.
     '''
     filename = client_id + '.log'
     f = open(filename, 'w'); # create/overwrite client log file
@@ -53,20 +127,53 @@ def client(client_id, server_ip, server_port):
     s = socket.socket()
     s.connect((server_ip, int(server_port)))
     print('Client started!')
+    if requests_file is not None or batch_file is not None:
+        if batch_file is not None:
+            send_batches(s, filename, client_id, batch_file, batch_size)
+        else:
+            pipeline(s, filename, requests_file)
+        s.close()
+        logs.close()
+        print('Client socket closed')
+        return
+    reader = framing.FrameReader()
+    request_id = 0
     response = '' # response from default local DNS server
     while response != 'shutdown':  # default local DNS server has been shut down or user indicated termination of client program
-        msg = raw_input('Enter a message request: ')
+        msg = read_input('Enter a message request: ')
         if (msg != 'q'):
             cleaned_msg = clean_message(msg)
-            s.send(cleaned_msg.encode('utf-8'))
-            response = s.recv(1024).decode('utf-8')
+            if legacy:
+                s.send(cleaned_msg.encode('utf-8'))
+                response = s.recv(1024).decode('utf-8')
+            else:
+                request_id += 1
+                response = framing.request(s, reader, request_id, cleaned_msg)
             if (response != 'shutdown'):
                 write_to_file(filename, msg, response)
             print('Response received from default DNS server: ' + response + '\n')
         else:
             response = 'shutdown'
     s.close()
+    logs.close()
     print('Client socket closed')
 
 if __name__ == '__main__':
-    client(sys.argv[1], sys.argv[2], sys.argv[3])
+    parser = argparse.ArgumentParser(description='DNS client')
+    parser.add_argument('client_id')
+    parser.add_argument('server_ip')
+    parser.add_argument('server_port')
+    parser.add_argument('--legacy', action='store_true',
+                        help='use the original unframed text protocol')
+    parser.add_argument('--pipeline', metavar='FILE',
+                        help='send every request message in FILE back-to-back and exit')
+    parser.add_argument('--batch', metavar='FILE',
+                        help='resolve every request message in FILE with batch requests and exit')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='hostnames per batch request')
+    parser.add_argument('--quiet', action='store_true',
+                        help="don't print every response of a --pipeline run")
+    args = parser.parse_args()
+    log_writer.verbose = not args.quiet
+    client(args.client_id, args.server_ip, args.server_port, args.legacy, args.pipeline,
+           args.batch, args.batch_size)
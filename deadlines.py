@@ -0,0 +1,163 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: deadlines.py
+Description: Deadlines and hedged requests of the default local and root DNS
+             servers. A request gets a deadline (--deadline) when it arrives,
+             and every request sent upstream on its behalf times out when the
+             deadline passes. The remaining time travels with the request as a
+             'DEADLINE <milliseconds>' line in front of the message, so the next
+             server gives up in time to answer too. A request whose deadline
+             passes is answered with the server failure code (0x02).
+
+             A request still unanswered after the p95 (--hedge-percentile)
+             latency of its upstream server is sent a second time, to another
+             replica when there is one, and the first response is used.
+'''
+
+import time
+import threading
+
+SERVER_FAILURE = '0x02' # response code of a request that failed upstream or ran out of time
+DEADLINE_KEYWORD = 'DEADLINE'
+DEFAULT_DEADLINE = 5.0 # seconds a client request may take
+FORWARDED_SHARE = 0.9 # share of the remaining time given to the next server
+DEFAULT_HEDGE_PERCENTILE = 95 # latency percentile after which a request is hedged
+MIN_HEDGE_DELAY = 0.001 # seconds a request waits at least before it is hedged
+HEDGE_SAMPLES = 256 # recent latencies per upstream server the percentile is taken over
+MIN_HEDGE_SAMPLES = 50 # latencies needed before requests to a server are hedged
+
+class DeadlineExceeded(Exception):
+    '''
+    Raised when a request ran out of time before its response arrived.
+    '''
+    pass
+
+class Deadline(object):
+    '''
+    The time by which a request must have its response.
+    '''
+    __slots__ = ('expires', 'clock')
+
+    def __init__(self, seconds, clock=time.time):
+        self.clock = clock
+        self.expires = clock() + seconds
+
+    def remaining(self):
+        return self.expires - self.clock()
+
+    def expired(self):
+        return self.clock() >= self.expires
+
+    def timeout(self):
+        '''
+        Function that returns the seconds left for the next upstream call, or
+        raises DeadlineExceeded when there are none.
+        '''
+        remaining = self.expires - self.clock()
+        if remaining <= 0:
+            raise DeadlineExceeded('Deadline exceeded')
+        return remaining
+
+def start(seconds):
+    '''
+    Function that returns the deadline of a request arriving now, or None if
+    seconds is 0 (no deadline).
+    '''
+    return Deadline(seconds) if seconds > 0 else None
+
+def seconds_left(deadline):
+    '''
+    Function that returns the timeout of the next blocking call made for a
+    request with the given deadline: None (no timeout) without one.
+    '''
+    return None if deadline is None else deadline.timeout()
+
+def attach(msg, deadline):
+    '''
+    Function that returns msg as it is sent upstream: after a line with the
+    share of the remaining time the next server has for it.
+    '''
+    if deadline is None:
+        return msg
+    budget = int(deadline.remaining() * FORWARDED_SHARE * 1000)
+    return DEADLINE_KEYWORD + ' ' + str(max(0, budget)) + '\n' + msg
+
+def detach(msg, default=0):
+    '''
+    Function that returns the deadline carried by a received message and the
+    message without it. A message without one gets a deadline of default
+    seconds (None if 0).
+    '''
+    if not msg.startswith(DEADLINE_KEYWORD + ' '):
+        return start(default), msg
+    header, _, msg = msg.partition('\n')
+    try:
+        milliseconds = int(header[len(DEADLINE_KEYWORD) + 1:])
+    except ValueError:
+        return start(default), msg
+    return Deadline(milliseconds / 1000.0), msg
+
+def failure_response(server_id):
+    return SERVER_FAILURE + ', ' + server_id + ', Server failure'
+
+class HedgePolicy(object):
+    '''
+    Decides when a request to an upstream server is hedged: after the given
+    percentile of the server's recent latencies, or after a fixed delay when
+    one is given. A percentile of 0 and no fixed delay disables hedging.
+    '''
+
+    def __init__(self, percentile=DEFAULT_HEDGE_PERCENTILE, fixed_delay=None,
+                 samples=HEDGE_SAMPLES):
+        self.percentile = percentile
+        self.fixed_delay = fixed_delay
+        self.samples = samples
+        self.latencies = {} # addr -> [recent latencies in arrival order, delay, samples recorded]
+        self.lock = threading.Lock() # guards latencies, recorded by many threads
+
+    def enabled(self):
+        return bool(self.fixed_delay or self.percentile)
+
+    def record(self, addr, seconds):
+        '''
+        Function that records the latency of a request to addr: its response
+        time, or when its hedge answered first the time it had been waiting,
+        so slow answers aren't dropped from the window. The delay is worked out
+        again every few samples.
+        '''
+        if self.fixed_delay or not self.percentile:
+            return
+        with self.lock:
+            entry = self.latencies.get(addr)
+            if entry is None:
+                entry = self.latencies[addr] = [[], None, 0]
+            recent = entry[0]
+            recent.append(seconds)
+            if len(recent) > self.samples:
+                del recent[0]
+            entry[2] += 1
+            if len(recent) >= MIN_HEDGE_SAMPLES and (entry[1] is None or entry[2] % 16 == 0):
+                ordered = sorted(recent)
+                index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100.0))
+                entry[1] = max(MIN_HEDGE_DELAY, ordered[index])
+
+    def delay(self, addr):
+        '''
+        Function that returns the seconds after which a request to addr is
+        hedged, or None if it isn't.
+        '''
+        if self.fixed_delay:
+            return self.fixed_delay
+        with self.lock:
+            entry = self.latencies.get(addr)
+            return entry[1] if entry is not None else None
+
+def settings_from_args(args):
+    '''
+    Function that returns the request deadline in seconds and the HedgePolicy
+    given on the command line (server_engine.build_arg_parser with
+    replicas=True).
+    '''
+    return args.deadline, HedgePolicy(args.hedge_percentile, args.hedge_delay)
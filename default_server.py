@@ -5,82 +5,213 @@ Email: alvar357@umn.edu
 Filename: default_server.py
 Description: Program encompasses the functionality of the default local DNS server
              program that forwards client requests to other servers and sends back
-             the response to the client.
+             the response to the client. With --workers it is served by several
+             worker processes (supervisor.py) that either keep a cache each or
+             share one cache in shared memory (--cache-mode shared).
 '''
 
 import sys
+import time
 import socket
-import thread
+import threading
+try:
+    import thread
+except ImportError: # Python 3, where the asyncio mode is available
+    import _thread as thread
+import admission
+import batch
+import cache_refresh
+import cache_snapshot
+import deadlines
+import dns_wire
+import framing
+import log_writer
+import metrics
+import profiler
+import query
+import replica_set
+import server_engine
+import upstream_pool
+import resolver_cache
+import single_flight
+import supervisor
+import tracing
+import zone_reload
 
-cached_mappings = {} # structure that contains succesful responses to past client requests
+cached_mappings = resolver_cache.ShardedResolverCache() # bounded TTL cache of responses to past client requests
 domains = {} # structure that contains domain ip-port information
+replicas = {} # structure that maps every domain to the ReplicaSet of its DNS servers
+replica_settings = {} # ReplicaSet settings given on the command line
+probe_interval = replica_set.DEFAULT_PROBE_INTERVAL # seconds between replica health probes
 clients = set() # structure that contains active client sockets
+framed_clients = set() # client sockets speaking the framed protocol
+clients_lock = threading.Lock() # guards the clients set shared by client threads
+log_lock = threading.Lock() # keeps log lines in order and guards the flags below
+logs = log_writer.LogWriter() # appends log lines to the log files in the background
 log_has_been_written = False # keeps track if something has been written to the server log file
 mapping_has_been_written = False # keeps track if something has been written to the mapping log file
 has_been_closed = False # keeps track of whether or not any server has been shut down
+upstreams = upstream_pool.ConnectionPool() # reusable connections to the root and DNS servers
+in_flight = single_flight.SingleFlight() # coalesces identical concurrent cache misses
+workers = None # supervisor of the worker processes in --workers mode
+referrals = resolver_cache.ResolverCache(64) # root referrals of iterative requests, by domain or shard
+refresher = None # re-resolves popular cache entries before they expire
+snapshot_file = None # file the cache is saved to and restored from on startup
+snapshot_interval = cache_snapshot.DEFAULT_INTERVAL # seconds between snapshots of the cache
+metrics_port = 0 # port of the metrics endpoint (0 disables it)
+limits = admission.Admission() # connection, upstream and rate limits (admission.py)
+request_deadline = deadlines.DEFAULT_DEADLINE # seconds a client request may take (0: no deadline)
+ROOT_SERVER = ('127.0.0.1', 5353)
+UPSTREAM_FAILURES = (socket.error, framing.FramingError, deadlines.DeadlineExceeded,
+                     single_flight.SingleFlightTimeout) # answered with a server failure
+REFERRAL_TTL = 300 # default seconds a root referral stays cached
 
-def server_shutdown(sock):
+def broadcast_shutdown():
     '''
-    Function triggered by user's ctrl-c keyboard interrupt signaling server shutdown.
-    Broadcast messages 'shutdown' are sent to all other servers notifying them of
-    shutdown and socket connections are closed.
+    Function that sends the broadcast message 'shutdown' to the root DNS server
+    and the .com, .org, .gov DNS servers, unless they have been shut down already.
     '''
-    print('\nCommencing default local server shutdown')
-
-    # sent broadcast message to connected clients and close corresponding sockets
-    for c in clients:
-        c.send('shutdown')
-        c.close()
-
     if not has_been_closed: # if the other servers haven't been shut down already
         # Send broadcast message to root DNS server
         s = socket.socket()
-        s.connect(('127.0.0.1', 5353))
-        s.send("shutdown")
+        s.connect(ROOT_SERVER)
+        s.send("shutdown".encode('utf-8'))
         s.close()
 
         # Send broadcast messages to remaining DNS servers
         for port in domains:
             s = socket.socket()
             ip = domains.get(port)
-            s.connect((ip, int(port)))
-            s.send("shutdown")
+            try:
+                s.connect((ip, int(port)))
+                s.send("shutdown".encode('utf-8'))
+            except socket.error: # a replica that is down has nothing to shut down
+                pass
             s.close()
+
+def print_stats(pool, flights):
+    '''
+    Function that prints the upstream pool, cache, coalescing and log writer
+    counters.
+    '''
+    print('Upstream connection pool stats: ' + str(pool.get_stats()))
+    print('Resolver cache stats: ' + str(cached_mappings.get_stats()))
+    print('Request coalescing stats: ' + str(flights.get_stats()))
+    print('Root referral cache stats: ' + str(referrals.get_stats()))
+    if refresher is not None:
+        print('Cache refresh stats: ' + str(refresher.get_stats()))
+    print('Log writer stats: ' + str(logs.get_stats()))
+    print('Admission control stats: ' + str(limits.get_stats()))
+    print('DNS server replica stats: ' +
+          str(dict((domain, replicas[domain].get_stats()) for domain in replicas)))
+
+def server_shutdown(sock, broadcast=True):
+    '''
+    Function triggered by user's ctrl-c keyboard interrupt signaling server shutdown.
+    Broadcast messages 'shutdown' are sent to all other servers notifying them of
+    shutdown and socket connections are closed. A worker process leaves the
+    broadcast to its supervisor.
+    '''
+    print('\nCommencing default local server shutdown')
+
+    # sent broadcast message to connected clients and close corresponding sockets
+    with clients_lock:
+        connected = list(clients)
+    for c in connected:
+        if c in framed_clients:
+            c.send(framing.encode_frame(0, 'shutdown'))
+        else:
+            c.send('shutdown'.encode('utf-8'))
+        c.close()
+
+    if broadcast:
+        broadcast_shutdown()
+    upstreams.close_all()
+    logs.close()
+    tracing.close()
+    save_snapshot()
+    print_stats(upstreams, in_flight)
     sock.close()
     print('Default local DNS server socket closed')
 
-def write_to_file(filename, content, is_client_msg):
+def reset_log_files(filename):
+    '''
+    Function that creates or overwrites the server log file. The mapping log
+    file is kept as a journal of resolved names and only compacted.
+    '''
+    global mapping_has_been_written
+    f = open(filename, 'w');        # create/overwrite server log file
+    f.close()
+    mapping_has_been_written = cache_snapshot.compact_journal('mapping.log') > 0
+
+def snapshots_enabled():
+    '''
+    Function that returns True if this process saves the cache snapshot. Of
+    the worker processes only the first does.
+    '''
+    return bool(snapshot_file) and (workers is None or workers.number == 0)
+
+def start_snapshots():
+    '''
+    Function that starts saving the cache to the snapshot file every
+    --snapshot-interval seconds, if this process saves it.
+    '''
+    if snapshots_enabled():
+        cache_snapshot.snapshot_forever(cached_mappings, snapshot_file, snapshot_interval)
+
+def save_snapshot():
+    '''
+    Function that saves the cache to the snapshot file on shutdown.
+    '''
+    if snapshots_enabled():
+        count = cache_snapshot.save_snapshot(cached_mappings, snapshot_file)
+        print(str(count) + ' cached answers saved to ' + snapshot_file)
+
+def write_to_file(filename, content, is_client_msg, blocking=True):
     '''
     Function that writes either
     1) message sent/recieved from server OR
     2) resolved query mapping
-    to the server log file or mapping log file, respectively.
+    to the server log file or mapping log file, respectively. The line is
+    queued for the background log writer rather than written right away.
+    Unless blocking is set, nothing is written and False is returned when the
+    line would have to wait for the log lock or for room in the queue.
     '''
-    f = open(filename,'a')
-    if filename == 'mapping.log':
-        global mapping_has_been_written
-        if mapping_has_been_written:
-            f.write('\n' + content)
-        else:
-            f.write(content)
-            mapping_has_been_written = True
-    else:
-        global log_has_been_written
-        if log_has_been_written:
-            if is_client_msg: # check if the message being written is from the client
-                f.write('\n\n' + content)
+    global mapping_has_been_written, log_has_been_written
+    # client threads must not interleave lines or race on the flags
+    with tracing.span('log'):
+        if not log_lock.acquire(blocking):
+            return False
+        try:
+            if filename == 'mapping.log':
+                if mapping_has_been_written:
+                    content = '\n' + content
+            elif log_has_been_written:
+                if is_client_msg: # check if the message being written is from the client
+                    content = '\n\n' + content
+                else:
+                    content = '\n' + content
+            try:
+                logs.write(filename, content, blocking)
+            except log_writer.QueueFull:
+                return False
+            if filename == 'mapping.log':
+                mapping_has_been_written = True
             else:
-                f.write('\n' + content)
-        else:
-            f.write(content)
-            log_has_been_written = True
-    f.close();
+                log_has_been_written = True
+        finally:
+            log_lock.release()
+    return True
 
 def map_domains(filename):
     '''
     Function that maps .com, .org, .gov domains to appropriate port and ip numbers
     based on server.dat file and stores this information in appropriate data structure.
+    The replicas of every domain are grouped so that iterative requests can be
+    retried on another replica.
     '''
+    global replicas
+    replicas = replica_set.build_replica_sets(filename, replicas, **replica_settings)
     file = open(filename, "r");
     try:
         for line in file:
@@ -90,32 +221,130 @@ def map_domains(filename):
     finally:
         file.close()
 
-def cache_mapping(client_msg, response):
+def cache_mapping(q, response):
     '''
-    Function that stores information about resolved query to the appropriate
-    data structure and write it to the mapping log file.
+    Function that stores information about resolved query q (a query.Query) to
+    the appropriate data structure and write it to the mapping log file. 'Host
+    not found' answers are cached for a shorter time and aren't written to the
+    log file. Server failures aren't cached.
     '''
-    client_msg_arr = client_msg.split(", ")
+    if response.startswith(deadlines.SERVER_FAILURE):
+        return
     response_arr = response.split(", ")
-    hostname = client_msg_arr[1].lower()
     response_code = response_arr[0]
     ip = response_arr[2]
-    if (hostname not in cached_mappings) and (response_code != '0xFF'):
-        # make sure hostname can be resolved and hasn't been cached already
-        cached_mappings[hostname] = [ip, response]
-        file_cached_mapping = hostname + " " + ip
+    negative = (response_code == '0xFF')
+    if cached_mappings.put(q.name, ip, response, negative) and not negative:
+        # hostname could be resolved and wasn't cached already
+        file_cached_mapping = q.name + " " + ip
         write_to_file('mapping.log', file_cached_mapping, False)
 
-def get_cached_mapping(client_msg):
+def get_cached_mapping(q, blocking=True):
+    '''
+    Function that returns stored response to resolve query q if its hostname
+    has already been resolved and hasn't expired. Unless blocking is set,
+    resolver_cache.LOCKED is returned instead of waiting for a cache lock.
+    '''
+    return cached_mappings.get(q.name, blocking=blocking)
+
+def invalidate_cached(client_msg):
+    '''
+    Function that drops the cached answers of the hostnames listed in an
+    invalidation message sent by a DNS server that reloaded its mapping file.
+    Names are listed without 'www', so both forms are dropped, and a wildcard
+    name drops every cached name under its domain.
+    '''
+    sender_id, hostnames = zone_reload.decode_invalidation(client_msg)
+    count = 0
+    for hostname in hostnames:
+        hostname = hostname.lower()
+        if hostname.startswith('*.'):
+            count += cached_mappings.discard_suffix(hostname[1:])
+        else:
+            count += cached_mappings.discard(hostname)
+            count += cached_mappings.discard('www.' + hostname)
+    print(str(count) + ' cached answers invalidated by ' + sender_id)
+    return 'INVALIDATED ' + str(count)
+
+def handle_invalidation(client_msg):
+    '''
+    Function that answers an invalidation message. When every worker process
+    keeps its own cache, the message is passed on to all of them.
+    '''
+    if workers is not None and workers.queues:
+        workers.broadcast(client_msg)
+        return 'INVALIDATED in ' + str(workers.count) + ' workers'
+    return invalidate_cached(client_msg)
+
+def start_probes():
+    '''
+    Function that starts the health probes of the DNS server replicas, if enabled.
+    '''
+    if probe_interval > 0:
+        replica_set.probe_forever(lambda: replicas, probe_interval)
+
+def start_metrics():
     '''
-    Function that returns stored response to resolve a query/hostname if it has
-    already been resolved.
+    Function that starts the metrics endpoint, if enabled, with the cache
+    counters, the number of connected clients, the admission control
+    counters and the upstream timeout and hedging counters.
     '''
-    client_msg_arr = client_msg.split(", ")
-    hostname = client_msg_arr[1].lower()
-    if (hostname in cached_mappings):
-        return cached_mappings.get(hostname)[1]
-    return None
+    metrics.collect_cache('dns_cache', lambda: cached_mappings.get_stats())
+    metrics.collect_cache('dns_referral_cache', referrals.get_stats)
+    metrics.registry.collect('dns_active_connections', 'gauge', 'Connected clients',
+                             lambda: len(clients))
+    metrics.collect_admission(lambda: limits.get_stats())
+    metrics.collect_pool(upstreams.get_stats)
+    metrics.serve_http(metrics_port, workers)
+
+def request_dns_server(addr, msg, deadline, referred=True):
+    '''
+    Function that sends a request to the DNS server at addr the root server
+    referred to. When addr is a replica of a domain the request goes to it while
+    it is healthy (or, for a cached referral, to the replica the domain's
+    balancing picks) and is retried on the other replicas if it fails.
+    '''
+    started = time.time()
+    replicas_of_addr = replica_set.find_replica_set(replicas, addr)
+    with tracing.span('tld'):
+        if replicas_of_addr is None:
+            response = upstreams.request(addr, msg, deadline)
+        else:
+            response = replicas_of_addr.request(upstreams.request, msg,
+                                                addr if referred else None, deadline)
+    metrics.observe_upstream('tld', started)
+    return response
+
+def referral_key(q):
+    '''
+    Function that returns the key of the root referral for query q in the
+    referral cache: its domain, or the domain's shard holding its hostname
+    ('com/com0') when the domain is sharded, since each shard is referred to
+    separately.
+    '''
+    domain_replicas = replicas.get(q.domain)
+    if domain_replicas is None:
+        return q.domain
+    return domain_replicas.route(q.zone_name()).domain
+
+def cached_referral(q, blocking=True):
+    '''
+    Function that returns the cached root referral answering query q if it is
+    iterative, or None if the root server has to be asked. Unless blocking is
+    set, resolver_cache.LOCKED is returned instead of waiting for the lock.
+    '''
+    if not q.iterative:
+        return None
+    return referrals.get(referral_key(q), blocking=blocking)
+
+def remember_referral(q, root_msg):
+    '''
+    Function that caches the root server's response to query q if it is a
+    referral.
+    '''
+    if q.iterative and root_msg.startswith('0x01'):
+        addr = ', '.join(root_msg.split(", ")[2:4])
+        referrals.put(referral_key(q), addr, root_msg)
 
 def format_message(is_received, msg, server_id):
     '''
@@ -129,129 +358,570 @@ def format_message(is_received, msg, server_id):
     else:
         return (msg_arr[0] + ', ' + server_id + ', ' + msg_arr[2])
 
-def resolve_query(client_msg, root_msg, server_id, filename):
+def resolve_query(q, client_msg, root_msg, server_id, filename, referred=True):
     '''
     Function that determines whether the response from the root server has to be
     sent to the client (recursive request) or other DNS server that can resolve
     the request (iterative request) and get back the response from this corresponding
     server. The appropriate response message string for either case is returned.
+    client_msg is the message of query q sent on by this server, and referred is
+    False when root_msg is a cached referral.
     '''
-    client_msg_arr = client_msg.split(", ")
-    request = client_msg_arr[2].lower()
-    if (request == "i"): # iterative
-        s = socket.socket()
+    if q.iterative and root_msg.startswith('0x01'):
         root_msg_arr = root_msg.split(", ")
         ip = root_msg_arr[2]
         port = int(root_msg_arr[3])
-        s.connect((ip, port))
-        print('Connected to DNS server port ' + str(port))
         write_to_file(filename, client_msg, False)
-        print('Message sent to DNS server: ' + client_msg)
-        s.send(client_msg.encode('utf-8'))
-        response = s.recv(1024).decode('utf-8')
-        print('Response received from DNS server: ' + response)
+        log_writer.echo('Message sent to DNS server port ' + str(port) + ': ' + client_msg)
+        response = request_dns_server((ip, port), client_msg, q.deadline, referred)
+        log_writer.echo('Response received from DNS server: ' + response)
         write_to_file(filename, response, False)
-        s.close()
-        print('DNS server socket closed')
         return response
     return root_msg
 
-def talk_with_server(client_msg, server_id, filename):
+def talk_with_server(q, server_id, filename):
     '''
     Function responsible for talking with root server to determine the next steps
-    towards resolving the client request. The correct response message to the
-    client message is returned.
+    towards resolving query q over a pooled upstream connection. The correct
+    response message to the query is returned. An iterative request whose
+    domain's referral is cached skips the root server, unless the referred DNS
+    server fails.
     '''
-    s = socket.socket()
-    s.connect(('127.0.0.1', 5353))
-    print('Connected to root DNS server')
+    client_msg = q.message(server_id)
+    root_msg = cached_referral(q)
+    if root_msg is not None:
+        log_writer.echo('Cached root referral used: ' + root_msg)
+        try:
+            return resolve_query(q, client_msg, root_msg, server_id, filename, False)
+        except socket.error: # ask the root server again
+            referrals.discard(referral_key(q))
     write_to_file(filename, client_msg, False)
-    s.send(client_msg.encode('utf-8'))
-    print('Message sent to root DNS server: ' + client_msg)
-    root_msg = s.recv(1024).decode('utf-8')
-    print('Response received from root DNS server: ' + root_msg)
+    log_writer.echo('Message sent to root DNS server: ' + client_msg)
+    started = time.time()
+    with tracing.span('root'):
+        root_msg = upstreams.request(ROOT_SERVER, client_msg, q.deadline)
+    metrics.observe_upstream('root', started)
+    log_writer.echo('Response received from root DNS server: ' + root_msg)
     write_to_file(filename, root_msg, False)
-    s.close()
-    print('Root DNS server socket closed')
-    return resolve_query(client_msg, root_msg, server_id, filename)
+    remember_referral(q, root_msg)
+    return resolve_query(q, client_msg, root_msg, server_id, filename)
+
+def resolve_uncached(q, server_id, filename):
+    '''
+    Function that resolves a client query that missed the cache by talking
+    with the other servers and caches the response. Concurrent identical
+    queries (same lowercased hostname and request mode) are resolved once and
+    all of them receive that response; the time they wait for it is their
+    'coalesced' span.
+    '''
+    led = []
+    def resolve():
+        led.append(True)
+        if not limits.acquire_upstream():
+            raise admission.Busy('Outstanding upstream request limit reached')
+        try:
+            response = talk_with_server(q, server_id, filename)
+        finally:
+            limits.release_upstream()
+        response = format_message(False, response, server_id)
+        cache_mapping(q, response)
+        return response
+    started = time.time()
+    try:
+        return in_flight.do((q.name, q.iterative), resolve)
+    finally:
+        if not led:
+            tracing.record('coalesced', started)
+
+def refresh_mapping(hostname, server_id):
+    '''
+    Function run by a refresher thread to resolve a popular cached hostname
+    again before its entry expires. The new response replaces the entry.
+    '''
+    log_writer.echo('Refreshing cached mapping of ' + hostname)
+    q = query.Query(server_id, hostname, 'I', True, deadlines.start(request_deadline))
+    resolve_uncached(q, server_id, server_id + '.log')
+
+def prepare_batch(client_msg, server_id, deadline):
+    '''
+    Function that answers the queries of a batch request that are invalid or
+    already cached. The list of responses (None for queries still to be
+    resolved) is returned with the unique queries that missed the cache, each
+    paired with the indexes of the batch entries it answers.
+    '''
+    sender_id, entries = batch.decode_request(client_msg)
+    responses = [None] * len(entries)
+    misses = {} # (lowercased hostname, iterative) -> [Query, indexes]
+    order = []
+    for i, q in enumerate(query.parse_batch(sender_id, entries, deadline)):
+        if not q.valid:
+            responses[i] = '0xEE, ' + server_id + ', Invalid format'
+            continue
+        response = get_cached_mapping(q)
+        if response:
+            responses[i] = response
+            continue
+        key = (q.name, q.iterative)
+        if key not in misses:
+            misses[key] = [q, []]
+            order.append(key)
+        misses[key][1].append(i)
+    return responses, [misses[key] for key in order]
+
+def finish_batch(responses, misses, forwarded, server_id):
+    '''
+    Function that caches the responses the other servers gave for the batch
+    queries that missed the cache and returns the batch response string.
+    forwarded is a single response when the misses weren't resolved (busy or
+    server failure), and every one of them is answered with it.
+    '''
+    for n, (q, indexes) in enumerate(misses):
+        if isinstance(forwarded, list):
+            response = format_message(False, forwarded[n], server_id)
+            cache_mapping(q, response)
+        else:
+            response = forwarded
+        for i in indexes:
+            responses[i] = response
+    return batch.encode_response(server_id, responses)
+
+def group_referrals(queries, root_responses):
+    '''
+    Function that groups the iterative batch queries the root server referred
+    to a DNS server by that server's (ip, port), so that each DNS server is sent
+    a single batch.
+    '''
+    groups = {}
+    for i, (q, root_msg) in enumerate(zip(queries, root_responses)):
+        if q.iterative and root_msg.startswith('0x01'):
+            root_msg_arr = root_msg.split(", ")
+            groups.setdefault((root_msg_arr[2], int(root_msg_arr[3])), []).append(i)
+    return groups
 
-def invalid_message(client_msg):
+def route_batch(queries):
     '''
-    Message that return True or False depending on whether or not the client request
-    is invalid.
+    Function that returns the cached root referrals of a list of queries (None
+    where there is none) and the indexes of the queries the root server has to
+    be asked about.
     '''
-    client_msg_arr = client_msg.split(", ")
-    if len(client_msg_arr) != 3:
-        return True
+    responses = [cached_referral(q) for q in queries]
+    return responses, [i for i, response in enumerate(responses) if response is None]
+
+def forget_referrals(queries, indexes):
+    '''
+    Function that drops the cached referrals used by the given batch queries
+    after their DNS server failed.
+    '''
+    for i in indexes:
+        referrals.discard(referral_key(queries[i]))
+
+def talk_with_server_batch(queries, server_id, filename):
+    '''
+    Function that resolves a list of queries with one batch request to the
+    root server and, for iterative queries, one batch request per referred DNS
+    server. Iterative queries whose referral is cached aren't sent to the root
+    server. The queries share the deadline of their batch. The responses are
+    returned in query order.
+    '''
+    deadline = queries[0].deadline
+    responses, ask = route_batch(queries)
+    if ask:
+        request = batch.encode_request(server_id, query.entries([queries[i] for i in ask]))
+        write_to_file(filename, request, False)
+        log_writer.echo('Batch of ' + str(len(ask)) + ' queries sent to root DNS server')
+        started = time.time()
+        with tracing.span('root'):
+            reply = upstreams.request(ROOT_SERVER, request, deadline)
+        metrics.observe_upstream('root', started)
+        write_to_file(filename, reply, False)
+        failure = deadlines.failure_response(server_id)
+        for i, root_msg in zip(ask, batch.response_lines(reply, len(ask), failure)):
+            responses[i] = root_msg
+            remember_referral(queries[i], root_msg)
+    asked = set(ask)
+    for addr, indexes in group_referrals(queries, responses).items():
+        from_cache = [i for i in indexes if i not in asked]
+        request = batch.encode_request(server_id, query.entries([queries[i] for i in indexes]))
+        write_to_file(filename, request, False)
+        log_writer.echo('Batch of ' + str(len(indexes)) + ' queries sent to DNS server port ' + str(addr[1]))
+        try:
+            reply = request_dns_server(addr, request, deadline, not from_cache)
+        except socket.error:
+            if not from_cache:
+                raise
+            forget_referrals(queries, from_cache) # ask the root server again
+            replies = talk_with_server_batch([queries[i] for i in indexes], server_id, filename)
+            for i, response in zip(indexes, replies):
+                responses[i] = response
+            continue
+        write_to_file(filename, reply, False)
+        failure = deadlines.failure_response(server_id)
+        for i, response in zip(indexes, batch.response_lines(reply, len(indexes), failure)):
+            responses[i] = response
+    return responses
+
+def respond_batch(client_msg, server_id, filename, deadline):
+    '''
+    Function that answers a batch request: cached and invalid queries are
+    answered locally and only the cache misses are forwarded, as one batch,
+    which takes one of the outstanding upstream requests.
+    '''
+    with tracing.span('cache'):
+        responses, misses = prepare_batch(client_msg, server_id, deadline)
+    forwarded = []
+    if misses:
+        if limits.acquire_upstream():
+            try:
+                forwarded = talk_with_server_batch([q for q, indexes in misses],
+                                                   server_id, filename)
+            except UPSTREAM_FAILURES as e:
+                log_writer.echo('Batch failed upstream: ' + str(e))
+                forwarded = deadlines.failure_response(server_id)
+            finally:
+                limits.release_upstream()
+        else:
+            forwarded = admission.busy_response(server_id)
+    return finish_batch(responses, misses, forwarded, server_id)
+
+def respond(client_msg, server_id, filename):
+    '''
+    Function that resolves a single client request message or batch request
+    and returns the correct response message. The request has --deadline
+    seconds to be resolved, after which it is answered with a server failure,
+    as it is when the other servers can't be reached. Requests are traced when
+    sampled or timed for the slow-query log (tracing.py).
+    '''
+    if zone_reload.is_invalidation(client_msg):
+        return handle_invalidation(client_msg)
+    started = time.time()
+    trace, client_msg = tracing.begin(client_msg)
+    deadline = deadlines.start(request_deadline)
+    write_to_file(filename, client_msg, True)
+    if batch.is_batch(client_msg):
+        log_writer.echo('Batch of ' + str(client_msg.count('\n')) + ' queries recieved from client')
+        response = respond_batch(client_msg, server_id, filename, deadline)
     else:
-        request = client_msg_arr[2]
-        domain = client_msg_arr[1].split(".")
-        domain = domain[len(domain) - 1]
-        if (request.lower() not in ['i','r']) or (domain.lower() not in ['com','gov','org']):
-            return True
-        return False
+        log_writer.echo('Message recieved from client: ' + client_msg)
+        q = query.parse(client_msg, deadline)
+        if not q.valid:
+            response = '0xEE, ' + server_id + ', Invalid format'
+        else:
+            with tracing.span('cache'):
+                response = get_cached_mapping(q);
+            if not response:
+                try:
+                    response = resolve_uncached(q, server_id, filename)
+                except admission.Busy:
+                    response = admission.busy_response(server_id)
+                except UPSTREAM_FAILURES as e:
+                    log_writer.echo('Request failed upstream: ' + str(e))
+                    response = deadlines.failure_response(server_id)
+    write_to_file(filename, response, False)
+    metrics.record_response(response, started)
+    tracing.end(trace, client_msg, response)
+    return response
+
+def shed(client_msg, peer, admitted, server_id):
+    '''
+    Function that returns the busy response answering a request right away
+    when its connection is over --max-clients or its client id or peer address
+    are over --rate-limit, or None if the request is to be resolved. Messages
+    of the other servers are never shed.
+    '''
+    if zone_reload.is_invalidation(client_msg) or limits.allow(client_msg, peer, admitted):
+        return None
+    response = admission.busy_reply(client_msg, server_id)
+    metrics.record_response(response, time.time())
+    return response
+
+def resolve_udp(hostname, mode, addr, server_id, filename):
+    '''
+    Function that resolves a query received over UDP (dns_wire.py) from addr
+    like any other client request, rate limited by its source address, and
+    returns the response string. A shed query gets the busy response, which
+    is answered with SERVFAIL.
+    '''
+    client_msg = 'UDP, ' + hostname + ', ' + mode
+    busy = shed(client_msg, addr[0], True, server_id)
+    if busy is not None:
+        return busy
+    return respond(client_msg, server_id, filename)
+
+def respond_to_frame(clientsocket, send_lock, request_id, client_msg, server_id, filename):
+    '''
+    Function run in its own thread for every framed request so that pipelined
+    requests are resolved concurrently. The reply carries the request id, so it
+    may be sent before replies to earlier requests.
+    '''
+    response = respond(client_msg, server_id, filename)
+    try:
+        with send_lock:
+            clientsocket.sendall(framing.encode_frame(request_id, response))
+        log_writer.echo('Response sent to client: ' + response + '\n')
+    except socket.error: # client went away before its reply was ready
+        pass
 
-def new_client(clientsocket, addr, server_id, filename):
+def new_client(clientsocket, addr, server_id, filename, admitted=True):
     '''
     Function that talks with the client to recieve requests and respond with the
-    correct response message
+    correct response message. The first bytes the client sends decide whether
+    it speaks the framed protocol or the original unframed one. A client that
+    isn't admitted has the requests it sent first answered busy and is
+    disconnected.
     '''
     global has_been_closed
-    while True:
-        response = ''
-        client_msg = clientsocket.recv(1024).decode('utf-8')
-        if not client_msg:
+    framed = None
+    reader = framing.FrameReader()
+    send_lock = threading.Lock() # framed replies are sent by several threads
+    shutdown = False
+    while not shutdown:
+        data = clientsocket.recv(framing.RECV_SIZE)
+        if not data:
             break
-        if (client_msg == 'shutdown'): # recieve broadcast message from another server
-            has_been_closed = True
+        if framed is None:
+            framed = framing.is_framed(data)
+            if framed:
+                with clients_lock:
+                    framed_clients.add(clientsocket)
+        try:
+            frames = reader.feed(data) if framed else [(0, data.decode('utf-8'))]
+        except (framing.FramingError, UnicodeDecodeError) as e:
+            print('Closing client that sent a bad message: ' + str(e))
             break
-        print('Message recieved from client: ' + client_msg)
-        write_to_file(filename, client_msg, True)
-        has_been_closed = False
-        if (invalid_message(client_msg)):
-            response = '0xEE, ' + server_id + ', Invalid format'
-        else:
-            response = get_cached_mapping(client_msg);
-            if not response:
-                client_msg = format_message(True, client_msg, server_id)
-                response = talk_with_server(client_msg, server_id, filename)
-                response = format_message(False, response, server_id)
-                cache_mapping(client_msg, response)
-        write_to_file(filename, response, False)
-        clientsocket.send(response.encode('utf-8'))
-        print('Response sent to client: ' + response + '\n')
-    clients.remove(clientsocket)
+        for request_id, client_msg in frames:
+            if (client_msg == 'shutdown'): # recieve broadcast message from another server
+                has_been_closed = True
+                shutdown = True
+                break
+            has_been_closed = False
+            busy = shed(client_msg, addr[0], admitted, server_id)
+            if busy is not None:
+                with send_lock:
+                    clientsocket.sendall(framing.encode_frame(request_id, busy) if framed
+                                         else busy.encode('utf-8'))
+            elif framed:
+                thread.start_new_thread(respond_to_frame, (clientsocket, send_lock, request_id,
+                                                           client_msg, server_id, filename))
+            else:
+                response = respond(client_msg, server_id, filename)
+                clientsocket.send(response.encode('utf-8'))
+                log_writer.echo('Response sent to client: ' + response + '\n')
+        if not admitted:
+            break
+    with clients_lock:
+        clients.discard(clientsocket)
+        framed_clients.discard(clientsocket)
     clientsocket.close()
-    print('Client socket closed')
+    log_writer.echo('Client socket closed')
+
+def serve_clients(s, server_id, filename):
+    '''
+    Function that accepts client connections on the listening socket s and
+    talks with every client in a thread of its own.
+    '''
+    while True:
+       c, addr = s.accept()              # Establish connection with client.
+       with clients_lock:
+           clients.add(c)
+           admitted = limits.admit_client(len(clients))
+       log_writer.echo('Connected to client ' + str(addr))
+       # spawn new thread for new client
+       thread.start_new_thread(new_client,(c, addr, server_id, filename, admitted))
+
+def serve_worker(tcp_sock, udp_sock, server_id, udp_threads, mode, backlog, pool_size):
+    '''
+    Function run by every worker process in --workers mode. The worker serves
+    the sockets it was given until the supervisor terminates it, then closes its
+    client connections and log files without broadcasting 'shutdown'.
+    '''
+    global log_has_been_written, mapping_has_been_written
+    filename = server_id + '.log'
+    # other workers write to the same log files, so every line starts a new one
+    log_has_been_written = mapping_has_been_written = True
+    start_probes()
+    start_snapshots()
+    start_metrics()
+    if udp_sock is not None:
+        ip, port = udp_sock.getsockname()
+        dns_wire.serve_udp(ip, port,
+                           lambda hostname, mode, addr: resolve_udp(hostname, mode, addr,
+                                                                    server_id, filename),
+                           udp_threads, sock=udp_sock)
+    if mode == 'asyncio':
+        import async_resolver
+        async_resolver.server(sys.modules[__name__], server_id, None, backlog, pool_size,
+                              sock=tcp_sock)
+        sys.exit(supervisor.TERMINATED)
+    try:
+        serve_clients(tcp_sock, server_id, filename)
+    except SystemExit: # terminated by the supervisor
+        server_shutdown(tcp_sock, broadcast=False)
+        raise
 
-def server(server_id, server_port, mapping_file, servers_list):
+def server(server_id, server_port, mapping_file, servers_list,
+           backlog=server_engine.DEFAULT_BACKLOG, udp_threads=0, worker_count=0,
+           reuse_port=False, mode='threads', pool_size=upstream_pool.DEFAULT_POOL_SIZE,
+           shared_cache=False):
     '''
     Main function where default local DNS server connection is set up to recieve
-    and send messages and is closed when appropriate.
+    and send messages and is closed when appropriate. When udp_threads is set,
+    standard DNS queries are also answered over UDP on the same port. With a
+    worker_count above 1 the port is served by that many worker processes, in
+    the given mode; shared_cache tells whether they share one cache.
     '''
+    global workers
     filename = server_id + '.log'
-    f = open(filename, 'w');        # create/overwrite server log file
-    f.close()
-    f = open('mapping.log', 'w')    # create/overwrite mapping log file
-    f.close()
+    reset_log_files(filename)
     s = socket.socket()                        # Create a socket object
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if worker_count > 1:
+        reuse_port = supervisor.prepare_socket(s, reuse_port)
     ip = '127.0.0.1'
     port = int(server_port)
 
     try:
         s.bind((ip, int(server_port)))       # Bind to the port
-        s.listen(5)                          # Now wait for client connection.
+        if worker_count > 1:
+            workers = supervisor.Supervisor(
+                worker_count, s, backlog, reuse_port, udp_threads > 0,
+                lambda tcp_sock, udp_sock: serve_worker(tcp_sock, udp_sock, server_id, udp_threads,
+                                                        mode, backlog, pool_size),
+                None if shared_cache else invalidate_cached)
+            print ('Default local DNS Server started!')
+            print ('Waiting for clients...')
+            workers.run()
+            return
+        s.listen(backlog)                    # Now wait for client connection.
+        start_probes()
+        start_snapshots()
+        start_metrics()
+        if udp_threads:
+            dns_wire.serve_udp(ip, server_port,
+                               lambda hostname, mode, addr: resolve_udp(hostname, mode, addr,
+                                                                        server_id, filename),
+                               udp_threads)
         print ('Default local DNS Server started!')
         print ('Waiting for clients...')
-        while True:
-           c, addr = s.accept()              # Establish connection with client.
-           clients.add(c)
-           print ('Connected to client ' + str(addr))
-           # spawn new thread for new client
-           thread.start_new_thread(new_client,(c, addr, server_id, filename))
+        serve_clients(s, server_id, filename)
     except KeyboardInterrupt: # user has manually indicated server shutdown
-        server_shutdown(s)
+        if workers is not None: # the workers already closed their clients and logs
+            print('\nCommencing default local server shutdown')
+            workers.stop()
+            broadcast_shutdown()
+            s.close()
+            print('Default local DNS server socket closed')
+        else:
+            server_shutdown(s)
 
 if __name__ == '__main__':
-    map_domains(sys.argv[4])
-    server(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])
+    parser = server_engine.build_arg_parser('Default local DNS server', threads=False,
+                                            reload=False, replicas=True)
+    parser.add_argument('--mode', choices=['threads', 'asyncio'], default='threads',
+                        help='one thread per client, or a single asyncio event loop (Python 3)')
+    parser.add_argument('--pool-size', type=int, default=upstream_pool.DEFAULT_POOL_SIZE,
+                        help='maximum pooled connections per upstream server')
+    parser.add_argument('--cache-entries', type=int, default=resolver_cache.DEFAULT_MAX_ENTRIES,
+                        help='maximum number of cached hostnames')
+    parser.add_argument('--cache-bytes', type=int, default=resolver_cache.DEFAULT_MAX_BYTES,
+                        help='approximate memory budget of the cache in bytes')
+    parser.add_argument('--cache-ttl', type=float, default=resolver_cache.DEFAULT_TTL,
+                        help='seconds a resolved hostname stays cached')
+    parser.add_argument('--negative-ttl', type=float, default=resolver_cache.DEFAULT_NEGATIVE_TTL,
+                        help='seconds a host not found answer stays cached')
+    parser.add_argument('--referral-ttl', type=float, default=REFERRAL_TTL,
+                        help='seconds a root referral is reused for iterative requests '
+                             '(0 always asks the root server)')
+    parser.add_argument('--coalesce-timeout', type=float, default=single_flight.DEFAULT_TIMEOUT,
+                        help='seconds a request waits on an identical in-flight request')
+    parser.add_argument('--log-queue', type=int, default=log_writer.DEFAULT_QUEUE_SIZE,
+                        help='log lines buffered in memory before --log-policy applies')
+    parser.add_argument('--log-policy', choices=log_writer.POLICIES, default='block',
+                        help='wait for room in a full log queue, or drop the line')
+    parser.add_argument('--log-flush-interval', type=float,
+                        default=log_writer.DEFAULT_FLUSH_INTERVAL,
+                        help='seconds between flushes of a partially filled log batch')
+    parser.add_argument('--cache-shards', type=int, default=resolver_cache.DEFAULT_SHARDS,
+                        help='number of independently locked cache shards')
+    parser.add_argument('--refresh-ahead', type=float, default=cache_refresh.DEFAULT_WINDOW,
+                        metavar='SECONDS',
+                        help='refresh a popular cache entry when it is hit this close to its '
+                             'expiry (0 disables refreshing)')
+    parser.add_argument('--refresh-hits', type=int, default=cache_refresh.DEFAULT_MIN_HITS,
+                        help='hits a cache entry needs before it is refreshed')
+    parser.add_argument('--refresh-concurrency', type=int,
+                        default=cache_refresh.DEFAULT_CONCURRENCY,
+                        help='refreshes running at the same time')
+    parser.add_argument('--snapshot', metavar='FILE',
+                        help='file the cache is saved to and restored from on startup '
+                             '(default: <server_id>.cache)')
+    parser.add_argument('--snapshot-interval', type=float, default=cache_snapshot.DEFAULT_INTERVAL,
+                        metavar='SECONDS',
+                        help='seconds between snapshots of the cache (0 disables snapshots)')
+    parser.add_argument('--cache-mode', choices=['worker', 'shared'], default='worker',
+                        help='with --workers, give every worker process its own cache or '
+                             'share one cache in shared memory')
+    parser.add_argument('--max-clients', type=int, default=0,
+                        help='connected clients served at once; requests of further clients '
+                             'are answered busy (0xBB) (default: unlimited)')
+    parser.add_argument('--max-upstream', type=int, default=0,
+                        help='cache misses resolved upstream at once; further misses are '
+                             'answered busy (default: unlimited)')
+    parser.add_argument('--rate-limit', type=float, default=0, metavar='QPS',
+                        help='queries per second allowed per client id and per peer address; '
+                             'queries over it are answered busy (default: unlimited)')
+    parser.add_argument('--rate-burst', type=int, default=admission.DEFAULT_BURST,
+                        help='queries a client id or peer address may send at once over '
+                             '--rate-limit')
+    args = parser.parse_args()
+    upstreams.max_size = max(1, args.pool_size)
+    log_writer.verbose = not args.quiet
+    logs = log_writer.LogWriter(args.log_queue, args.log_flush_interval, policy=args.log_policy)
+    in_flight.timeout = args.coalesce_timeout
+    referrals.ttl = args.referral_ttl
+    replica_settings = replica_set.settings_from_args(args)
+    probe_interval = args.probe_interval
+    metrics_port = args.metrics_port
+    limits = admission.settings_from_args(args)
+    request_deadline, upstreams.hedging = deadlines.settings_from_args(args)
+    tracing.configure(args.server_id, args.trace_sample, args.slow_query_ms)
+    profiler.install(args.server_id, args.profile_seconds)
+    shared_cache = args.workers > 1 and args.cache_mode == 'shared'
+    if shared_cache:
+        cached_mappings = resolver_cache.SharedResolverCache(
+            args.cache_entries, args.cache_bytes, args.cache_ttl, args.negative_ttl,
+            context=supervisor.get_context())
+    else:
+        cached_mappings = resolver_cache.ShardedResolverCache(
+            args.cache_entries, args.cache_bytes, args.cache_ttl, args.negative_ttl,
+            args.cache_shards)
+    if args.refresh_ahead > 0 and args.refresh_concurrency > 0:
+        refresher = cache_refresh.Refresher(
+            lambda hostname: refresh_mapping(hostname, args.server_id), args.refresh_concurrency)
+        cached_mappings.refresh_ahead(args.refresh_ahead, args.refresh_hits, refresher.schedule)
+    if args.snapshot_interval > 0:
+        snapshot_file = args.snapshot or args.server_id + '.cache'
+        snapshot_interval = args.snapshot_interval
+        print(str(cache_snapshot.load_snapshot(cached_mappings, snapshot_file)) +
+              ' cached answers restored from ' + snapshot_file)
+    map_domains(args.servers_list)
+    udp_threads = args.udp_threads if args.udp else 0
+    if args.workers > 1:
+        server(args.server_id, args.server_port, args.mapping_file, args.servers_list,
+               args.backlog, udp_threads, args.workers, args.reuse_port, args.mode,
+               args.pool_size, shared_cache)
+    elif args.mode == 'asyncio':
+        import async_resolver
+        start_probes()
+        start_snapshots()
+        start_metrics()
+        if udp_threads: # UDP queries are resolved by threads beside the event loop
+            dns_wire.serve_udp('127.0.0.1', args.server_port,
+                               lambda hostname, mode, addr: resolve_udp(hostname, mode, addr,
+                                                                        args.server_id,
+                                                                        args.server_id + '.log'),
+                               udp_threads)
+        async_resolver.server(sys.modules[__name__], args.server_id, args.server_port,
+                              args.backlog, args.pool_size)
+    else:
+        server(args.server_id, args.server_port, args.mapping_file, args.servers_list,
+               args.backlog, udp_threads)
@@ -5,14 +5,32 @@ Email: alvar357@umn.edu
 Filename: dns_servers.py
 Description: Program encompasses the functionality of the .com, .org, .gov DNS server
              programs that resolve DNS queries by referencing the appropriate
-             mapping file.
+             mapping file. The mapping file and server.dat can be reloaded while
+             the server runs (zone_reload.py).
 '''
 
-import sys
+import time
 import socket
+import batch
+import deadlines
+import dns_wire
+import log_writer
+import metrics
+import profiler
+import query
+import replica_set
+import server_engine
+import supervisor
+import tracing
+import zone_index
+import zone_reload
 
-mappings = {} # strcuture that contains hostname mappings according to .dat file
+mappings = zone_index.ZoneIndex() # compact index of the hostname mappings in the .dat file
 domains = {} # structure that contains domain ip-port information
+reloader = None # reloads the mapping file and server.dat in the background
+workers = None # supervisor of the worker processes in --workers mode
+metrics_port = 0 # port of the metrics endpoint (0 disables it)
+MIN_OVERLAY = 1000 # changed names always kept in an overlay rather than rebuilt into the index
 
 def server_shutdown(sock, server_port):
     '''
@@ -25,13 +43,13 @@ def server_shutdown(sock, server_port):
     # Send broadcast message to default local DNS server
     s = socket.socket()
     s.connect(('127.0.0.1', 5352))
-    s.send("shutdown")
+    s.send("shutdown".encode('utf-8'))
     s.close()
 
     # Send broadcast message to root DNS server
     s = socket.socket()
     s.connect(('127.0.0.1', 5353))
-    s.send("shutdown")
+    s.send("shutdown".encode('utf-8'))
     s.close()
 
     # Send broadcast messages to remaining DNS servers
@@ -40,26 +58,27 @@ def server_shutdown(sock, server_port):
             s = socket.socket()
             ip = domains.get(domain_port)
             port = int(domain_port)
-            s.connect((ip, port))
-            s.send("shutdown")
+            try:
+                s.connect((ip, port))
+                s.send("shutdown".encode('utf-8'))
+            except socket.error: # a replica that is down has nothing to shut down
+                pass
             s.close()
+    tracing.close()
     sock.close()
     print('DNS server socket closed')
 
 def preprocess_server(filename):
     '''
     Function that reads hostname mappings from .dat file to store them in
-    appropriate data structure so they can be used to resolve queries.
+    appropriate data structure so they can be used to resolve queries. A zone
+    file compiled by zone_compile.py is mapped into memory instead of parsed.
     '''
-    file = open(filename, "r");
-    try:
-        for line in file:
-            line = line.strip("\n").strip("\r")
-            line = line.split(" ")
-            hostname = format_hostname(line[0])
-            mappings[hostname.lower()] = line[1]
-    finally:
-        file.close()
+    global mappings
+    if zone_index.is_compiled(filename):
+        mappings = zone_index.MappedZoneIndex(filename)
+    else:
+        mappings = zone_index.ZoneIndex.build(zone_index.read_mapping_file(filename))
 
 def map_domains(filename):
     '''
@@ -67,14 +86,50 @@ def map_domains(filename):
     addresses based on server.dat file and stores this information in
     appropriate data structure.
     '''
+    global domains
+    new_domains = {}
     file = open(filename, "r");
     try:
         for line in file:
             line = line.strip("\n").strip("\r")
             line = line.split(" ")
-            domains[line[2]] = line[1]
+            new_domains[line[2]] = line[1]
     finally:
         file.close()
+    domains = new_domains
+
+def reload_zone(filename, server_id):
+    '''
+    Function that brings the loaded zone up to date with the mapping file while
+    queries keep being answered from the old one. A few changes are applied as
+    an overlay on the current index; many changes, or a compiled zone file,
+    replace the index. The default local DNS server is told which names changed,
+    in --workers mode by the first worker only, since every worker reloads the
+    same changes.
+    '''
+    global mappings
+    if zone_index.is_compiled(filename):
+        index = zone_index.MappedZoneIndex(filename)
+        changes = mappings.diff(index.items())
+    else:
+        changes = mappings.diff(zone_index.read_mapping_file(filename))
+        if len(mappings.overlay) + len(changes) <= max(MIN_OVERLAY, len(mappings) // 10):
+            index = mappings.with_overlay(changes)
+        else:
+            index = zone_index.ZoneIndex.build(zone_index.read_mapping_file(filename))
+    mappings = index
+    print(str(len(changes)) + ' names changed in ' + filename)
+    if workers is None or workers.number == 0:
+        zone_reload.notify_changed(server_id, [zone_index.unreverse_name(key) for key in changes])
+
+def reload_file(filename, server_id, mapping_file):
+    '''
+    Function run by the reloader for a mapping file or server.dat that changed.
+    '''
+    if filename == mapping_file:
+        reload_zone(filename, server_id)
+    else:
+        map_domains(filename)
 
 def format_message(is_received, msg, server_id):
     '''
@@ -94,75 +149,157 @@ def format_hostname(hostname):
     lowercase so that it be searched for and compared to see if it exists in
     DNS mapping. This reformatted hostname is then returned.
     '''
-    hostname = hostname.split(".")
-    hostname_str = ''
-    index = 0;
-    for i in hostname:
-        if (index != 0) or (i.lower() != 'www'):
-            hostname_str += i
-            if (index != len(hostname)-1):
-                hostname_str += '.'
-        index +=  1
-    return hostname_str.lower()
-
-def resolve_query(client_msg, server_id):
-    '''
-    Function that determines whether a mapping for queried hostname exists in
-    DNS mapping and returns the correct response string.
-    '''
-    client_msg_arr = client_msg.split(", ")
-    hostname = format_hostname(client_msg_arr[1])
-    if (hostname not in mappings):
+    return query.zone_name(hostname)
+
+def resolve_query(q, server_id):
+    '''
+    Function that determines whether a mapping for the hostname of query q
+    exists in DNS mapping and returns the correct response string.
+    '''
+    with tracing.span('lookup'):
+        ip = mappings.lookup(q.zone_name())
+    if ip is None:
         return ('0xFF, ' +  server_id + ', Host not found')
     else:
-        return ('0x00, ' + server_id + ', ' + mappings.get(hostname))
-
-def talk_with_server(clientsocket, addr, server_id, shutdown):
-    '''
-    Function responsible for talking with DNS servers by accepting requests and
-    sending out the correct responses. The server shutdown status after
-    communication is returned.
-    '''
-    while True:
-        client_msg = clientsocket.recv(1024).decode('utf-8')
-        if not client_msg:
-            break
-        if client_msg == 'shutdown': # recieve broadcast message from another server
-            shutdown = True
-            break
-        print('Message recieved from server: ' + client_msg)
-        client_msg = format_message(True, client_msg, server_id)
-        response = resolve_query(client_msg, server_id)
-        clientsocket.send(response.encode('utf-8'))
-        print('Response sent to server: ' + response)
-    clientsocket.close()
-    print('Server socket closed\n')
-    return shutdown
-
-def server(server_id, server_port, mapping_file, servers_list):
+        return ('0x00, ' + server_id + ', ' + ip)
+
+def resolve_batch(client_msg, server_id):
+    '''
+    Function that answers every hostname of a batch request from the DNS
+    mapping in one pass and returns the batch response string.
+    '''
+    sender_id, entries = batch.decode_request(client_msg)
+    responses = []
+    with tracing.span('lookup'):
+        for hostname in query.zone_names([hostname for hostname, mode in entries]):
+            ip = mappings.lookup(hostname)
+            if ip is None:
+                responses.append('0xFF, ' + server_id + ', Host not found')
+            else:
+                responses.append('0x00, ' + server_id + ', ' + ip)
+    return batch.encode_response(server_id, responses)
+
+def resolve_udp(hostname, mode, server_id):
+    '''
+    Function that answers a query received over UDP (dns_wire.py) from the
+    DNS mapping and returns the response string.
+    '''
+    started = time.time()
+    response = resolve_query(query.Query(server_id, hostname, mode), server_id)
+    metrics.record_response(response, started)
+    return response
+
+def handle_request(client_msg, server_id):
+    '''
+    Function responsible for answering a single request or batch request
+    received from another server. It is run by the connection engine's worker
+    threads and the correct response message is returned. A request whose
+    deadline (deadlines.py) passed while it waited for a worker is answered
+    with a server failure, since the server that sent it has given up on it.
+    '''
+    deadline, client_msg = deadlines.detach(client_msg)
+    if deadline is not None and deadline.expired():
+        return batch.answer_all(client_msg, server_id, deadlines.failure_response(server_id))
+    if client_msg == zone_reload.RELOAD_MESSAGE:
+        if workers is not None: # every worker process reloads its own tables
+            workers.broadcast(client_msg)
+        else:
+            reloader.request()
+        return 'Reload started'
+    if client_msg == replica_set.PROBE_MESSAGE: # health probe of the root or default server
+        return replica_set.PROBE_REPLY
+    if batch.is_batch(client_msg):
+        response = resolve_batch(client_msg, server_id)
+        log_writer.echo('Batch of ' + str(client_msg.count('\n')) + ' queries answered')
+        return response
+    log_writer.echo('Message recieved from server: ' + client_msg)
+    response = resolve_query(query.parse(client_msg), server_id)
+    log_writer.echo('Response sent to server: ' + response)
+    return response
+
+def serve_worker(tcp_sock, udp_sock, server_id, threads, udp_threads, watch):
+    '''
+    Function run by every worker process in --workers mode. The worker serves
+    the sockets it was given with a connection engine of its own.
+    '''
+    if watch:
+        zone_reload.watch_files(reloader, watch)
+    metrics.serve_http(metrics_port, workers)
+    if udp_sock is not None:
+        ip, port = udp_sock.getsockname()
+        dns_wire.serve_udp(ip, port,
+                           lambda hostname, mode, addr: resolve_udp(hostname, mode, server_id),
+                           udp_threads, sock=udp_sock)
+    engine = server_engine.ConnectionEngine(
+        lambda client_msg: handle_request(client_msg, server_id), threads, server_id)
+    try:
+        engine.serve_forever(tcp_sock)
+    finally:
+        tracing.close()
+
+def server(server_id, server_port, mapping_file, servers_list,
+           backlog=server_engine.DEFAULT_BACKLOG, threads=server_engine.DEFAULT_THREADS,
+           udp_threads=0, watch=0, worker_count=0, reuse_port=False):
     '''
     Main function where DNS server connection is set up to recieve and send
-    messages and is closed when appropriate.
+    messages and is closed when appropriate. Connections are served concurrently
+    by the connection engine. When udp_threads is set, standard DNS queries are
+    also answered over UDP on the same port. When watch is set, the mapping file
+    and servers list are checked for changes every watch seconds. With a
+    worker_count above 1 the port is served by that many worker processes.
     '''
+    global reloader, workers
+    reloader = zone_reload.Reloader(
+        lambda filename: reload_file(filename, server_id, mapping_file),
+        [mapping_file, servers_list])
     s = socket.socket()                     # Create a socket object
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if worker_count > 1:
+        reuse_port = supervisor.prepare_socket(s, reuse_port)
     ip = domains.get(server_port)
-    shutdown = False                        # Track any existing server shutdown
+    engine = server_engine.ConnectionEngine(
+        lambda client_msg: handle_request(client_msg, server_id), threads, server_id)
 
     try:
         s.bind((ip, int(server_port)))      # Bind to the port
-        s.listen(5)                         # Now wait for client connection.
-        print ('DNS Server started!')
-        print ('Waiting for clients...')
-        while True and not shutdown:
-           c, addr = s.accept()             # Establish connection with client.
-           print('Connected to server ' + str(addr))
-           shutdown = talk_with_server(c, addr, server_id, shutdown)
+        if worker_count > 1:
+            workers = supervisor.Supervisor(
+                worker_count, s, backlog, reuse_port, udp_threads > 0,
+                lambda tcp_sock, udp_sock: serve_worker(tcp_sock, udp_sock, server_id,
+                                                        threads, udp_threads, watch),
+                lambda msg: reloader.request())
+            print ('DNS Server started!')
+            print ('Waiting for clients...')
+            workers.run()
+        else:
+            s.listen(backlog)               # Now wait for client connection.
+            if watch:
+                zone_reload.watch_files(reloader, watch)
+            metrics.serve_http(metrics_port)
+            if udp_threads:
+                dns_wire.serve_udp(ip, server_port,
+                                   lambda hostname, mode, addr: resolve_udp(hostname, mode,
+                                                                            server_id),
+                                   udp_threads)
+            print ('DNS Server started!')
+            print ('Waiting for clients...')
+            engine.serve_forever(s)
         s.close()
         print('DNS server socket closed')
     except KeyboardInterrupt: # user has manually indicated server shutdown
+        engine.stop()
+        if workers is not None:
+            workers.stop()
         server_shutdown(s, server_port)
 
 if __name__ == '__main__':
-    preprocess_server(sys.argv[3])
-    map_domains(sys.argv[4])
-    server(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])
+    args = server_engine.build_arg_parser('.com, .org, .gov DNS server').parse_args()
+    log_writer.verbose = not args.quiet
+    metrics_port = args.metrics_port
+    tracing.configure(args.server_id, args.trace_sample, args.slow_query_ms)
+    profiler.install(args.server_id, args.profile_seconds)
+    preprocess_server(args.mapping_file)
+    map_domains(args.servers_list)
+    server(args.server_id, args.server_port, args.mapping_file, args.servers_list,
+           args.backlog, args.threads, args.udp_threads if args.udp else 0, args.watch,
+           args.workers, args.reuse_port)
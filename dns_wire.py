@@ -0,0 +1,253 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: dns_wire.py
+Description: UDP transport speaking the standard DNS message format (RFC 1035)
+             for A record queries, so standard tools such as dig can query the
+             DNS servers. Queries are decoded into the 'id, hostname, mode'
+             request the servers already resolve (mode R when the query asks for
+             recursion, I otherwise) and the response string they return is
+             encoded back into a DNS response:
+
+             0x00 -> NOERROR with one A record
+             0x01 -> NOERROR referral: an NS record for the domain in the
+                     authority section and its address as glue (standard DNS has
+                     no way to carry the referred server's port)
+             0xFF -> NXDOMAIN
+             0xEE -> REFUSED (the hostname isn't in a .com, .org or .gov domain)
+
+             Every listener thread receives into its own preallocated buffer with
+             recvfrom_into and parses the query in place; the response is built
+             in a second preallocated buffer that starts with the query's
+             question section. A response whose records don't fit in 512 bytes
+             is sent without them and with the TC flag set, so the client knows
+             it was truncated.
+'''
+
+import socket
+import struct
+import threading
+
+MAX_UDP_SIZE = 512 # largest DNS message over UDP without EDNS (RFC 1035 4.2.1)
+MAX_NAME_SIZE = 255 # longest domain name in label format (RFC 1035 2.3.4)
+DEFAULT_TTL = 300  # TTL in seconds of the records in a response
+DEFAULT_UDP_THREADS = 4
+
+QTYPE_A = 1
+QTYPE_NS = 2
+QCLASS_IN = 1
+
+RCODE_NOERROR = 0
+RCODE_FORMERR = 1
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+RCODE_NOTIMP = 4
+RCODE_REFUSED = 5
+
+HEADER = struct.Struct('!HHHHHH') # id, flags, qdcount, ancount, nscount, arcount
+QUESTION_TAIL = struct.Struct('!HH') # qtype, qclass
+RECORD = struct.Struct('!HHHIH')  # name pointer, type, class, ttl, rdlength
+NAME_POINTER = 0xC000 | HEADER.size # compression pointer to the question name
+
+class WireFormatError(ValueError):
+    '''
+    Raised for a query that can't be decoded.
+    '''
+    pass
+
+def parse_query(buf, length):
+    '''
+    Function that decodes the query held in the first length bytes of buf
+    without copying it. Returns (id, flags, hostname, qtype, qclass, end), where
+    end is the offset just past the question section.
+    '''
+    if length < HEADER.size:
+        raise WireFormatError('Message shorter than a DNS header')
+    msg_id, flags, qdcount, ancount, nscount, arcount = HEADER.unpack_from(buf, 0)
+    if flags & 0x8000:
+        raise WireFormatError('Message is a response, not a query')
+    if qdcount != 1:
+        raise WireFormatError('Query must contain exactly one question')
+    labels = []
+    offset = HEADER.size
+    while True:
+        if offset >= length:
+            raise WireFormatError('Truncated question name')
+        size = buf[offset]
+        if size == 0:
+            offset += 1
+            break
+        if size & 0xC0: # queries carry a single name, so compression can't occur
+            raise WireFormatError('Compressed question name')
+        if offset + 2 + size - HEADER.size > MAX_NAME_SIZE: # with the closing zero
+            raise WireFormatError('Question name longer than 255 bytes')
+        if offset + 1 + size > length:
+            raise WireFormatError('Truncated question name')
+        labels.append(bytes(buf[offset + 1:offset + 1 + size]).decode('latin-1'))
+        offset += 1 + size
+    if offset + QUESTION_TAIL.size > length:
+        raise WireFormatError('Truncated question')
+    qtype, qclass = QUESTION_TAIL.unpack_from(buf, offset)
+    return msg_id, flags, '.'.join(labels), qtype, qclass, offset + QUESTION_TAIL.size
+
+def encode_ip(ip):
+    '''
+    Function that returns the 4 byte address of a dotted-quad ip address, or
+    None if the mapping holds something that isn't a valid IPv4 address.
+    '''
+    try:
+        return socket.inet_aton(str(ip)) if ip.count('.') == 3 else None
+    except (socket.error, UnicodeError):
+        return None
+
+def encode_name(name):
+    '''
+    Function that returns a domain name in DNS label format.
+    '''
+    data = bytearray()
+    for label in name.split('.'):
+        if label:
+            data.append(len(label))
+            data.extend(label.encode('latin-1'))
+    data.append(0)
+    return data
+
+def build_response(out, buf, question_end, msg_id, flags, rcode, answer=None,
+                   referral=None, ttl=DEFAULT_TTL):
+    '''
+    Function that writes a response into the preallocated buffer out and
+    returns its length. The question section is copied from the query in buf.
+    answer is the 4 byte address of an A record; referral is a (domain, 4 byte
+    address) pair for an NS record with glue. When the records don't fit in out
+    they are left out and the TC flag is set.
+    '''
+    rd = flags & 0x0100
+    opcode = flags & 0x7800
+    flags = 0x8000 | opcode | rd | 0x0080 | rcode # QR, RA
+    if referral is None and rcode in (RCODE_NOERROR, RCODE_NXDOMAIN):
+        flags |= 0x0400 # AA: answered from this server's own mapping or cache
+    end = max(question_end, HEADER.size) # FORMERR responses carry no question
+    if answer is not None:
+        end += RECORD.size + len(answer)
+    if referral is not None:
+        domain, address = referral
+        zone = encode_name(domain)
+        server = encode_name('ns.' + domain)
+        end += len(zone) + 2 * len(server) + len(address) + 20
+    if end > len(out):
+        flags |= 0x0200 # TC
+        answer = referral = None
+    ancount = 1 if answer is not None else 0
+    nscount = arcount = 1 if referral is not None else 0
+    HEADER.pack_into(out, 0, msg_id, flags, 1 if question_end else 0, ancount, nscount, arcount)
+    out[HEADER.size:question_end] = buf[HEADER.size:question_end]
+    end = max(question_end, HEADER.size)
+    if answer is not None:
+        RECORD.pack_into(out, end, NAME_POINTER, QTYPE_A, QCLASS_IN, ttl, 4)
+        end += RECORD.size
+        out[end:end + 4] = answer
+        end += 4
+    if referral is not None:
+        for rtype, owner, rdata in ((QTYPE_NS, zone, server), (QTYPE_A, server, address)):
+            out[end:end + len(owner)] = owner
+            end += len(owner)
+            struct.pack_into('!HHIH', out, end, rtype, QCLASS_IN, ttl, len(rdata))
+            end += 10
+            out[end:end + len(rdata)] = rdata
+            end += len(rdata)
+    return end
+
+def encode_answer(out, buf, question_end, msg_id, flags, hostname, response, ttl=DEFAULT_TTL):
+    '''
+    Function that encodes one of the servers' response strings as a DNS
+    response in out and returns its length.
+    '''
+    response_arr = response.split(", ")
+    code = response_arr[0]
+    if code == '0x00':
+        address = encode_ip(response_arr[2])
+        if address is None: # mapping file holds an address DNS can't carry
+            return build_response(out, buf, question_end, msg_id, flags, RCODE_SERVFAIL)
+        return build_response(out, buf, question_end, msg_id, flags, RCODE_NOERROR,
+                              answer=address, ttl=ttl)
+    if code == '0x01':
+        address = encode_ip(response_arr[2])
+        domain = hostname.split('.')[-1].lower()
+        return build_response(out, buf, question_end, msg_id, flags, RCODE_NOERROR,
+                              referral=(domain, address), ttl=ttl)
+    if code == '0xFF':
+        return build_response(out, buf, question_end, msg_id, flags, RCODE_NXDOMAIN)
+    if code == '0xEE':
+        return build_response(out, buf, question_end, msg_id, flags, RCODE_REFUSED)
+    return build_response(out, buf, question_end, msg_id, flags, RCODE_SERVFAIL)
+
+def udp_listener(sock, resolve, ttl):
+    '''
+    Function run by every UDP listener thread: receives queries into a
+    preallocated buffer, resolves them with resolve(hostname, mode, addr) and
+    sends the encoded response. A response that fails to encode is answered
+    with SERVFAIL, and no single query can end the thread.
+    '''
+    buf = bytearray(MAX_UDP_SIZE)
+    out = bytearray(MAX_UDP_SIZE)
+    view = memoryview(out)
+    while True:
+        try:
+            length, addr = sock.recvfrom_into(buf)
+        except socket.error:
+            return # socket was closed
+        try:
+            answer_query(sock, buf, length, addr, out, view, resolve, ttl)
+        except Exception as e: # keep the listener serving the next queries
+            print('Error answering UDP query: ' + repr(e))
+
+def answer_query(sock, buf, length, addr, out, view, resolve, ttl):
+    '''
+    Function that answers the query held in the first length bytes of buf,
+    received from addr.
+    '''
+    try:
+        msg_id, flags, hostname, qtype, qclass, end = parse_query(buf, length)
+    except WireFormatError:
+        # only queries get FORMERR: answering responses (QR set) or runts could
+        # bounce errors back and forth between two servers forever
+        if length >= HEADER.size and not buf[2] & 0x80:
+            msg_id = (buf[0] << 8) | buf[1]
+            size = build_response(out, buf, 0, msg_id, 0, RCODE_FORMERR)
+            sock.sendto(view[:size], addr)
+        return
+    if qtype != QTYPE_A or qclass != QCLASS_IN or (flags & 0x7800):
+        size = build_response(out, buf, end, msg_id, flags, RCODE_NOTIMP)
+    else:
+        mode = 'R' if flags & 0x0100 else 'I'
+        try:
+            response = resolve(hostname, mode, addr)
+        except Exception as e:
+            print('Error resolving UDP query for ' + hostname + ': ' + str(e))
+            response = '0x02'
+        try:
+            size = encode_answer(out, buf, end, msg_id, flags, hostname, response, ttl)
+        except (ValueError, IndexError, BufferError, struct.error) as e:
+            print('Error encoding UDP response for ' + hostname + ': ' + str(e))
+            size = build_response(out, buf, end, msg_id, flags, RCODE_SERVFAIL)
+    sock.sendto(view[:size], addr)
+
+def serve_udp(ip, port, resolve, threads=DEFAULT_UDP_THREADS, ttl=DEFAULT_TTL, sock=None):
+    '''
+    Function that binds a UDP socket to (ip, port), unless an already bound
+    sock is given, and starts threads serving DNS queries on it.
+    resolve(hostname, mode, addr), where addr is the (ip, port) the query came
+    from, must return a response string such as '0x00, com, 216.58.192.164'.
+    The socket is returned.
+    '''
+    if sock is None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((ip, int(port)))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    for i in range(max(1, threads)):
+        t = threading.Thread(target=udp_listener, args=(sock, resolve, ttl))
+        t.daemon = True
+        t.start()
+    print('UDP DNS listener started on port ' + str(port))
+    return sock
@@ -0,0 +1,101 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: framing.py
+Description: Length-prefixed framing of the wire protocol shared by the client
+             and all DNS servers. A frame is a 4 byte big-endian payload length,
+             a 4 byte request id and the utf-8 message text (the same
+             'id, hostname, mode' text the original protocol sends). The request
+             id lets a client pipeline many requests on one connection and match
+             replies that come back in any order.
+
+             Frames always start with a zero byte (payloads are below 16 MB)
+             while the original unframed text messages never do, so a server
+             tells the two apart from the first byte a connection sends and keeps
+             serving unframed clients as before.
+'''
+
+import struct
+
+HEADER = struct.Struct('!II') # payload length, request id
+MAX_FRAME = 0xFFFFFF          # largest payload accepted from a peer (keeps the first byte zero)
+RECV_SIZE = 65536             # bytes read from a socket at a time
+NOTICE_ID = 0                 # request id of server notices such as 'shutdown'
+
+class FramingError(ValueError):
+    '''
+    Raised when a peer sends a frame that can't be decoded.
+    '''
+    pass
+
+def is_framed(data):
+    '''
+    Function that returns True if the first bytes received on a connection
+    start a frame rather than an unframed text message.
+    '''
+    return data[:1] == b'\x00'
+
+def encode_frame(request_id, msg):
+    '''
+    Function that returns the bytes of a frame carrying msg.
+    '''
+    payload = msg.encode('utf-8')
+    return HEADER.pack(len(payload), request_id) + payload
+
+class FrameReader(object):
+    '''
+    Buffered frame decoder. Bytes are fed in as they are received and every
+    complete frame is returned as a (request id, message) pair; an incomplete
+    frame stays buffered until the rest of it arrives.
+    '''
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer.extend(data)
+        frames = []
+        start = 0
+        while len(self.buffer) - start >= HEADER.size:
+            length, request_id = HEADER.unpack_from(self.buffer, start)
+            if length > MAX_FRAME:
+                raise FramingError('Frame of ' + str(length) + ' bytes exceeds the limit')
+            end = start + HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            frames.append((request_id, bytes(self.buffer[start + HEADER.size:end]).decode('utf-8')))
+            start = end
+        if start:
+            del self.buffer[:start]
+        return frames
+
+def recv_frames(sock, reader):
+    '''
+    Function that blocks until at least one complete frame has been received
+    on sock and returns the list of frames, or an empty list once the peer has
+    closed the connection.
+    '''
+    while True:
+        data = sock.recv(RECV_SIZE)
+        if not data:
+            return []
+        frames = reader.feed(data)
+        if frames:
+            return frames
+
+def request(sock, reader, request_id, msg):
+    '''
+    Function that sends a single framed request and returns the message of the
+    reply carrying the same request id. Returns '' if the connection closed.
+    Frames with request id 0 are server notices such as 'shutdown' and are
+    returned in place of the reply.
+    '''
+    sock.sendall(encode_frame(request_id, msg))
+    while True:
+        frames = recv_frames(sock, reader)
+        if not frames:
+            return ''
+        for reply_id, reply in frames:
+            if reply_id == request_id or reply_id == NOTICE_ID:
+                return reply
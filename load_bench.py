@@ -0,0 +1,318 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: load_bench.py
+Description: Load generator and benchmark of the whole resolver hierarchy. It
+             generates .com, .org and .gov zones, starts the default local, root
+             and .com, .org, .gov servers on their usual ports and replays query
+             mixes against the default local server from many concurrent framed
+             connections. Every scenario runs against freshly started servers and
+             reports the queries per second and the p50/p99/p99.9 latency. The
+             results are written as JSON, and --compare prints how they changed
+             against an earlier run.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import bisect
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+import framing
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DOMAINS = [('com', 5678), ('org', 5679), ('gov', 5680)]
+ROOT_PORT = 5353
+DEFAULT_PORT = 5352
+HOT_NAMES = 100 # names the hit-heavy scenario draws from
+STARTUP_TIMEOUT = 30 # seconds a server gets to start listening
+
+SCENARIOS = OrderedDict([
+    ('hit-heavy', 'a few popular names, already cached, iterative and recursive'),
+    ('miss-heavy', 'names never asked before, iterative and recursive'),
+    ('nxdomain', 'names missing from their zone'),
+    ('invalid', 'queries with an unknown domain or request mode'),
+    ('iterative', 'names of the whole zones, iterative'),
+    ('recursive', 'names of the whole zones, recursive'),
+])
+
+def zone_hostname(domain, i):
+    return 'www.name' + str(i) + '.' + domain
+
+def generate_zones(directory, records):
+    '''
+    Function that writes a mapping file of records names for every domain and
+    the server.dat listing the three DNS servers.
+    '''
+    for domain, port in DOMAINS:
+        f = open(os.path.join(directory, domain + '.dat'), 'w')
+        try:
+            f.write(''.join(zone_hostname(domain, i) + ' 10.' + str((i >> 16) & 255) + '.' +
+                            str((i >> 8) & 255) + '.' + str(i & 255) + '\n'
+                            for i in range(records)))
+        finally:
+            f.close()
+    f = open(os.path.join(directory, 'server.dat'), 'w')
+    try:
+        f.write(''.join(domain + ' 127.0.0.1 ' + str(port) + '\n' for domain, port in DOMAINS))
+    finally:
+        f.close()
+
+class Zipf(object):
+    '''
+    Draws ranks 0..n-1 where rank k is drawn with weight 1 / (k + 1) ** s.
+    s = 0 draws every rank equally often.
+    '''
+
+    def __init__(self, n, s):
+        self.cumulative = []
+        total = 0.0
+        for k in range(n):
+            total += 1.0 / (k + 1) ** s
+            self.cumulative.append(total)
+
+    def draw(self, rand):
+        return bisect.bisect_left(self.cumulative, rand.random() * self.cumulative[-1])
+
+def query_maker(scenario, records, zipf, connection, connections):
+    '''
+    Function that returns a function giving the (hostname, mode) of the i-th
+    query sent on a connection in the scenario. Names of the miss-heavy and
+    nxdomain scenarios are spread over the connections so none is asked twice.
+    '''
+    popular = Zipf(HOT_NAMES if scenario == 'hit-heavy' else records * len(DOMAINS), zipf)
+    def zone_name(rank):
+        return zone_hostname(DOMAINS[rank % len(DOMAINS)][0], rank // len(DOMAINS))
+    def make(rand, i):
+        n = i * connections + connection # distinct for every query of the scenario
+        mode = rand.choice('IR')
+        if scenario == 'hit-heavy':
+            return zone_name(popular.draw(rand)), mode
+        if scenario == 'miss-heavy':
+            return zone_name(n % (records * len(DOMAINS))), mode
+        if scenario == 'nxdomain':
+            return 'missing' + str(n) + '.' + DOMAINS[n % len(DOMAINS)][0], mode
+        if scenario == 'invalid':
+            return ('host' + str(n) + '.net', mode) if n % 2 else (zone_name(n), 'X')
+        return zone_name(popular.draw(rand)), 'I' if scenario == 'iterative' else 'R'
+    return make
+
+def wait_for_port(port, process):
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit('server on port ' + str(port) + ' exited with code ' +
+                             str(process.returncode))
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise SystemExit('server on port ' + str(port) + ' did not start')
+
+def start_servers(args, directory):
+    '''
+    Function that starts the .com, .org, .gov, root and default local servers
+    in directory and returns their processes once all of them are listening.
+    '''
+    python = args.python or sys.executable
+    for leftover in ['default_local.cache', 'mapping.log']: # every scenario starts cold
+        if os.path.exists(os.path.join(directory, leftover)):
+            os.remove(os.path.join(directory, leftover))
+    out = open(os.path.join(directory, 'servers.out'), 'a')
+    processes = []
+    def start(program, server_id, port, mapping_file, extra):
+        p = subprocess.Popen([python, os.path.join(HERE, program), server_id, str(port),
+                              mapping_file, 'server.dat', '--quiet'] + extra.split(),
+                             cwd=directory, stdout=out, stderr=subprocess.STDOUT)
+        processes.append(p)
+        wait_for_port(port, p)
+    try:
+        for domain, port in DOMAINS:
+            start('dns_servers.py', domain, port, domain + '.dat', args.tld_args)
+        start('root_server.py', 'ROOT', ROOT_PORT, 'com.dat', args.root_args)
+        start('default_server.py', 'default_local', DEFAULT_PORT, 'com.dat',
+              '--snapshot-interval 0 ' + args.default_args)
+    except BaseException:
+        stop_servers(processes)
+        raise
+    finally:
+        out.close()
+    return processes
+
+def stop_servers(processes):
+    for p in reversed(processes):
+        if p.poll() is None:
+            p.terminate()
+    for p in processes:
+        p.wait()
+
+def run_connection(make, count, duration, seed, results):
+    '''
+    Function run by every connection thread: it sends one query at a time
+    until count queries were sent or duration seconds passed, and records the
+    latency and response code of every query.
+    '''
+    rand = random.Random(seed)
+    latencies = []
+    codes = {}
+    errors = 0
+    s = socket.create_connection(('127.0.0.1', DEFAULT_PORT))
+    reader = framing.FrameReader()
+    deadline = time.time() + duration
+    i = 0
+    try:
+        while (count and i < count) or (not count and time.time() < deadline):
+            hostname, mode = make(rand, i)
+            i += 1
+            start = time.time()
+            try:
+                response = framing.request(s, reader, i, 'bench, ' + hostname + ', ' + mode)
+            except (socket.error, framing.FramingError):
+                response = ''
+            if not response:
+                errors += 1
+                break
+            latencies.append(time.time() - start)
+            code = response.split(", ")[0]
+            codes[code] = codes.get(code, 0) + 1
+    finally:
+        s.close()
+    results.append((latencies, codes, errors))
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 3)
+
+def run_scenario(args, scenario, directory):
+    '''
+    Function that runs one scenario against freshly started servers and
+    returns its results.
+    '''
+    processes = start_servers(args, directory)
+    try:
+        if scenario == 'hit-heavy': # cache the popular names in both modes first
+            names = [(zone_hostname(DOMAINS[rank % len(DOMAINS)][0], rank // len(DOMAINS)), mode)
+                     for rank in range(HOT_NAMES) for mode in 'IR']
+            run_connection(lambda rand, i: names[i], len(names), 0, 0, [])
+        results = []
+        threads = [threading.Thread(target=run_connection,
+                                    args=(query_maker(scenario, args.records, args.zipf, c,
+                                                      args.connections),
+                                          args.queries // args.connections if args.queries else 0,
+                                          args.duration, args.seed + c, results))
+                   for c in range(args.connections)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+    finally:
+        stop_servers(processes)
+    latencies = sorted(l for result in results for l in result[0])
+    codes = {}
+    for result in results:
+        for code, count in result[1].items():
+            codes[code] = codes.get(code, 0) + count
+    return OrderedDict([
+        ('queries', len(latencies)),
+        ('errors', sum(result[2] for result in results)),
+        ('seconds', round(elapsed, 3)),
+        ('qps', round(len(latencies) / max(elapsed, 1e-9), 1)),
+        ('p50_ms', percentile(latencies, 0.5)),
+        ('p99_ms', percentile(latencies, 0.99)),
+        ('p999_ms', percentile(latencies, 0.999)),
+        ('codes', codes),
+    ])
+
+def compare(results, previous):
+    '''
+    Function that prints the change of every scenario's QPS and p99 latency
+    against the results of an earlier run.
+    '''
+    for scenario, result in results['scenarios'].items():
+        old = previous.get('scenarios', {}).get(scenario)
+        if not old:
+            continue
+        change = lambda new, before: ('%+.1f%%' % (100.0 * (new - before) / before)
+                                      if new is not None and before else 'n/a')
+        print('%-11s qps %10.1f -> %10.1f (%s)  p99 %8s -> %8s ms (%s)' %
+              (scenario, old['qps'], result['qps'], change(result['qps'], old['qps']),
+               old['p99_ms'], result['p99_ms'], change(result['p99_ms'], old['p99_ms'])))
+
+def main():
+    parser = argparse.ArgumentParser(description='Resolver hierarchy load generator')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma separated scenarios among: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--connections', type=int, default=32,
+                        help='concurrent client connections')
+    parser.add_argument('--duration', type=float, default=5, metavar='SECONDS',
+                        help='length of every scenario')
+    parser.add_argument('--queries', type=int, default=0,
+                        help='queries per scenario instead of running for --duration')
+    parser.add_argument('--records', type=int, default=50000,
+                        help='names generated in every zone')
+    parser.add_argument('--zipf', type=float, default=1.0, metavar='S',
+                        help='exponent of the Zipf name popularity (0 for uniform)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--python', help='interpreter running the servers')
+    parser.add_argument('--default-args', default='',
+                        help='extra arguments of the default local server, e.g. "--workers 4"')
+    parser.add_argument('--root-args', default='', help='extra arguments of the root server')
+    parser.add_argument('--tld-args', default='',
+                        help='extra arguments of the .com, .org, .gov servers')
+    parser.add_argument('--dir', help='where the zones, logs and server output are written')
+    parser.add_argument('--json', default='bench_results.json', metavar='FILE',
+                        help='file the results are written to')
+    parser.add_argument('--compare', metavar='FILE', help='results of an earlier run')
+    args = parser.parse_args()
+    args.connections = max(1, args.connections)
+
+    directory = args.dir or tempfile.mkdtemp()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    generate_zones(directory, args.records)
+    results = OrderedDict([
+        ('time', time.strftime('%Y-%m-%d %H:%M:%S')),
+        ('python', platform.python_version()),
+        ('settings', dict((key, value) for key, value in vars(args).items()
+                          if key not in ('json', 'compare', 'dir'))),
+        ('scenarios', OrderedDict()),
+    ])
+    print('%-11s %9s %7s %10s %9s %9s %9s' %
+          ('scenario', 'queries', 'errors', 'qps', 'p50 ms', 'p99 ms', 'p99.9 ms'))
+    for scenario in args.scenarios.split(','):
+        if scenario not in SCENARIOS:
+            raise SystemExit('unknown scenario ' + scenario)
+        result = run_scenario(args, scenario, directory)
+        results['scenarios'][scenario] = result
+        print('%-11s %9d %7d %10.1f %9s %9s %9s' %
+              (scenario, result['queries'], result['errors'], result['qps'],
+               result['p50_ms'], result['p99_ms'], result['p999_ms']))
+        sys.stdout.flush()
+    f = open(args.json, 'w')
+    try:
+        json.dump(results, f, indent=2)
+    finally:
+        f.close()
+    print('results written to ' + args.json)
+    if args.compare:
+        f = open(args.compare, 'r')
+        try:
+            compare(results, json.load(f))
+        finally:
+            f.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
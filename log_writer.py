@@ -0,0 +1,182 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: log_writer.py
+Description: Background log writer shared by the client and default local DNS
+             server programs. Log lines are put on a bounded in-memory queue and
+             a writer thread appends them to their (kept open) log files in
+             batches, flushing once enough bytes have accumulated or a short
+             interval has passed. When the queue is full callers either wait for
+             room (block) or the line is dropped and counted (drop). Lines that
+             can't be written (permissions, full disk) are dropped and counted
+             too, so the writer thread keeps draining the queue.
+
+             Also holds the switch for the per-message lines the programs print.
+'''
+
+import time
+import threading
+try:
+    import Queue as queue
+except ImportError: # Python 3
+    import queue
+
+DEFAULT_QUEUE_SIZE = 10000    # log lines buffered before the policy applies
+DEFAULT_FLUSH_INTERVAL = 0.2  # seconds between flushes of a partially filled batch
+DEFAULT_FLUSH_BYTES = 64 * 1024 # batch size that triggers an immediate flush
+POLICIES = ['block', 'drop']
+QueueFull = queue.Full # raised by a write that would wait for room
+
+verbose = True # print a line for every message sent and received
+
+def echo(msg):
+    '''
+    Function that prints a per-message line unless printing has been turned off.
+    '''
+    if verbose:
+        print(msg)
+
+class FlushRequest(object):
+    '''
+    Queue marker asking the writer thread to write everything queued before it.
+    '''
+
+    def __init__(self):
+        self.done = threading.Event()
+
+STOP = object() # queue marker ending the writer thread
+
+class LogWriter(object):
+    '''
+    Bounded queue of (filename, text) appends drained by a writer thread.
+    '''
+
+    def __init__(self, max_queue=DEFAULT_QUEUE_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 flush_bytes=DEFAULT_FLUSH_BYTES, policy='block'):
+        if policy not in POLICIES:
+            raise ValueError('Unknown log policy ' + repr(policy))
+        self.queue = queue.Queue(max(1, max_queue))
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.policy = policy
+        self.files = {}   # filename -> file object opened for appending
+        self.pending = {} # filename -> texts not written yet
+        self.pending_bytes = 0
+        self.stats = {'written': 0, 'dropped': 0, 'flushes': 0}
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def write(self, filename, text, blocking=True):
+        '''
+        Function that queues text to be appended to filename. Returns False if
+        the line was dropped because the queue was full. With the block policy
+        and blocking unset, QueueFull is raised instead of waiting for room.
+        '''
+        if self.thread is None:
+            self.start()
+        if self.policy == 'block':
+            if blocking:
+                self.queue.put((filename, text))
+            else:
+                self.queue.put_nowait((filename, text))
+            return True
+        try:
+            self.queue.put_nowait((filename, text))
+            return True
+        except queue.Full:
+            with self.lock:
+                self.stats['dropped'] += 1
+            return False
+
+    def flush(self, timeout=None):
+        '''
+        Function that waits until every line queued so far has been written.
+        '''
+        if self.thread is None:
+            return
+        request = FlushRequest()
+        self.queue.put((None, request))
+        request.done.wait(timeout)
+
+    def close(self):
+        '''
+        Function that writes every queued line, stops the writer thread and
+        closes the log files. A later write starts a new writer thread.
+        '''
+        thread = self.thread
+        if thread is not None:
+            self.queue.put((None, STOP))
+            thread.join()
+        with self.lock:
+            for f in self.files.values():
+                f.close()
+            self.files = {}
+            self.thread = None
+
+    def write_pending(self):
+        for filename, texts in self.pending.items():
+            try:
+                f = self.files.get(filename)
+                if f is None:
+                    f = self.files[filename] = open(filename, 'a')
+                f.write(''.join(texts))
+                f.flush()
+            except (IOError, OSError) as e: # keep draining the queue, reopen the file next time
+                print('Dropped ' + str(len(texts)) + ' log lines for ' + filename + ': ' + str(e))
+                self.discard_file(filename)
+                with self.lock:
+                    self.stats['dropped'] += len(texts)
+                continue
+            with self.lock:
+                self.stats['written'] += len(texts)
+        if self.pending:
+            with self.lock:
+                self.stats['flushes'] += 1
+        self.pending = {}
+        self.pending_bytes = 0
+
+    def discard_file(self, filename):
+        f = self.files.pop(filename, None)
+        if f is not None:
+            try:
+                f.close()
+            except (IOError, OSError): # its buffered lines can't be written either
+                pass
+
+    def run(self):
+        last_flush = time.time()
+        while True:
+            timeout = max(0.0, self.flush_interval - (time.time() - last_flush))
+            try:
+                filename, text = self.queue.get(timeout=timeout if self.pending else None)
+            except queue.Empty:
+                filename = text = None
+            if text is STOP:
+                self.write_pending()
+                return
+            if isinstance(text, FlushRequest):
+                self.write_pending()
+                last_flush = time.time()
+                text.done.set()
+                continue
+            if filename is not None:
+                self.pending.setdefault(filename, []).append(text)
+                self.pending_bytes += len(text)
+            if self.pending_bytes >= self.flush_bytes or \
+                    time.time() - last_flush >= self.flush_interval:
+                self.write_pending()
+                last_flush = time.time()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['queued'] = self.queue.qsize()
+        return stats
@@ -0,0 +1,350 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: metrics.py
+Description: Runtime metrics of the server programs, served in the Prometheus
+             text format over HTTP on a local admin port (--metrics-port). Every
+             server records how long its requests take from receipt to response,
+             counts its responses per response code and reports its thread count;
+             the programs add the round trips to the root and .com, .org, .gov
+             servers, cache counters and active connections.
+
+             Counters and latency histograms are updated without locks: every
+             thread adds to a shard of its own, held in thread-local storage,
+             and the shards are only added together when the endpoint is
+             scraped. When a thread ends its shard is added to the totals of
+             the ended threads and dropped, so the default local server's thread
+             per client or framed request doesn't leave a shard behind.
+'''
+
+import time
+import bisect
+import weakref
+import threading
+try:
+    import thread
+except ImportError: # Python 3
+    import _thread as thread
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError: # Python 3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+import batch
+import profiler
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+           10.0) # upper bounds of the latency histogram buckets in seconds
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+REQUEST_SECONDS = 'dns_request_seconds'
+UPSTREAM_SECONDS = 'dns_upstream_seconds'
+RESPONSES = 'dns_responses_total'
+SLOW_QUERIES = 'dns_slow_queries_total'
+
+class Shard(object):
+    '''
+    The counters and histograms recorded by one thread. Counters map a
+    (name, label value) key to a number; histograms map it to a list of the
+    bucket counts, the count above the last bucket and the sum of the values.
+    '''
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def merge_into(self, counters, histograms):
+        for key, value in dict(self.counters).items():
+            counters[key] = counters.get(key, 0) + value
+        for key, values in dict(self.histograms).items():
+            values = list(values)
+            total = histograms.get(key)
+            if total is None:
+                histograms[key] = values
+            else:
+                for i in range(len(values)):
+                    total[i] += values[i]
+
+class ShardOwner(object):
+    '''
+    Object held only by a thread's local storage, which is cleared when the
+    thread ends; a weak reference to it tells the registry the thread ended.
+    '''
+    __slots__ = ('__weakref__',)
+
+class Metrics(object):
+    '''
+    Registry of the metrics of a server process. Metrics are declared with
+    describe() (updated through inc() and observe()) or collect() (read from a
+    function when scraped), and render() returns all of them in the
+    Prometheus text format.
+    '''
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.local = threading.local() # the Shard and ShardOwner of the running thread
+        self.shards = {} # weak reference to a running thread's ShardOwner -> Shard of the thread
+        self.retired = Shard() # counters and histograms of the threads that ended
+        self.metrics = [] # (name, kind, help, label name, function or None) in declaration order
+
+    def describe(self, name, kind, help, label=None):
+        self.metrics = [m for m in self.metrics if m[0] != name] + [(name, kind, help, label, None)]
+
+    def collect(self, name, kind, help, fn, label=None):
+        '''
+        Function that declares a metric read by calling fn when scraped. fn
+        returns a number, or a dict mapping label values to numbers.
+        '''
+        self.metrics = [m for m in self.metrics if m[0] != name] + [(name, kind, help, label, fn)]
+
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = Shard()
+            owner = self.local.owner = ShardOwner()
+            with self.lock:
+                self.shards[weakref.ref(owner, self.retire)] = shard
+        return shard
+
+    def retire(self, owner_ref):
+        '''
+        Function called when the thread owning a shard ended: the shard is
+        added to the retired totals and dropped.
+        '''
+        with self.lock:
+            shard = self.shards.pop(owner_ref, None)
+            if shard is not None:
+                shard.merge_into(self.retired.counters, self.retired.histograms)
+
+    def inc(self, name, value='', amount=1):
+        counters = self.shard().counters
+        key = (name, value)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, value=''):
+        histograms = self.shard().histograms
+        key = (name, value)
+        values = histograms.get(key)
+        if values is None:
+            values = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        values[bisect.bisect_left(self.buckets, seconds)] += 1
+        values[-1] += seconds
+
+    def totals(self):
+        '''
+        Function that returns the counters and histograms of every thread added
+        together.
+        '''
+        counters = {}
+        histograms = {}
+        with self.lock:
+            self.retired.merge_into(counters, histograms)
+            shards = list(self.shards.values())
+        for shard in shards:
+            shard.merge_into(counters, histograms)
+        return counters, histograms
+
+    def render(self):
+        '''
+        Function that returns every metric in the Prometheus text format.
+        '''
+        counters, histograms = self.totals()
+        lines = []
+        for name, kind, help, label, fn in self.metrics:
+            lines.append('# HELP ' + name + ' ' + help)
+            lines.append('# TYPE ' + name + ' ' + kind)
+            def labels(value, extra=''):
+                pairs = ([label + '="' + str(value) + '"'] if label else []) + ([extra] if extra else [])
+                return '{' + ','.join(pairs) + '}' if pairs else ''
+            if fn is not None:
+                try:
+                    values = fn()
+                except Exception as e: # a failing collector must not break the others
+                    lines.append('# ' + name + ' unavailable: ' + str(e))
+                    continue
+                if not isinstance(values, dict):
+                    values = {'': values}
+                for value in sorted(values):
+                    lines.append(name + labels(value) + ' ' + format_number(values[value]))
+            elif kind == 'histogram':
+                for (metric, value), values in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    count = 0
+                    for bound, bucket in zip(self.buckets + ('+Inf',), values):
+                        count += bucket
+                        lines.append(name + '_bucket' + labels(value, 'le="' + str(bound) + '"') +
+                                     ' ' + str(count))
+                    lines.append(name + '_sum' + labels(value) + ' ' + format_number(values[-1]))
+                    lines.append(name + '_count' + labels(value) + ' ' + str(count))
+            else:
+                for (metric, value), count in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(name + labels(value) + ' ' + format_number(count))
+        return '\n'.join(lines) + '\n'
+
+def format_number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def thread_count():
+    '''
+    Function that returns the number of threads of the process, including
+    those started with thread.start_new_thread.
+    '''
+    if hasattr(thread, '_count'):
+        return thread._count() + 1 # plus the main thread
+    return threading.active_count()
+
+registry = Metrics() # metrics of this process
+registry.describe(REQUEST_SECONDS, 'histogram',
+                  'Seconds from receiving a request to having its response')
+registry.describe(UPSTREAM_SECONDS, 'histogram',
+                  'Round trip of requests sent to the root and DNS servers', 'hop')
+registry.describe(RESPONSES, 'counter', 'Responses sent, by response code', 'code')
+registry.describe(SLOW_QUERIES, 'counter',
+                  'Requests written to the slow-query log (tracing.py)')
+registry.collect('dns_threads', 'gauge', 'Threads of the process', thread_count)
+
+def inc(name, value='', amount=1):
+    registry.inc(name, value, amount)
+
+def observe(name, seconds, value=''):
+    registry.observe(name, seconds, value)
+
+def observe_upstream(hop, started):
+    '''
+    Function that records the round trip of a request to the root ('root') or
+    a .com, .org, .gov server ('tld') that was sent at time started.
+    '''
+    registry.observe(UPSTREAM_SECONDS, time.time() - started, hop)
+
+def record_response(response, started):
+    '''
+    Function that records the latency of a request received at time started
+    and the response code of its response, or of every response of a batch.
+    Replies to control messages (reload, ping, ...) aren't recorded.
+    '''
+    if batch.is_batch(response):
+        for line in batch.decode_response(response)[1]:
+            registry.inc(RESPONSES, line[:4])
+    elif response.startswith('0x'):
+        registry.inc(RESPONSES, response[:4])
+    else:
+        return
+    registry.observe(REQUEST_SECONDS, time.time() - started)
+
+def collect_cache(prefix, get_stats):
+    '''
+    Function that exposes the hit, miss, eviction, expiration, invalidation and
+    refresh counters and the size of a resolver cache under the given prefix.
+    '''
+    registry.collect(prefix + '_operations_total', 'counter', 'Cache operations, by result',
+                     lambda: dict((result, count) for result, count in get_stats().items()
+                                  if result not in ('entries', 'bytes')), 'result')
+    registry.collect(prefix + '_entries', 'gauge', 'Entries in the cache',
+                     lambda: get_stats()['entries'])
+
+def collect_admission(get_stats):
+    '''
+    Function that exposes the admission control counters (admission.py): the
+    requests answered busy by reason, the requests over the rate limit by the
+    key that was over it, and the cache misses being resolved upstream.
+    '''
+    def counts(prefix):
+        return lambda: dict((key[len(prefix):], count) for key, count in get_stats().items()
+                            if key.startswith(prefix))
+    registry.collect('dns_shed_total', 'counter',
+                     'Requests answered busy because a limit was reached, by limit',
+                     counts('shed_'), 'limit')
+    registry.collect('dns_throttled_total', 'counter',
+                     'Requests answered busy because of the rate limit, by key',
+                     counts('throttled_'), 'key')
+    registry.collect('dns_upstream_outstanding', 'gauge', 'Cache misses being resolved upstream',
+                     lambda: get_stats()['upstream'])
+
+def collect_pool(get_stats):
+    '''
+    Function that exposes the requests of an upstream connection pool that ran
+    out of time, were hedged, or were answered first by their hedge
+    (deadlines.py).
+    '''
+    registry.collect('dns_upstream_requests_total', 'counter',
+                     'Upstream requests that timed out or were hedged, by outcome',
+                     lambda: dict((outcome, get_stats()[outcome])
+                                  for outcome in ('timeouts', 'hedged', 'hedge_wins')),
+                     'outcome')
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    '''
+    Answers GET /metrics with the metrics of the process and GET
+    /profile?seconds=N with a profile of it (profiler.py).
+    '''
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        if path == '/profile':
+            self.send_profile(query)
+            return
+        if path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        self.send_text(registry.render(), CONTENT_TYPE)
+
+    def send_profile(self, query):
+        seconds = profiler.DEFAULT_PROFILE_SECONDS
+        for pair in query.split('&'):
+            name, _, value = pair.partition('=')
+            if name == 'seconds':
+                try:
+                    seconds = float(value)
+                except ValueError:
+                    self.send_error(400, 'seconds must be a number')
+                    return
+        if not 0 < seconds <= profiler.MAX_PROFILE_SECONDS:
+            self.send_error(400, 'seconds must be above 0 and at most ' +
+                            str(profiler.MAX_PROFILE_SECONDS))
+            return
+        text = profiler.report(seconds)
+        if text is None:
+            self.send_error(409, 'A profile is already being taken')
+            return
+        self.send_text(text, 'text/plain; charset=utf-8')
+
+    def send_text(self, text, content_type):
+        body = text.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # scrapes aren't worth a line each
+        pass
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    '''
+    HTTP server answering every request in a thread of its own, so scrapes are
+    answered while a profile is taken.
+    '''
+    daemon_threads = True
+
+def serve_http(port, workers=None):
+    '''
+    Function that serves the metrics endpoint on 127.0.0.1:port from a
+    background thread, unless port is 0. Worker n of a --workers server serves
+    its own metrics on port + n.
+    '''
+    if not port:
+        return None
+    if workers is not None and workers.number is not None:
+        port += workers.number
+    httpd = MetricsServer(('127.0.0.1', port), MetricsHandler)
+    t = threading.Thread(target=httpd.serve_forever)
+    t.daemon = True
+    t.start()
+    print('Metrics served on http://127.0.0.1:' + str(port) + '/metrics')
+    return httpd
@@ -0,0 +1,148 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: profiler.py
+Description: On-demand sampling profiler of a running server program. Sending the
+             process SIGUSR1 (kill -USR1 <pid>) samples the stack of every
+             thread for --profile-seconds and writes the report to
+             <server_id>_profile_<time>_<pid>.txt; GET /profile?seconds=N on the
+             metrics port returns the same report. The report starts with the
+             stack of every thread when the profile began, then lists the
+             functions the samples were taken in and the sampled stacks in the
+             collapsed format of flame graph tools.
+
+             Stacks are sampled rather than run under cProfile, which only sees
+             the thread that enables it, while a server spends its time in many.
+'''
+
+import os
+import sys
+import time
+import signal
+import threading
+import traceback
+
+DEFAULT_PROFILE_SECONDS = 5 # length of a profile started by SIGUSR1
+MAX_PROFILE_SECONDS = 60 # longest profile the metrics endpoint takes
+SAMPLE_INTERVAL = 0.005 # seconds between stack samples
+TOP_FUNCTIONS = 30 # functions listed in a report
+
+server_id = '' # id of the server, naming its report files
+running = threading.Lock() # held while a profile is taken, so they don't overlap
+
+def thread_stacks():
+    '''
+    Function that returns the current stack of every thread but the calling
+    one, most recent call last.
+    '''
+    me = threading.current_thread().ident
+    names = dict((t.ident, t.name) for t in threading.enumerate())
+    lines = []
+    for ident, frame in sys._current_frames().items():
+        if ident == me:
+            continue
+        lines.append('Thread ' + str(ident) + ' (' + names.get(ident, 'unnamed') + '):')
+        lines.extend(line.rstrip('\n') for line in traceback.format_stack(frame))
+    return '\n'.join(lines)
+
+def stack_of(frame):
+    '''
+    Function that returns the functions of a stack, outermost first, each as
+    file:function.
+    '''
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(os.path.basename(code.co_filename) + ':' + code.co_name)
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+def sample(seconds, interval=SAMPLE_INTERVAL):
+    '''
+    Function that samples the stacks of the other threads every interval
+    seconds for the given seconds and returns how often every stack was seen
+    and the number of samples taken.
+    '''
+    me = threading.current_thread().ident
+    stacks = {}
+    samples = 0
+    ends = time.time() + seconds
+    while time.time() < ends:
+        for ident, frame in sys._current_frames().items():
+            if ident != me:
+                stack = stack_of(frame)
+                stacks[stack] = stacks.get(stack, 0) + 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+def report(seconds):
+    '''
+    Function that profiles the process for the given seconds and returns the
+    report, or None if another profile is being taken.
+    '''
+    if not running.acquire(False):
+        return None
+    try:
+        started = time.time()
+        threads = thread_stacks()
+        stacks, samples = sample(seconds)
+    finally:
+        running.release()
+    own = {}       # function -> samples taken in it
+    inclusive = {} # function -> samples taken in it or a function it called
+    for stack, count in stacks.items():
+        own[stack[-1]] = own.get(stack[-1], 0) + count
+        for function in set(stack):
+            inclusive[function] = inclusive.get(function, 0) + count
+    total = float(sum(stacks.values())) or 1.0
+    lines = ['Profile of ' + server_id + ' started ' + time.ctime(started) + ': ' +
+             str(samples) + ' samples over ' + str(seconds) + 's, every ' +
+             str(int(SAMPLE_INTERVAL * 1000)) + 'ms', '',
+             'Threads when the profile started:', threads, '',
+             'Functions by thread samples taken in them:',
+             '%8s %8s  %s' % ('own %', 'total %', 'function')]
+    for function in sorted(own, key=own.get, reverse=True)[:TOP_FUNCTIONS]:
+        lines.append('%8.1f %8.1f  %s' % (own[function] * 100 / total,
+                                          inclusive[function] * 100 / total, function))
+    lines.extend(['', 'Collapsed stacks:'])
+    for stack in sorted(stacks, key=stacks.get, reverse=True):
+        lines.append(';'.join(stack) + ' ' + str(stacks[stack]))
+    return '\n'.join(lines) + '\n'
+
+def dump(seconds):
+    '''
+    Function that profiles the process and writes the report to a file of its
+    own.
+    '''
+    text = report(seconds)
+    if text is None:
+        print('A profile is already being taken')
+        return
+    filename = (server_id + '_profile_' + time.strftime('%Y%m%d-%H%M%S') + '_' +
+                str(os.getpid()) + '.txt')
+    f = open(filename, 'w')
+    try:
+        f.write(text)
+    finally:
+        f.close()
+    print('Profile written to ' + filename)
+
+def install(sid, seconds=DEFAULT_PROFILE_SECONDS):
+    '''
+    Function that makes SIGUSR1 start a profile of the given seconds in a
+    background thread. Must be called from the main thread; worker processes
+    forked afterwards inherit the handler.
+    '''
+    global server_id
+    server_id = sid
+    if not hasattr(signal, 'SIGUSR1'): # Windows
+        return
+    def start(signum, frame):
+        t = threading.Thread(target=dump, args=(seconds,))
+        t.daemon = True
+        t.start()
+    signal.signal(signal.SIGUSR1, start)
+    signal.siginterrupt(signal.SIGUSR1, False) # restart the system calls it interrupts
@@ -0,0 +1,90 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: query.py
+Description: Parsed form of a 'id, hostname, mode' query. A request is split once
+             when it is received, and the Query, with its hostname already
+             normalized, is what the servers pass on to validation, the cache
+             and the messages forwarded to other servers, instead of every step
+             splitting and lowercasing the message again.
+'''
+
+VALID_MODES = ('i', 'r')
+VALID_DOMAINS = ('com', 'gov', 'org')
+
+class Query(object):
+    '''
+    A single query. hostname and mode are kept as the client sent them, for
+    the messages forwarded to other servers; name is the lowercased hostname
+    (the cache key) and domain the lowercased top-level domain. Only what every
+    server needs is worked out when the query is parsed. deadline is the
+    deadlines.Deadline the query must be answered by, or None.
+    '''
+    __slots__ = ('sender_id', 'hostname', 'mode', 'name', 'domain', 'iterative', 'valid',
+                 'deadline')
+
+    def __init__(self, sender_id, hostname, mode, well_formed=True, deadline=None):
+        self.sender_id = sender_id
+        self.hostname = hostname
+        self.mode = mode
+        name = self.name = hostname.lower()
+        domain = self.domain = name[name.rfind('.') + 1:]
+        mode_key = mode.lower()
+        self.iterative = mode_key == 'i'
+        self.valid = well_formed and mode_key in VALID_MODES and domain in VALID_DOMAINS
+        self.deadline = deadline
+
+    def message(self, sender_id):
+        '''
+        Function that returns the query message sent on by server sender_id.
+        '''
+        return sender_id + ', ' + self.hostname + ', ' + self.mode
+
+    def zone_name(self):
+        '''
+        Function that returns the name a .com, .org, .gov server looks up: the
+        lowercased hostname without 'www'.
+        '''
+        name = self.name
+        return name[4:] if name[:4] == 'www.' or name == 'www' else name
+
+def parse(msg, deadline=None):
+    '''
+    Function that returns the Query of a 'id, hostname, mode' message. A
+    message without exactly three fields gives an invalid Query.
+    '''
+    fields = msg.split(", ")
+    if len(fields) != 3:
+        return Query('', msg, '', False, deadline)
+    return Query(fields[0], fields[1], fields[2], True, deadline)
+
+def parse_batch(sender_id, entries, deadline=None):
+    '''
+    Function that returns the Queries of the (hostname, mode) entries of a
+    batch request, which share the batch's deadline.
+    '''
+    return [Query(sender_id, hostname, mode, True, deadline) for hostname, mode in entries]
+
+def entries(queries):
+    '''
+    Function that returns the (hostname, mode) entries of a list of Queries,
+    as a batch request lists them.
+    '''
+    return [(q.hostname, q.mode) for q in queries]
+
+def zone_name(hostname):
+    '''
+    Function that returns hostname lowercased and without 'www', the way the
+    .com, .org, .gov servers store and look up names.
+    '''
+    name = hostname.lower()
+    return name[4:] if name[:4] == 'www.' or name == 'www' else name
+
+def zone_names(hostnames):
+    '''
+    Function that returns the zone_name of every hostname of a list, for
+    batches and zone files, without a function call per name.
+    '''
+    names = [hostname.lower() for hostname in hostnames]
+    return [name[4:] if name[:4] == 'www.' or name == 'www' else name for name in names]
@@ -0,0 +1,155 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: query_bench.py
+Description: Microbenchmark of the CPU time spent parsing and normalizing a
+             query along the default local -> root -> .com, .org, .gov path.
+             'split' runs the string handling every step used to do on the
+             message (the functions are kept below as they were), 'query' parses
+             the message once into a query.Query and uses its fields. The
+             normalization of zone file hostnames is measured the same way, one
+             call per name against the batched query.zone_names.
+'''
+
+import sys
+import time
+import random
+import argparse
+import query
+
+WORDS = ['mail', 'shop', 'cdn', 'api', 'static', 'news', 'blog', 'dev', 'app', 'img']
+DOMAINS = ['com', 'org', 'gov', 'COM', 'net']
+
+# The string handling of a query before query.py, one function per step.
+
+def invalid_message(client_msg):
+    client_msg_arr = client_msg.split(", ")
+    if len(client_msg_arr) != 3:
+        return True
+    request = client_msg_arr[2]
+    domain = client_msg_arr[1].split(".")
+    domain = domain[len(domain) - 1]
+    return (request.lower() not in ['i', 'r']) or (domain.lower() not in ['com', 'gov', 'org'])
+
+def cache_key(client_msg):
+    return client_msg.split(", ")[1].lower()
+
+def flight_key(client_msg):
+    client_msg_arr = client_msg.split(", ")
+    return (client_msg_arr[1].lower(), client_msg_arr[2].lower())
+
+def format_message(msg, server_id):
+    msg_arr = msg.split(", ")
+    return server_id + ', ' + msg_arr[1] + ', ' + msg_arr[2]
+
+def referral_domain(client_msg):
+    client_msg_arr = client_msg.split(", ")
+    if client_msg_arr[2].lower() != 'i':
+        return None
+    return client_msg_arr[1].split(".")[-1].lower()
+
+def is_iterative(client_msg):
+    return client_msg.split(", ")[2].lower() == 'i'
+
+def root_domain(client_msg):
+    client_msg_arr = client_msg.split(", ")
+    hostname = client_msg_arr[1].split(".")
+    return hostname[len(hostname) - 1].lower(), client_msg_arr[2].lower() == 'i'
+
+def format_hostname(hostname):
+    labels = hostname.lower().split(".")
+    if labels[0] == 'www':
+        del labels[0]
+    return '.'.join(labels)
+
+def split_path(msg):
+    '''
+    Function that handles a query message the way the servers did: validated,
+    looked up in the cache, coalesced, forwarded to the root server, referred
+    to a DNS server and looked up there. What every step worked out is
+    returned.
+    '''
+    if invalid_message(msg):
+        return None
+    name = cache_key(msg)
+    key = flight_key(msg)
+    server_msg = format_message(msg, 'default_local')
+    domain = referral_domain(server_msg)
+    iterative = is_iterative(server_msg)
+    root = root_domain(format_message(server_msg, 'ROOT'))
+    tld_msg = format_message(server_msg, 'com')
+    cache_key(server_msg) # cache_mapping
+    return (name, key[0], iterative, server_msg, domain, root,
+            format_hostname(tld_msg.split(", ")[1]))
+
+def query_path(msg):
+    '''
+    Function that handles a query message the way the servers do now, parsing
+    it once in every server.
+    '''
+    q = query.parse(msg)
+    if not q.valid:
+        return None
+    server_msg = q.message('default_local')
+    root_q = query.parse(q.message('ROOT'))
+    tld_q = query.parse(q.message('com'))
+    return (q.name, q.name, q.iterative, server_msg, q.domain if q.iterative else None,
+            (root_q.domain, root_q.iterative), tld_q.zone_name())
+
+def make_messages(count, seed):
+    '''
+    Function that returns count query messages with mixed case names, 'www'
+    prefixes, both modes and a few invalid domains.
+    '''
+    rand = random.Random(seed)
+    msgs = []
+    for i in range(count):
+        hostname = WORDS[i % len(WORDS)] + str(i) + '.example.' + rand.choice(DOMAINS)
+        if rand.random() < 0.5:
+            hostname = 'www.' + hostname
+        if rand.random() < 0.2:
+            hostname = hostname.upper()
+        msgs.append('PC' + str(i % 10) + ', ' + hostname + ', ' + rand.choice('IiRr'))
+    return msgs
+
+def measure(fn, items, repeat):
+    '''
+    Function that returns the best time over repeat runs of fn over items, in
+    microseconds per item.
+    '''
+    best = None
+    for r in range(repeat):
+        start = time.time()
+        fn(items)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e6 / len(items)
+
+def main():
+    parser = argparse.ArgumentParser(description='Query parsing microbenchmark')
+    parser.add_argument('--queries', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    msgs = make_messages(args.queries, args.seed)
+    for msg in msgs: # both paths must agree before they are timed
+        if split_path(msg) != query_path(msg):
+            raise SystemExit('paths disagree on ' + repr(msg))
+    split_us = measure(lambda items: [split_path(msg) for msg in items], msgs, args.repeat)
+    query_us = measure(lambda items: [query_path(msg) for msg in items], msgs, args.repeat)
+    print('%-22s split %6.2f us  query %6.2f us  (%.2fx)' %
+          ('per query path', split_us, query_us, split_us / query_us))
+
+    hostnames = [msg.split(", ")[1] for msg in msgs]
+    if [format_hostname(h) for h in hostnames] != query.zone_names(hostnames):
+        raise SystemExit('zone name normalizations disagree')
+    single_us = measure(lambda items: [format_hostname(h) for h in items], hostnames, args.repeat)
+    batch_us = measure(query.zone_names, hostnames, args.repeat)
+    print('%-22s split %6.2f us  query %6.2f us  (%.2fx)' %
+          ('per zone file name', single_us, batch_us, single_us / batch_us))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
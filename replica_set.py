@@ -0,0 +1,363 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: replica_set.py
+Description: Replicas of the .com, .org and .gov DNS servers. server.dat may list
+             several servers for a domain (one 'domain ip port' line each), and
+             the root and default local DNS servers spread their requests over
+             them: to the replica with the fewest outstanding requests, or the
+             one whose recent latency (weighted by its outstanding requests) is
+             lowest. A replica that fails several requests in a row has its
+             circuit opened and gets no requests until a health probe or a
+             trial request succeeds, and a failed request is retried on another
+             replica.
+
+             A domain too large for one server is split into shards (a fourth
+             'shard' column in server.dat, shard_ring.py): each hostname is
+             routed to the replicas of the shard owning it on the domain's
+             consistent hash ring.
+'''
+
+import time
+import socket
+import threading
+import deadlines
+import framing
+import shard_ring
+
+PROBE_MESSAGE = 'ping' # health probe every DNS server answers with PROBE_REPLY
+PROBE_REPLY = 'pong'
+POLICIES = ['least-outstanding', 'latency']
+DEFAULT_PROBE_INTERVAL = 0 # seconds between health probes of every replica (0: none)
+DEFAULT_FAILURE_THRESHOLD = 3 # consecutive failures that open a replica's circuit
+DEFAULT_OPEN_SECONDS = 5.0 # seconds an open circuit waits before a trial request
+PROBE_TIMEOUT = 1.0 # seconds a health probe waits for its reply
+EWMA_WEIGHT = 0.3 # weight of the newest latency sample in a replica's average
+
+class Replica(object):
+    '''
+    One DNS server of a domain and what is known about its health.
+    '''
+
+    def __init__(self, addr):
+        self.addr = addr
+        self.outstanding = 0 # requests sent and not answered yet
+        self.latency = 0.0   # moving average of the response time in seconds
+        self.failures = 0    # consecutive failed requests and probes
+        self.opened_at = None # time the circuit was opened, None while closed
+        self.trial = False   # a trial request of a half-open circuit is running
+        self.stats = {'requests': 0, 'failures': 0, 'opened': 0}
+
+    def available(self, now, open_seconds):
+        '''
+        Function that returns True if a request may be sent to the replica: its
+        circuit is closed, or has been open long enough for one trial request.
+        '''
+        if self.opened_at is None:
+            return True
+        return not self.trial and now - self.opened_at >= open_seconds
+
+class ReplicaSet(object):
+    '''
+    The replicas of one domain. Requests are sent through send(addr, msg),
+    normally a connection pool's request method.
+    '''
+
+    def __init__(self, domain, replicas, policy='least-outstanding',
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD, open_seconds=DEFAULT_OPEN_SECONDS,
+                 clock=time.time):
+        self.domain = domain
+        self.replicas = replicas
+        self.policy = policy
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+
+    def addrs(self):
+        return [replica.addr for replica in self.replicas]
+
+    def route(self, name):
+        '''
+        Function that returns the replica set serving the zone name (every
+        name, for a domain that isn't sharded).
+        '''
+        return self
+
+    def replica_sets(self):
+        return [self]
+
+    def find(self, addr):
+        for replica in self.replicas:
+            if replica.addr == addr:
+                return replica
+        return None
+
+    def score(self, replica):
+        if self.policy == 'latency':
+            return (replica.latency * (replica.outstanding + 1), replica.outstanding)
+        return (replica.outstanding, replica.latency)
+
+    def choose(self, exclude=(), prefer=None, count=True):
+        '''
+        Function that returns the replica the next request should go to and,
+        if count is set, counts the request as outstanding. prefer (e.g. the
+        replica the root server referred to) is taken when it is available. When
+        every circuit is open the request still goes to the replica opened
+        longest ago, rather than failing without trying. None is returned if
+        every replica is excluded.
+        '''
+        with self.lock:
+            now = self.clock()
+            candidates = [r for r in self.replicas if r.addr not in exclude]
+            if not candidates:
+                return None
+            available = [r for r in candidates if r.available(now, self.open_seconds)]
+            preferred = [r for r in available if r.addr == prefer]
+            if preferred:
+                replica = preferred[0]
+            elif available:
+                replica = min(available, key=self.score)
+            else:
+                replica = min(candidates, key=lambda r: r.opened_at)
+            if not count:
+                return replica
+            if replica.opened_at is not None:
+                replica.trial = True
+            replica.outstanding += 1
+            replica.stats['requests'] += 1
+            return replica
+
+    def finish(self, replica, started, ok):
+        '''
+        Function that records the outcome of a request that choose() sent to
+        replica at time started, closing or opening its circuit. ok is None
+        when the request ran out of time, which tells nothing about the replica.
+        '''
+        with self.lock:
+            replica.outstanding -= 1
+            if ok is None:
+                replica.trial = False
+            else:
+                self.record(replica, self.clock() - started, ok)
+
+    def hedge_sent(self, replica):
+        '''
+        Function that counts a hedged request sent to replica as outstanding,
+        so balancing sees the load hedges put on it, and returns the function
+        to call once that request is over.
+        '''
+        with self.lock:
+            replica.outstanding += 1
+            replica.stats['requests'] += 1
+        def done():
+            with self.lock:
+                replica.outstanding -= 1
+        return done
+
+    def record(self, replica, elapsed, ok):
+        '''
+        Function that updates a replica's health after a request or probe (whose
+        elapsed is None, since it pays for a new connection). The lock must be
+        held.
+        '''
+        replica.trial = False
+        if ok:
+            if elapsed is None:
+                pass
+            elif replica.latency:
+                replica.latency += EWMA_WEIGHT * (elapsed - replica.latency)
+            else:
+                replica.latency = elapsed
+            replica.failures = 0
+            replica.opened_at = None
+            return
+        replica.stats['failures'] += 1
+        replica.failures += 1
+        if replica.opened_at is not None or replica.failures >= self.failure_threshold:
+            if replica.opened_at is None:
+                replica.stats['opened'] += 1
+            replica.opened_at = self.clock()
+
+    def request(self, send, msg, prefer=None, deadline=None):
+        '''
+        Function that sends msg to a replica with send(addr, msg, deadline,
+        hedge_addr, on_hedge), normally a connection pool's request method, and
+        returns the response. A hedged request goes to the replica that would be
+        chosen next, or to the same one if there is no other, and is counted as
+        outstanding there while it runs (on_hedge). A failed request is retried
+        on every other replica before the last error is raised.
+        '''
+        tried = []
+        error = None
+        while True:
+            replica = self.choose(tried, prefer)
+            if replica is None:
+                raise socket.error('No replica of ' + self.domain + ' answered: ' + str(error))
+            tried.append(replica.addr)
+            hedge = self.choose(tried, count=False) or replica
+            started = self.clock()
+            try:
+                response = send(replica.addr, msg, deadline, hedge.addr,
+                                lambda hedge=hedge: self.hedge_sent(hedge))
+            except (socket.error, framing.FramingError) as e:
+                self.finish(replica, started, False)
+                error = e
+                continue
+            except deadlines.DeadlineExceeded:
+                self.finish(replica, started, None)
+                raise
+            self.finish(replica, started, True)
+            return response
+
+    def probe(self):
+        '''
+        Function that sends a health probe to every replica on a connection of
+        its own and records the outcome.
+        '''
+        for replica in self.replicas:
+            ok = probe_server(replica.addr)
+            with self.lock:
+                self.record(replica, None, ok)
+
+    def get_stats(self):
+        with self.lock:
+            return dict((str(r.addr[0]) + ':' + str(r.addr[1]),
+                         dict(r.stats, open=r.opened_at is not None,
+                              latency_ms=round(r.latency * 1000, 3)))
+                        for r in self.replicas)
+
+class ShardedReplicaSet(object):
+    '''
+    The shards of one domain, each a ReplicaSet named 'domain/shard', and the
+    hash ring (shard_ring.HashRing) routing zone names to them. Requests are
+    sent through the ReplicaSet returned by route(name).
+    '''
+
+    def __init__(self, domain, shards, vnodes=shard_ring.DEFAULT_VNODES):
+        self.domain = domain
+        self.shards = shards # shard name -> ReplicaSet
+        self.ring = shard_ring.HashRing(shards, vnodes)
+        self.replicas = [replica for name in self.ring.shards
+                         for replica in shards[name].replicas]
+
+    def addrs(self):
+        return [replica.addr for replica in self.replicas]
+
+    def find(self, addr):
+        for replicas in self.shards.values():
+            replica = replicas.find(addr)
+            if replica is not None:
+                return replica
+        return None
+
+    def route(self, name):
+        return self.shards[self.ring.owner(name)]
+
+    def replica_sets(self):
+        return [self.shards[name] for name in self.ring.shards]
+
+    def probe(self):
+        for replicas in self.replica_sets():
+            replicas.probe()
+
+    def get_stats(self):
+        stats = {}
+        for replicas in self.replica_sets():
+            stats.update(replicas.get_stats())
+        return stats
+
+def probe_server(addr, timeout=PROBE_TIMEOUT):
+    '''
+    Function that returns True if the DNS server at addr answers a health probe
+    within timeout seconds.
+    '''
+    try:
+        s = socket.create_connection(addr, timeout)
+    except socket.error:
+        return False
+    try:
+        return framing.request(s, framing.FrameReader(), 1, PROBE_MESSAGE) == PROBE_REPLY
+    except (socket.error, framing.FramingError):
+        return False
+    finally:
+        s.close()
+
+def read_servers_list(filename):
+    '''
+    Function that returns the replica addresses of every domain listed in a
+    server.dat file, as a dict of domain -> dict of shard name -> list of
+    (ip, port), in file order. Lines without a shard name ('domain ip port')
+    are listed under the shard name None.
+    '''
+    servers = {}
+    file = open(filename, "r");
+    try:
+        for line in file:
+            line = line.strip("\n").strip("\r").split(" ")
+            if len(line) >= 3:
+                shard = line[3] if len(line) >= 4 and line[3] else None
+                servers.setdefault(line[0], {}).setdefault(shard, []).append(
+                    (line[1].lower(), int(line[2])))
+    finally:
+        file.close()
+    return servers
+
+def build_replica_sets(filename, old=None, **settings):
+    '''
+    Function that returns a dict of domain -> ReplicaSet, or ShardedReplicaSet
+    for a sharded domain, for a server.dat file. Replicas already known in old
+    (the sets built before a reload) keep their health and latency. A domain
+    listed both with and without shard names is rejected with ValueError.
+    '''
+    known = {}
+    for replica_set in (old or {}).values():
+        for replica in replica_set.replicas:
+            known[replica.addr] = replica
+    def build(name, addrs):
+        return ReplicaSet(name, [known.get(addr) or Replica(addr) for addr in addrs], **settings)
+    replica_sets = {}
+    for domain, shards in read_servers_list(filename).items():
+        if list(shards) == [None]:
+            replica_sets[domain] = build(domain, shards[None])
+        elif None in shards:
+            raise ValueError(filename + ' lists ' + domain + ' both with and without shards')
+        else:
+            replica_sets[domain] = ShardedReplicaSet(
+                domain, dict((name, build(domain + '/' + name, addrs))
+                             for name, addrs in shards.items()))
+    return replica_sets
+
+def settings_from_args(args):
+    '''
+    Function that returns the ReplicaSet settings given on the command line
+    (server_engine.build_arg_parser with replicas=True).
+    '''
+    return {'policy': args.balance, 'failure_threshold': args.failure_threshold,
+            'open_seconds': args.open_seconds}
+
+def find_replica_set(replica_sets, addr):
+    '''
+    Function that returns the replica set addr belongs to (the shard's, for a
+    sharded domain), or None.
+    '''
+    for domain_set in replica_sets.values():
+        for replica_set in domain_set.replica_sets():
+            if replica_set.find(addr) is not None:
+                return replica_set
+    return None
+
+def probe_forever(get_replica_sets, interval=DEFAULT_PROBE_INTERVAL):
+    '''
+    Function that starts a thread probing every replica of the replica sets
+    returned by get_replica_sets() every interval seconds.
+    '''
+    def probe():
+        while True:
+            time.sleep(interval)
+            for replica_set in list(get_replica_sets().values()):
+                replica_set.probe()
+    t = threading.Thread(target=probe)
+    t.daemon = True
+    t.start()
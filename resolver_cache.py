@@ -0,0 +1,480 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: resolver_cache.py
+Description: Bounded cache of resolved queries used by the default local DNS
+             server. Entries expire after a time-to-live, the least recently used
+             entries are evicted once the entry or memory budget is exceeded and
+             'Host not found' answers are cached for a shorter time. Every entry
+             counts its hits, so that popular entries can be refreshed in the
+             background shortly before they expire (refresh ahead).
+
+             SharedResolverCache keeps its entries in shared memory so that the
+             worker processes of --workers mode share one cache.
+'''
+
+import mmap
+import time
+import zlib
+import struct
+import threading
+import multiprocessing
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 100000        # maximum number of cached hostnames
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024 # approximate memory budget for cached entries
+DEFAULT_TTL = 300                   # seconds a successful answer stays cached
+DEFAULT_NEGATIVE_TTL = 30           # seconds a 'Host not found' answer stays cached
+ENTRY_OVERHEAD = 200                # approximate bytes used by an entry besides its strings
+DEFAULT_SHARDS = 16                 # independently locked partitions of a sharded cache
+SLOT = struct.Struct('<IHHIBdd')     # hash, hostname length, response length, hits,
+                                    # refresh scheduled, expiry, last use
+MAX_HOSTNAME = 128                  # longest hostname a shared cache slot holds
+MAX_RESPONSE = 96                   # longest response a shared cache slot holds
+SLOT_SIZE = SLOT.size + MAX_HOSTNAME + MAX_RESPONSE
+WAYS = 8                            # slots a hostname may occupy in a shared cache
+SHARED_LOCKS = 64                   # locks striped over the buckets of a shared cache
+STAT_NAMES = ['hits', 'misses', 'evictions', 'expirations', 'invalidations', 'refreshes',
+              'entries']
+COUNTER = struct.Struct('<q')
+LOCKED = object() # returned by a get(blocking=False) that would wait for a lock
+
+def entry_size(hostname, ip, response):
+    '''
+    Function that returns the approximate number of bytes a cache entry uses.
+    '''
+    return len(hostname) + len(ip) + len(response) + ENTRY_OVERHEAD
+
+class ResolverCache(object):
+    '''
+    TTL-aware LRU cache mapping a lowercased hostname to [ip, response,
+    expiry time, size, hits, refresh scheduled]. The most recently used entries
+    are kept at the end of the ordered dictionary so eviction pops from the
+    front. 'Host not found' answers are never refreshed, so they start out
+    marked as scheduled.
+    '''
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL, clock=time.time):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.size = 0 # approximate bytes used by all entries
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0,
+                      'invalidations': 0, 'refreshes': 0}
+        self.refresh = None # called with a hostname due for a refresh
+        self.refresh_window = 0
+        self.refresh_hits = 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def refresh_ahead(self, window, min_hits, refresh):
+        '''
+        Function that makes the cache call refresh(hostname), once per entry,
+        when an entry that has been hit at least min_hits times is hit within
+        window seconds of its expiry.
+        '''
+        self.refresh_window = window
+        self.refresh_hits = min_hits
+        self.refresh = refresh
+
+    def __contains__(self, hostname):
+        return self.get(hostname, count=False) is not None
+
+    def remove(self, hostname):
+        entry = self.entries.pop(hostname)
+        self.size -= entry[3]
+        return entry
+
+    def get(self, hostname, count=True, blocking=True):
+        '''
+        Function that returns the cached response for hostname, or None if it
+        isn't cached or has expired. A hit marks the entry as recently used and
+        may schedule its refresh. Unless blocking is set, LOCKED is returned
+        instead of waiting for another thread holding the lock.
+        '''
+        due = False
+        if not self.lock.acquire(blocking):
+            return LOCKED
+        try:
+            now = self.clock()
+            entry = self.entries.get(hostname)
+            if entry is not None and entry[2] <= now:
+                self.remove(hostname)
+                self.stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                if count:
+                    self.stats['misses'] += 1
+                return None
+            # move entry to the most recently used end
+            del self.entries[hostname]
+            self.entries[hostname] = entry
+            if count:
+                self.stats['hits'] += 1
+                entry[4] += 1
+                due = (self.refresh is not None and not entry[5] and
+                       entry[4] >= self.refresh_hits and entry[2] - now <= self.refresh_window)
+                if due:
+                    entry[5] = True
+                    self.stats['refreshes'] += 1
+            response = entry[1]
+        finally:
+            self.lock.release()
+        if due:
+            self.refresh(hostname)
+        return response
+
+    def put(self, hostname, ip, response, negative=False, ttl=None):
+        '''
+        Function that caches the response for hostname. Negative answers are
+        kept for negative_ttl seconds instead of ttl, unless a ttl is given
+        (e.g. what is left of a restored entry's). True is returned if the
+        hostname wasn't already cached.
+        '''
+        if ttl is None:
+            ttl = self.negative_ttl if negative else self.ttl
+        if ttl <= 0:
+            return False
+        size = entry_size(hostname, ip, response)
+        with self.lock:
+            is_new = hostname not in self.entries
+            if not is_new:
+                self.remove(hostname)
+            self.entries[hostname] = [ip, response, self.clock() + ttl, size, 0, negative]
+            self.size += size
+            while self.entries and (len(self.entries) > self.max_entries
+                                    or self.size > self.max_bytes):
+                self.remove(next(iter(self.entries)))
+                self.stats['evictions'] += 1
+        return is_new
+
+    def discard(self, hostname):
+        '''
+        Function that drops hostname from the cache because its answer changed.
+        True is returned if it was cached.
+        '''
+        with self.lock:
+            if hostname not in self.entries:
+                return False
+            self.remove(hostname)
+            self.stats['invalidations'] += 1
+            return True
+
+    def discard_suffix(self, suffix):
+        '''
+        Function that drops every cached hostname ending with suffix and returns
+        how many were dropped.
+        '''
+        with self.lock:
+            hostnames = [hostname for hostname in self.entries if hostname.endswith(suffix)]
+            for hostname in hostnames:
+                self.remove(hostname)
+            self.stats['invalidations'] += len(hostnames)
+        return len(hostnames)
+
+    def export(self):
+        '''
+        Function that returns a (hostname, response, expiry time) tuple for
+        every entry that hasn't expired, least recently used first.
+        '''
+        with self.lock:
+            now = self.clock()
+            return [(hostname, entry[1], entry[2]) for hostname, entry in self.entries.items()
+                    if entry[2] > now]
+
+    def get_stats(self):
+        '''
+        Function that returns a snapshot of the hit, miss, eviction, expiration
+        and invalidation counters along with the current size of the cache.
+        '''
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.entries)
+            stats['bytes'] = self.size
+        return stats
+
+class ShardedResolverCache(object):
+    '''
+    Resolver cache split into independently locked ResolverCache shards chosen
+    by the hash of the hostname, so client threads looking up different
+    hostnames rarely wait on the same lock. The entry and memory budgets are
+    divided evenly between the shards.
+    '''
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL, shards=DEFAULT_SHARDS,
+                 clock=time.time):
+        shards = max(1, shards)
+        self.shards = [ResolverCache(max(1, max_entries // shards), max(1, max_bytes // shards),
+                                     ttl, negative_ttl, clock)
+                       for i in range(shards)]
+
+    def shard(self, hostname):
+        return self.shards[hash(hostname) % len(self.shards)]
+
+    def refresh_ahead(self, window, min_hits, refresh):
+        for shard in self.shards:
+            shard.refresh_ahead(window, min_hits, refresh)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def __contains__(self, hostname):
+        return hostname in self.shard(hostname)
+
+    def get(self, hostname, count=True, blocking=True):
+        return self.shard(hostname).get(hostname, count, blocking)
+
+    def put(self, hostname, ip, response, negative=False, ttl=None):
+        return self.shard(hostname).put(hostname, ip, response, negative, ttl)
+
+    def discard(self, hostname):
+        return self.shard(hostname).discard(hostname)
+
+    def discard_suffix(self, suffix):
+        return sum(shard.discard_suffix(suffix) for shard in self.shards)
+
+    def export(self):
+        entries = []
+        for shard in self.shards:
+            entries.extend(shard.export())
+        return entries
+
+    def get_stats(self):
+        '''
+        Function that returns the counters of every shard added together.
+        '''
+        stats = {}
+        for shard in self.shards:
+            for key, value in shard.get_stats().items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+class SharedResolverCache(object):
+    '''
+    Resolver cache held in an anonymous shared memory map, so that processes
+    forked after it is created all see the same entries. The map is an array of
+    fixed size slots grouped into buckets of WAYS slots; a hostname lives in
+    the bucket its hash selects, and when the bucket is full the expired or
+    else least recently used slot is reused. Buckets are guarded by striped
+    process-shared locks, and the counters live in shared memory too. Hostnames
+    and responses that don't fit in a slot aren't cached.
+    '''
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL, clock=time.time,
+                 context=multiprocessing):
+        entries = max(WAYS, min(max_entries, max_bytes // SLOT_SIZE))
+        self.buckets = entries // WAYS
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.map = mmap.mmap(-1, self.buckets * WAYS * SLOT_SIZE)
+        self.locks = [context.Lock() for i in range(min(SHARED_LOCKS, self.buckets))]
+        self.counters = mmap.mmap(-1, len(self.locks) * len(STAT_NAMES) * COUNTER.size)
+        self.refresh = None # called with a hostname due for a refresh
+        self.refresh_window = 0
+        self.refresh_hits = 1
+
+    def __len__(self):
+        return self.get_stats()['entries']
+
+    def refresh_ahead(self, window, min_hits, refresh):
+        '''
+        Function that makes the cache call refresh(hostname), as
+        ResolverCache.refresh_ahead does. The entry's hits and whether its
+        refresh was scheduled are shared, so only one process refreshes it.
+        '''
+        self.refresh_window = window
+        self.refresh_hits = min_hits
+        self.refresh = refresh
+
+    def __contains__(self, hostname):
+        return self.get(hostname, count=False) is not None
+
+    def count(self, stripe, name, amount=1):
+        '''
+        Function that adds amount to a counter of a stripe whose lock is held.
+        '''
+        offset = (stripe * len(STAT_NAMES) + STAT_NAMES.index(name)) * COUNTER.size
+        COUNTER.pack_into(self.counters, offset, COUNTER.unpack_from(self.counters, offset)[0] + amount)
+
+    def locate(self, hostname):
+        '''
+        Function that returns the encoded hostname, its hash, the offset of its
+        bucket and the stripe guarding the bucket.
+        '''
+        key = hostname.encode('utf-8')
+        h = zlib.crc32(key) & 0xFFFFFFFF
+        bucket = h % self.buckets
+        return key, h, bucket * WAYS * SLOT_SIZE, bucket % len(self.locks)
+
+    def find(self, key, h, start):
+        '''
+        Function that returns the offset of the slot holding key in the bucket
+        starting at start, or -1.
+        '''
+        for offset in range(start, start + WAYS * SLOT_SIZE, SLOT_SIZE):
+            slot_hash, key_len, value_len, hits, scheduled, expiry, used = \
+                SLOT.unpack_from(self.map, offset)
+            if key_len == len(key) and slot_hash == h and \
+                    self.map[offset + SLOT.size:offset + SLOT.size + key_len] == key:
+                return offset
+        return -1
+
+    def clear(self, offset, stripe):
+        SLOT.pack_into(self.map, offset, 0, 0, 0, 0, 0, 0.0, 0.0)
+        self.count(stripe, 'entries', -1)
+
+    def get(self, hostname, count=True, blocking=True):
+        '''
+        Function that returns the cached response for hostname, or None if it
+        isn't cached or has expired. Unless blocking is set, LOCKED is returned
+        instead of waiting for another thread or process holding the lock.
+        '''
+        key, h, start, stripe = self.locate(hostname)
+        due = False
+        if not self.locks[stripe].acquire(blocking):
+            return LOCKED
+        try:
+            offset = self.find(key, h, start)
+            response = None
+            if offset >= 0:
+                slot_hash, key_len, value_len, hits, scheduled, expiry, used = \
+                    SLOT.unpack_from(self.map, offset)
+                now = self.clock()
+                if expiry <= now:
+                    self.clear(offset, stripe)
+                    self.count(stripe, 'expirations')
+                else:
+                    if count:
+                        hits += 1
+                        due = (self.refresh is not None and not scheduled and
+                               hits >= self.refresh_hits and expiry - now <= self.refresh_window)
+                        if due:
+                            scheduled = 1
+                            self.count(stripe, 'refreshes')
+                    SLOT.pack_into(self.map, offset, slot_hash, key_len, value_len,
+                                   min(hits, 0xFFFFFFFF), scheduled, expiry, now)
+                    value = offset + SLOT.size + MAX_HOSTNAME
+                    response = self.map[value:value + value_len].decode('utf-8')
+            if count:
+                self.count(stripe, 'hits' if response is not None else 'misses')
+        finally:
+            self.locks[stripe].release()
+        if due:
+            self.refresh(hostname)
+        return response
+
+    def put(self, hostname, ip, response, negative=False, ttl=None):
+        '''
+        Function that caches the response for hostname for ttl seconds (by
+        default the cache's ttl or negative_ttl). True is returned if the
+        hostname wasn't already cached.
+        '''
+        if ttl is None:
+            ttl = self.negative_ttl if negative else self.ttl
+        key, h, start, stripe = self.locate(hostname)
+        value = response.encode('utf-8')
+        if ttl <= 0 or len(key) > MAX_HOSTNAME or len(value) > MAX_RESPONSE:
+            return False
+        with self.locks[stripe]:
+            now = self.clock()
+            offset = self.find(key, h, start)
+            is_new = offset < 0
+            if is_new: # take an empty slot, else an expired one, else the least recently used
+                victim = None
+                for candidate in range(start, start + WAYS * SLOT_SIZE, SLOT_SIZE):
+                    slot_hash, key_len, value_len, hits, scheduled, expiry, used = \
+                        SLOT.unpack_from(self.map, candidate)
+                    if key_len == 0:
+                        victim = (-1, candidate)
+                        break
+                    rank = -1 if expiry <= now else used
+                    if victim is None or rank < victim[0]:
+                        victim = (rank, candidate)
+                offset = victim[1]
+                if SLOT.unpack_from(self.map, offset)[1]:
+                    self.count(stripe, 'expirations' if victim[0] < 0 else 'evictions')
+                else:
+                    self.count(stripe, 'entries')
+            SLOT.pack_into(self.map, offset, h, len(key), len(value), 0, int(negative),
+                           now + ttl, now)
+            self.map[offset + SLOT.size:offset + SLOT.size + len(key)] = key
+            value_start = offset + SLOT.size + MAX_HOSTNAME
+            self.map[value_start:value_start + len(value)] = value
+        return is_new
+
+    def discard(self, hostname):
+        '''
+        Function that drops hostname from the cache because its answer changed.
+        True is returned if it was cached.
+        '''
+        key, h, start, stripe = self.locate(hostname)
+        with self.locks[stripe]:
+            offset = self.find(key, h, start)
+            if offset < 0:
+                return False
+            self.clear(offset, stripe)
+            self.count(stripe, 'invalidations')
+            return True
+
+    def discard_suffix(self, suffix):
+        '''
+        Function that drops every cached hostname ending with suffix and returns
+        how many were dropped.
+        '''
+        suffix = suffix.encode('utf-8')
+        dropped = 0
+        for bucket in range(self.buckets):
+            stripe = bucket % len(self.locks)
+            start = bucket * WAYS * SLOT_SIZE
+            with self.locks[stripe]:
+                for offset in range(start, start + WAYS * SLOT_SIZE, SLOT_SIZE):
+                    key_len = SLOT.unpack_from(self.map, offset)[1]
+                    if key_len and self.map[offset + SLOT.size:
+                                            offset + SLOT.size + key_len].endswith(suffix):
+                        self.clear(offset, stripe)
+                        self.count(stripe, 'invalidations')
+                        dropped += 1
+        return dropped
+
+    def export(self):
+        '''
+        Function that returns a (hostname, response, expiry time) tuple for
+        every entry that hasn't expired.
+        '''
+        entries = []
+        now = self.clock()
+        for bucket in range(self.buckets):
+            start = bucket * WAYS * SLOT_SIZE
+            with self.locks[bucket % len(self.locks)]:
+                for offset in range(start, start + WAYS * SLOT_SIZE, SLOT_SIZE):
+                    slot_hash, key_len, value_len, hits, scheduled, expiry, used = \
+                        SLOT.unpack_from(self.map, offset)
+                    if key_len and expiry > now:
+                        key = offset + SLOT.size
+                        value = key + MAX_HOSTNAME
+                        entries.append((self.map[key:key + key_len].decode('utf-8'),
+                                        self.map[value:value + value_len].decode('utf-8'),
+                                        expiry))
+        return entries
+
+    def get_stats(self):
+        '''
+        Function that returns the counters of every stripe added together.
+        '''
+        stats = dict((name, 0) for name in STAT_NAMES)
+        for stripe in range(len(self.locks)):
+            for i, name in enumerate(STAT_NAMES):
+                offset = (stripe * len(STAT_NAMES) + i) * COUNTER.size
+                stats[name] += COUNTER.unpack_from(self.counters, offset)[0]
+        stats['bytes'] = len(self.map)
+        return stats
@@ -7,12 +7,37 @@ Description: Program encompasses the functionality of the root DNS server
              programs that either redirects the default local DNS server to the
              appropriate DNS server or directly contacts said DNS server to
              receive the response and send it back to the default local DNS server.
+             server.dat can be reloaded while the server runs (zone_reload.py),
+             and may list several replicas of a DNS server (replica_set.py) and
+             split a domain into shards (shard_ring.py), to which queries are
+             routed by hostname.
 '''
 
-import sys
+import time
 import socket
+import batch
+import deadlines
+import dns_wire
+import log_writer
+import metrics
+import profiler
+import query
+import replica_set
+import server_engine
+import supervisor
+import tracing
+import upstream_pool
+import zone_reload
 
-domains = {} # structure that contains domain ip-port information
+domains = {} # structure that maps every domain to the ReplicaSet of its DNS servers
+replica_settings = {} # ReplicaSet settings given on the command line
+probe_interval = replica_set.DEFAULT_PROBE_INTERVAL # seconds between replica health probes
+upstreams = upstream_pool.ConnectionPool() # reusable framed connections to the DNS servers
+reloader = None # reloads server.dat in the background
+workers = None # supervisor of the worker processes in --workers mode
+metrics_port = 0 # port of the metrics endpoint (0 disables it)
+request_deadline = deadlines.DEFAULT_DEADLINE # seconds a request that carries no deadline may take
+UPSTREAM_FAILURES = (socket.error, deadlines.DeadlineExceeded) # answered with a server failure
 
 def server_shutdown(sock):
     '''
@@ -21,38 +46,59 @@ def server_shutdown(sock):
     notifying them of shutdown and socket connections are closed.
     '''
     print('\nCommencing root DNS server shutdown')
+    upstreams.close_all()
+    tracing.close()
 
     # Send broadcast message to default local DNS server
     s = socket.socket()
     s.connect(('127.0.0.1', 5352))
-    s.send("shutdown")
+    s.send("shutdown".encode('utf-8'))
     s.close()
 
     # Send broadcast messages to remaining DNS servers
     for item in domains:
-        s = socket.socket()
-        ip = domains.get(item)[0]
-        port = domains.get(item)[1]
-        s.connect((ip, port))
-        s.send("shutdown")
-        s.close()
+        for ip, port in domains.get(item).addrs():
+            s = socket.socket()
+            try:
+                s.connect((ip, port))
+                s.send("shutdown")
+            except socket.error: # a replica that is down has nothing to shut down
+                pass
+            s.close()
     print('Root DNS server socket closed')
     sock.close()
 
 def map_domains(filename):
     '''
-    Function that maps .com, .org, .gov domains to appropriate port and ip
-    numbers based on server.dat file and stores this information in appropriate
-    data structure.
+    Function that maps .com, .org, .gov domains to the ip and port numbers of
+    their replicas based on server.dat file and stores this information in
+    appropriate data structure. Replicas that were already listed keep their
+    health and latency.
     '''
-    file = open(filename, "r");
-    try:
-        for line in file:
-            line = line.strip("\n").strip("\r")
-            line = line.split(" ")
-            domains[line[0]] = [line[1].lower(), int(line[2])]
-    finally:
-        file.close()
+    global domains
+    domains = replica_set.build_replica_sets(filename, domains, **replica_settings)
+
+def route(q):
+    '''
+    Function that returns the replica set of the DNS server (the shard, for a
+    sharded domain) that holds the hostname of query q.
+    '''
+    return domains.get(q.domain).route(q.zone_name())
+
+def referral(q, server_id):
+    '''
+    Function that returns the response referring an iterative request to the
+    replica of the DNS server holding its hostname that should answer it.
+    '''
+    dns_server_ip, dns_server_port = route(q).choose(count=False).addr
+    return ('0x01, ' + server_id + ', ' + dns_server_ip + ', ' + str(dns_server_port))
+
+def start_probes():
+    '''
+    Function that starts the health probes of the replicas, if enabled.
+    '''
+    if probe_interval > 0:
+        replica_set.probe_forever(lambda: domains, probe_interval)
 
 def format_message(is_received, msg, server_id):
     '''
@@ -66,77 +112,201 @@ def format_message(is_received, msg, server_id):
     else:
         return (msg_arr[0] + ', ' + server_id + ', ' + msg_arr[2])
 
-def resolve_query(client_msg, server_id):
+def resolve_query(q, server_id):
     '''
-    Function that determines whether the client request has to be sent directly
-    to the .com, .org or .gov server or it should redirect the default local DNS
+    Function that determines whether query q has to be sent directly to the
+    .com, .org or .gov server or it should redirect the default local DNS
     server to one of the three mentioned server. The appropriate response
-    message string for either case is returned.
-    '''
-    client_msg_arr = client_msg.split(", ")
-    hostname = client_msg_arr[1].split(".")
-    domain = hostname[len(hostname)-1].lower()
-    dns_server_ip = domains.get(domain)[0]
-    dns_server_port = domains.get(domain)[1]
-    if (client_msg_arr[2].lower() == 'i'): # iterative request
-        return ('0x01, ' + server_id + ', ' + dns_server_ip + ', ' + str(dns_server_port))
+    message string for either case is returned, or a server failure if the DNS
+    server didn't answer before the query's deadline.
+    '''
+    if q.iterative: # iterative request
+        return referral(q, server_id)
     else: # recursive request
-        s = socket.socket()
-        s.connect((dns_server_ip, dns_server_port))
-        print('Connected to DNS server ' + domain)
-        s.send(client_msg.encode('utf-8'))
-        print('Message sent to DNS server: ' + client_msg)
-        response = s.recv(1024).decode('utf-8')
-        print('Response received from DNS server: ' + response)
-        s.close()
-        print('DNS server socket closed')
+        replicas = route(q)
+        client_msg = q.message(server_id)
+        log_writer.echo('Message sent to DNS server ' + replicas.domain + ': ' + client_msg)
+        started = time.time()
+        try:
+            with tracing.span('tld'):
+                response = replicas.request(upstreams.request, client_msg, deadline=q.deadline)
+        except UPSTREAM_FAILURES as e:
+            log_writer.echo('Request to DNS server ' + replicas.domain + ' failed: ' + str(e))
+            return deadlines.failure_response(server_id)
+        metrics.observe_upstream('tld', started)
+        log_writer.echo('Response received from DNS server: ' + response)
         return format_message(False, response, server_id)
 
-def talk_with_server(clientsocket, addr, server_id, shutdown):
-    '''
-    Function responsible for talking with DNS servers by accepting requests and
-    sending out the correct responses. The server shutdown status after
-    communication is returned.
-    '''
-    while True:
-        client_msg = clientsocket.recv(1024).decode('utf-8')
-        if not client_msg:
-            break
-        if client_msg == 'shutdown': # recieve broadcast message from another server
-            shutdown = True
-            break
-        print('Message recieved from default local DNS server: ' + client_msg)
-        client_msg = format_message(True, client_msg, server_id)
-        response = resolve_query(client_msg, server_id)
-        clientsocket.send(response.encode('utf-8'))
-        print('Response sent to default local DNS server: ' + response)
-    clientsocket.close()
-    print('Default local DNS socket closed\n')
-    return shutdown
-
-def server(server_id, server_port, mapping_file, servers_list):
+def resolve_batch(client_msg, server_id, deadline):
+    '''
+    Function that answers a batch request. Iterative queries get a referral to
+    their DNS server; recursive queries are grouped by the DNS server (domain or
+    shard) holding them and each group is sent to it as a single batch, whose
+    queries get a server failure if it fails. The batch response string, with
+    the responses in request order, is returned.
+    '''
+    sender_id, entries = batch.decode_request(client_msg)
+    responses = [None] * len(entries)
+    groups = {} # replica set -> indexes of the recursive queries it holds
+    for i, q in enumerate(query.parse_batch(sender_id, entries, deadline)):
+        if (q.domain not in domains) or (q.mode.lower() not in query.VALID_MODES):
+            responses[i] = '0xEE, ' + server_id + ', Invalid format'
+        elif q.iterative: # iterative request
+            responses[i] = referral(q, server_id)
+        else: # recursive request
+            groups.setdefault(route(q), []).append(i)
+    for replicas in groups:
+        indexes = groups[replicas]
+        request = batch.encode_request(server_id, [entries[i] for i in indexes])
+        log_writer.echo('Batch of ' + str(len(indexes)) + ' queries sent to DNS server ' +
+                        replicas.domain)
+        started = time.time()
+        try:
+            with tracing.span('tld'):
+                reply = replicas.request(upstreams.request, request, deadline=deadline)
+        except UPSTREAM_FAILURES as e:
+            log_writer.echo('Batch to DNS server ' + replicas.domain + ' failed: ' + str(e))
+            for i in indexes:
+                responses[i] = deadlines.failure_response(server_id)
+            continue
+        metrics.observe_upstream('tld', started)
+        failure = deadlines.failure_response(server_id)
+        for i, response in zip(indexes, batch.response_lines(reply, len(indexes), failure)):
+            responses[i] = format_message(False, response, server_id)
+    return batch.encode_response(server_id, responses)
+
+def resolve_udp(hostname, mode, server_id):
+    '''
+    Function that answers a query received over UDP (dns_wire.py) with a
+    referral or, when recursion is desired, the DNS server's answer, and returns
+    the response string.
+    '''
+    started = time.time()
+    q = query.Query(server_id, hostname, mode, True, deadlines.start(request_deadline))
+    if q.domain not in domains:
+        response = '0xEE, ' + server_id + ', Invalid format'
+    else:
+        response = resolve_query(q, server_id)
+    metrics.record_response(response, started)
+    return response
+
+def handle_request(client_msg, server_id):
+    '''
+    Function responsible for answering a single request or batch request
+    received from the default local DNS server. It is run by the connection
+    engine's worker threads and the correct response message is returned. The
+    request has the time left that it carries (deadlines.py), or --deadline
+    seconds.
+    '''
+    deadline, client_msg = deadlines.detach(client_msg, request_deadline)
+    if client_msg == zone_reload.RELOAD_MESSAGE:
+        if workers is not None: # every worker process reloads its own tables
+            workers.broadcast(client_msg)
+        else:
+            reloader.request()
+        return 'Reload started'
+    if batch.is_batch(client_msg):
+        response = resolve_batch(client_msg, server_id, deadline)
+        log_writer.echo('Batch of ' + str(client_msg.count('\n')) + ' queries answered')
+        return response
+    log_writer.echo('Message recieved from default local DNS server: ' + client_msg)
+    q = query.parse(client_msg, deadline)
+    if q.domain not in domains: # e.g. a domain removed from server.dat by a reload
+        response = '0xEE, ' + server_id + ', Invalid format'
+    else:
+        response = resolve_query(q, server_id)
+    log_writer.echo('Response sent to default local DNS server: ' + response)
+    return response
+
+def serve_worker(tcp_sock, udp_sock, server_id, threads, udp_threads, watch):
+    '''
+    Function run by every worker process in --workers mode. The worker serves
+    the sockets it was given with a connection engine and upstream connections
+    of its own.
+    '''
+    if watch:
+        zone_reload.watch_files(reloader, watch)
+    start_probes()
+    metrics.collect_pool(upstreams.get_stats)
+    metrics.serve_http(metrics_port, workers)
+    if udp_sock is not None:
+        ip, port = udp_sock.getsockname()
+        dns_wire.serve_udp(ip, port,
+                           lambda hostname, mode, addr: resolve_udp(hostname, mode, server_id),
+                           udp_threads, sock=udp_sock)
+    engine = server_engine.ConnectionEngine(
+        lambda client_msg: handle_request(client_msg, server_id), threads, server_id)
+    try:
+        engine.serve_forever(tcp_sock)
+    finally:
+        upstreams.close_all()
+        tracing.close()
+
+def server(server_id, server_port, mapping_file, servers_list,
+           backlog=server_engine.DEFAULT_BACKLOG, threads=server_engine.DEFAULT_THREADS,
+           udp_threads=0, watch=0, worker_count=0, reuse_port=False):
     '''
     Main function where root DNS server connection is set up to recieve and send
-    messages and is closed when appropriate.
+    messages and is closed when appropriate. Connections are served concurrently
+    by the connection engine. When udp_threads is set, standard DNS queries are
+    also answered over UDP on the same port. When watch is set, the servers list
+    is checked for changes every watch seconds. With a worker_count above 1 the
+    port is served by that many worker processes.
     '''
+    global reloader, workers
+    reloader = zone_reload.Reloader(map_domains, [servers_list])
     s = socket.socket()                     # Create a socket object
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if worker_count > 1:
+        reuse_port = supervisor.prepare_socket(s, reuse_port)
     ip = '127.0.0.1'
-    shutdown = False                        # Track any existing server shutdown
+    engine = server_engine.ConnectionEngine(
+        lambda client_msg: handle_request(client_msg, server_id), threads, server_id)
 
     try:
         s.bind((ip, int(server_port)))      # Bind to the port
-        s.listen(5)                         # Now wait for client connection.
-        print('Root DNS Server started!')
-        print('Waiting for clients...')
-        while True and not shutdown:
-           c, addr = s.accept()             # Establish connection with client.
-           print ('Connect to default local DNS server' + str(addr))
-           shutdown = talk_with_server(c, addr, server_id, shutdown)
+        if worker_count > 1:
+            workers = supervisor.Supervisor(
+                worker_count, s, backlog, reuse_port, udp_threads > 0,
+                lambda tcp_sock, udp_sock: serve_worker(tcp_sock, udp_sock, server_id,
+                                                        threads, udp_threads, watch),
+                lambda msg: reloader.request())
+            print('Root DNS Server started!')
+            print('Waiting for clients...')
+            workers.run()
+        else:
+            s.listen(backlog)               # Now wait for client connection.
+            if watch:
+                zone_reload.watch_files(reloader, watch)
+            start_probes()
+            metrics.collect_pool(upstreams.get_stats)
+            metrics.serve_http(metrics_port)
+            if udp_threads:
+                dns_wire.serve_udp(ip, server_port,
+                                   lambda hostname, mode, addr: resolve_udp(hostname, mode,
+                                                                            server_id),
+                                   udp_threads)
+            print('Root DNS Server started!')
+            print('Waiting for clients...')
+            engine.serve_forever(s)
         s.close()
         print('Root DNS server socket closed')
     except KeyboardInterrupt:
+        engine.stop()
+        if workers is not None:
+            workers.stop()
         server_shutdown(s)
 
 if __name__ == '__main__':
-    map_domains(sys.argv[4])
-    server(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])
+    args = server_engine.build_arg_parser('Root DNS server', replicas=True).parse_args()
+    log_writer.verbose = not args.quiet
+    replica_settings = replica_set.settings_from_args(args)
+    probe_interval = args.probe_interval
+    metrics_port = args.metrics_port
+    request_deadline, upstreams.hedging = deadlines.settings_from_args(args)
+    tracing.configure(args.server_id, args.trace_sample, args.slow_query_ms)
+    profiler.install(args.server_id, args.profile_seconds)
+    map_domains(args.servers_list)
+    server(args.server_id, args.server_port, args.mapping_file, args.servers_list,
+           args.backlog, args.threads, args.udp_threads if args.udp else 0, args.watch,
+           args.workers, args.reuse_port)
@@ -0,0 +1,351 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: server_engine.py
+Description: Shared connection engine used by the root and .com, .org, .gov DNS
+             server programs. A single event loop watches every open connection
+             and hands complete request messages to a pool of worker threads so
+             that one slow or long-lived peer never stalls the others.
+             Connections speak either the framed protocol (framing.py), whose
+             pipelined requests are resolved concurrently and answered in any
+             order, or the original unframed text protocol.
+'''
+
+import os
+import time
+import errno
+import socket
+import select
+import argparse
+import threading
+import batch
+import framing
+import deadlines
+import dns_wire
+import log_writer
+import metrics
+import profiler
+import replica_set
+import tracing
+try:
+    import Queue as queue
+except ImportError: # Python 3
+    import queue
+
+DEFAULT_BACKLOG = 128 # pending connections the kernel queues before accept()
+DEFAULT_THREADS = 8   # worker threads that run resolve_query concurrently
+
+def build_arg_parser(description, threads=True, reload=True, replicas=False):
+    '''
+    Function that returns a command line parser accepting the positional
+    arguments every server program takes, plus the optional engine settings.
+    Servers that do not run on the connection engine pass threads=False,
+    servers that can't reload their files pass reload=False, and servers that
+    send requests to the .com, .org, .gov replicas pass replicas=True.
+    '''
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('server_id')
+    parser.add_argument('server_port')
+    parser.add_argument('mapping_file')
+    parser.add_argument('servers_list')
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG,
+                        help='listen() backlog for the server socket')
+    if threads:
+        parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                            help='number of worker threads resolving requests')
+    parser.add_argument('--quiet', action='store_true',
+                        help="don't print a line for every message sent and received")
+    parser.add_argument('--udp', action='store_true',
+                        help='also answer standard DNS queries over UDP on server_port')
+    parser.add_argument('--udp-threads', type=int, default=dns_wire.DEFAULT_UDP_THREADS,
+                        help='number of threads serving UDP queries')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='serve from this many worker processes (supervisor.py)')
+    parser.add_argument('--reuse-port', action='store_true',
+                        help='give every worker its own SO_REUSEPORT socket instead of '
+                             'sharing one listening socket')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='serve Prometheus metrics over HTTP on this port of 127.0.0.1 '
+                             '(worker n uses the port plus n; default: disabled)')
+    parser.add_argument('--trace-sample', type=float, default=0, metavar='RATE',
+                        help='share of requests traced to <server_id>_trace.log, '
+                             'e.g. 0.01 (default: 0, or as requested by the sending server)')
+    parser.add_argument('--slow-query-ms', type=float, default=0, metavar='MS',
+                        help='write requests that take longer, with their spans, to '
+                             '<server_id>_slow.log (default: 0, disabled)')
+    parser.add_argument('--profile-seconds', type=float,
+                        default=profiler.DEFAULT_PROFILE_SECONDS, metavar='SECONDS',
+                        help='length of the profile SIGUSR1 writes to '
+                             '<server_id>_profile_<time>_<pid>.txt')
+    if reload:
+        parser.add_argument('--watch', type=float, default=0, metavar='SECONDS',
+                            help='check the mapping file and servers list for changes this '
+                                 'often and reload them (default: only on a reload message)')
+    if replicas:
+        parser.add_argument('--balance', choices=replica_set.POLICIES,
+                            default='least-outstanding',
+                            help='how requests are spread over the replicas of a domain')
+        parser.add_argument('--probe-interval', type=float,
+                            default=replica_set.DEFAULT_PROBE_INTERVAL, metavar='SECONDS',
+                            help='seconds between health probes of every replica, e.g. 2 '
+                                 '(default: 0, disabled)')
+        parser.add_argument('--failure-threshold', type=int,
+                            default=replica_set.DEFAULT_FAILURE_THRESHOLD,
+                            help='consecutive failures that take a replica out of rotation')
+        parser.add_argument('--open-seconds', type=float,
+                            default=replica_set.DEFAULT_OPEN_SECONDS, metavar='SECONDS',
+                            help='seconds before a failed replica is tried again')
+        parser.add_argument('--deadline', type=float, default=deadlines.DEFAULT_DEADLINE,
+                            metavar='SECONDS',
+                            help='seconds a request may take before it is answered with a '
+                                 'server failure (0x02); 0 waits forever')
+        parser.add_argument('--hedge-percentile', type=int,
+                            default=deadlines.DEFAULT_HEDGE_PERCENTILE,
+                            help='send a request again when it is still unanswered after this '
+                                 'percentile of its server\'s latency (0 disables hedging)')
+        parser.add_argument('--hedge-delay', type=float, metavar='SECONDS',
+                            help='hedge after this fixed delay instead of the percentile')
+    return parser
+
+class Poller(object):
+    '''
+    Thin wrapper around select.poll (or select.select where poll is missing)
+    that reports which registered file descriptors are readable.
+    '''
+
+    def __init__(self):
+        self.fds = set()
+        if hasattr(select, 'poll'):
+            self.poller = select.poll()
+        else:
+            self.poller = None
+
+    def register(self, fd):
+        self.fds.add(fd)
+        if self.poller is not None:
+            self.poller.register(fd, select.POLLIN)
+
+    def unregister(self, fd):
+        if fd in self.fds:
+            self.fds.discard(fd)
+            if self.poller is not None:
+                self.poller.unregister(fd)
+
+    def poll(self, timeout):
+        try:
+            if self.poller is not None:
+                return [fd for fd, event in self.poller.poll(timeout * 1000)]
+            readable, _, _ = select.select(list(self.fds), [], [], timeout)
+        except select.error as e: # interrupted by a signal (SIGUSR1, profiler.py) on Python 2
+            if e.args[0] != errno.EINTR:
+                raise
+            return []
+        return readable
+
+class Connection(object):
+    '''
+    An accepted connection and its protocol state. The protocol is unknown
+    until the first bytes arrive; framed connections buffer partial frames and
+    serialize the replies written by concurrent workers.
+    '''
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.framed = None
+        self.reader = framing.FrameReader()
+        self.send_lock = threading.Lock()
+
+    def send(self, request_id, response):
+        if self.framed:
+            data = framing.encode_frame(request_id, response)
+        else:
+            data = response.encode('utf-8')
+        with self.send_lock:
+            self.sock.sendall(data)
+
+class ConnectionEngine(object):
+    '''
+    Event-driven connection engine. The event loop accepts connections and
+    reads requests; workers run handle_message(client_msg) and send back the
+    response it returns, or a server failure from server_id when it raises.
+    An unframed connection has at most one request in flight, so its responses
+    are sent in the order requests arrived. Every frame of a framed connection
+    is dispatched as soon as it is read. A request is traced (tracing.py) from
+    the time it was read.
+    '''
+
+    def __init__(self, handle_message, threads=DEFAULT_THREADS, server_id=''):
+        self.handle_message = handle_message
+        self.server_id = server_id
+        self.threads = max(1, threads)
+        self.requests = queue.Queue()
+        self.connections = {}   # fd -> Connection of every open connection
+        self.rearm = []         # unframed connections whose response has been sent
+        self.rearm_lock = threading.Lock()
+        self.poller = Poller()
+        self.wake_r, self.wake_w = os.pipe()
+        self.shutdown = False
+
+    def wake(self):
+        try:
+            os.write(self.wake_w, b'x')
+        except OSError:
+            pass
+
+    def stop(self):
+        '''
+        Function that stops the event loop and worker threads.
+        '''
+        self.shutdown = True
+        self.wake()
+
+    def worker(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                break
+            conn, request_id, client_msg, received = item
+            try:
+                trace, client_msg = tracing.begin(client_msg, received)
+                response = self.handle_message(client_msg)
+                conn.send(request_id, response)
+                metrics.record_response(response, received)
+                tracing.end(trace, client_msg, response)
+            except Exception as e:
+                print('Error handling request ' + repr(client_msg) + ': ' + str(e))
+                response = None
+                if conn.framed:
+                    self.send_failure(conn, request_id, client_msg)
+            if not conn.framed:
+                with self.rearm_lock:
+                    self.rearm.append((conn, response is not None))
+                self.wake()
+
+    def send_failure(self, conn, request_id, client_msg):
+        '''
+        Function that answers a framed request whose handler failed with a
+        server failure, so the peer waiting on request_id doesn't wait until
+        its deadline.
+        '''
+        _, client_msg = deadlines.detach(client_msg)
+        failure = deadlines.failure_response(self.server_id)
+        try:
+            conn.send(request_id, batch.answer_all(client_msg, self.server_id, failure))
+        except socket.error:
+            pass
+
+    def close_connection(self, fd):
+        conn = self.connections.pop(fd, None)
+        self.poller.unregister(fd)
+        if conn is not None:
+            conn.sock.close()
+            log_writer.echo('Connection socket closed\n')
+
+    def accept_all(self, sock):
+        while True:
+            try:
+                c, addr = sock.accept()
+            except socket.error:
+                return
+            c.setblocking(True)
+            conn = Connection(c)
+            self.connections[conn.fd] = conn
+            self.poller.register(conn.fd)
+            log_writer.echo('Connected to server ' + str(addr))
+
+    def dispatch(self, conn, request_id, client_msg):
+        if client_msg == 'shutdown': # recieve broadcast message from another server
+            self.close_connection(conn.fd)
+            self.shutdown = True
+            return False
+        self.requests.put((conn, request_id, client_msg, time.time()))
+        return True
+
+    def read_request(self, fd):
+        conn = self.connections.get(fd)
+        try:
+            data = conn.sock.recv(framing.RECV_SIZE)
+        except socket.error:
+            data = b''
+        if not data:
+            self.close_connection(fd)
+            return
+        if conn.framed is None:
+            conn.framed = framing.is_framed(data)
+        if conn.framed:
+            try:
+                frames = conn.reader.feed(data)
+            except (framing.FramingError, UnicodeDecodeError) as e:
+                print('Closing connection that sent a bad frame: ' + str(e))
+                self.close_connection(fd)
+                return
+            for request_id, client_msg in frames:
+                if not self.dispatch(conn, request_id, client_msg):
+                    return
+        else:
+            try:
+                client_msg = data.decode('utf-8')
+            except UnicodeDecodeError as e:
+                print('Closing connection that sent a bad message: ' + str(e))
+                self.close_connection(fd)
+                return
+            # stop watching the connection until its response has been sent
+            self.poller.unregister(fd)
+            self.dispatch(conn, 0, client_msg)
+
+    def rearm_connections(self):
+        try:
+            os.read(self.wake_r, 4096)
+        except OSError:
+            pass
+        with self.rearm_lock:
+            finished, self.rearm = self.rearm, []
+        for conn, ok in finished:
+            if self.connections.get(conn.fd) is not conn:
+                continue
+            if ok:
+                self.poller.register(conn.fd)
+            else:
+                self.close_connection(conn.fd)
+
+    def serve_forever(self, sock):
+        '''
+        Function that runs the event loop on an already bound and listening
+        socket until a 'shutdown' broadcast is received or stop() is called.
+        The server shutdown status is returned.
+        '''
+        metrics.registry.collect('dns_active_connections', 'gauge', 'Open client connections',
+                                 lambda: len(self.connections))
+        metrics.registry.collect('dns_queued_requests', 'gauge',
+                                 'Requests waiting for a worker thread', self.requests.qsize)
+        workers = []
+        for i in range(self.threads):
+            t = threading.Thread(target=self.worker)
+            t.daemon = True
+            t.start()
+            workers.append(t)
+        sock.setblocking(False)
+        listen_fd = sock.fileno()
+        self.poller.register(listen_fd)
+        self.poller.register(self.wake_r)
+        try:
+            while not self.shutdown:
+                for fd in self.poller.poll(1.0):
+                    if fd == listen_fd:
+                        self.accept_all(sock)
+                    elif fd == self.wake_r:
+                        self.rearm_connections()
+                    elif fd in self.connections:
+                        self.read_request(fd)
+                    if self.shutdown:
+                        break
+        finally:
+            for t in workers:
+                self.requests.put(None)
+            for fd in list(self.connections):
+                self.close_connection(fd)
+            os.close(self.wake_r)
+            os.close(self.wake_w)
+        return self.shutdown
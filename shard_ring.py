@@ -0,0 +1,57 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: shard_ring.py
+Description: Consistent hash ring splitting a .com, .org or .gov zone over shard
+             servers. Every shard is placed on the ring at many points (virtual
+             nodes) derived from its name alone, and a hostname belongs to the
+             shard of the first point at or after the hash of its zone name
+             (query.zone_name). Adding a shard therefore only moves the names it
+             takes over, about 1/N of the zone, and removing one only moves its
+             own names. The root and default local DNS servers route queries
+             with the ring built from server.dat, and zone_split.py splits a
+             mapping file with the same ring.
+'''
+
+import bisect
+import struct
+import hashlib
+
+DEFAULT_VNODES = 160 # points of every shard on the ring
+HASH = struct.Struct('>Q')
+
+def key_hash(key):
+    '''
+    Function that returns the 64 bit ring position of a string. The position
+    must not depend on the process, so Python's hash() can't be used.
+    '''
+    return HASH.unpack(hashlib.md5(key.encode('utf-8')).digest()[:8])[0]
+
+class HashRing(object):
+    '''
+    Ring of the named shards of a zone.
+    '''
+
+    def __init__(self, shards, vnodes=DEFAULT_VNODES):
+        self.shards = sorted(set(shards))
+        if not self.shards:
+            raise ValueError('A hash ring needs at least one shard')
+        points = sorted((key_hash(shard + '#' + str(i)), shard)
+                        for shard in self.shards for i in range(vnodes))
+        self.hashes = [position for position, shard in points]
+        self.owners = [shard for position, shard in points]
+
+    def owner(self, name):
+        '''
+        Function that returns the shard a zone name belongs to.
+        '''
+        i = bisect.bisect_left(self.hashes, key_hash(name))
+        return self.owners[i if i < len(self.owners) else 0]
+
+def is_wildcard(name):
+    '''
+    Function that returns True for a wildcard record ('*.example.com'). The
+    names it covers hash anywhere, so every shard holds a copy of it.
+    '''
+    return name[:2] == '*.'
@@ -0,0 +1,85 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: single_flight.py
+Description: Coalesces identical in-flight requests in the default local DNS
+             server. The first client thread to miss the cache for a query does
+             the upstream work and every other thread asking for the same query
+             meanwhile waits for, and shares, that one result.
+'''
+
+import threading
+
+DEFAULT_TIMEOUT = 10 # seconds a waiting thread waits for the first request's result
+
+class SingleFlightTimeout(Exception):
+    '''
+    Raised in a waiting thread when the request it joined didn't finish in time.
+    '''
+    pass
+
+class Flight(object):
+    '''
+    A request that is currently being resolved and the result it produced.
+    '''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight(object):
+    '''
+    Table of in-flight requests keyed by an arbitrary hashable key.
+    '''
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.stats = {'leaders': 0, 'coalesced': 0, 'timeouts': 0, 'errors': 0}
+
+    def do(self, key, fn):
+        '''
+        Function that returns fn() for the first caller with key and the same
+        result to every caller that arrives while it runs. An exception raised
+        by fn() is re-raised in every one of those callers.
+        '''
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.stats['leaders'] += 1
+            else:
+                flight.waiters += 1
+                self.stats['coalesced'] += 1
+        if leader:
+            try:
+                flight.result = fn()
+            except Exception as e:
+                flight.error = e
+                with self.lock:
+                    self.stats['errors'] += 1
+            finally:
+                with self.lock:
+                    del self.flights[key]
+                flight.done.set()
+        elif not flight.done.wait(self.timeout):
+            with self.lock:
+                self.stats['timeouts'] += 1
+            raise SingleFlightTimeout('Timed out waiting for in-flight request ' + str(key))
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def get_stats(self):
+        '''
+        Function that returns a snapshot of the coalescing counters.
+        '''
+        with self.lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = len(self.flights)
+        return stats
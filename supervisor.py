@@ -0,0 +1,199 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: supervisor.py
+Description: Multi-process mode shared by every server program (--workers N), so
+             a server isn't limited to the one core a Python process can use.
+             The supervisor process binds the server port and starts N worker
+             processes that serve it: either all of them accept from the one
+             listening socket they inherit, or (--reuse-port) every worker binds
+             its own socket with SO_REUSEPORT and the kernel spreads connections
+             between them. A worker that dies is restarted; a worker that exits
+             cleanly (it received the 'shutdown' broadcast) stops the others.
+
+             Messages that concern every worker, such as a reload request, can be
+             broadcast to all of them through one queue per worker.
+'''
+
+import os
+import sys
+import time
+import signal
+import socket
+import threading
+import multiprocessing
+
+CHECK_INTERVAL = 0.5 # seconds between checks that every worker is alive
+RESTART_DELAY = 1.0  # minimum seconds between two starts of the same worker
+TERMINATED = 128 + signal.SIGTERM # exit code of a worker stopped by SIGTERM
+
+def get_context():
+    '''
+    Function that returns the multiprocessing context used to start workers.
+    Workers are forked so that they inherit the loaded mappings, the listening
+    socket and any shared cache.
+    '''
+    try:
+        return multiprocessing.get_context('fork')
+    except AttributeError: # Python 2 always forks
+        return multiprocessing
+
+def reuse_port_supported():
+    return hasattr(socket, 'SO_REUSEPORT')
+
+def allow_reuse_port(sock):
+    '''
+    Function that lets other sockets bind the same port with SO_REUSEPORT. It
+    must be called before the socket is bound.
+    '''
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+def prepare_socket(sock, reuse_port):
+    '''
+    Function called on the server socket before it is bound. Returns whether
+    the workers will bind their own SO_REUSEPORT sockets, which falls back to
+    sharing the server socket where SO_REUSEPORT is missing.
+    '''
+    if reuse_port and not reuse_port_supported():
+        print('SO_REUSEPORT is not supported here, workers will share one socket')
+        return False
+    if reuse_port:
+        allow_reuse_port(sock)
+    return reuse_port
+
+def bind_socket(sock_type, addr, reuse_port=False):
+    '''
+    Function that returns a new socket of sock_type bound to addr.
+    '''
+    s = socket.socket(socket.AF_INET, sock_type)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        allow_reuse_port(s)
+    s.bind(addr)
+    return s
+
+def terminate(signum, frame):
+    sys.exit(TERMINATED)
+
+def watch_parent(parent_pid):
+    '''
+    Function run by a thread in every worker that exits the worker if the
+    supervisor goes away without stopping it (e.g. it was killed).
+    '''
+    while os.getppid() == parent_pid:
+        time.sleep(CHECK_INTERVAL)
+    os._exit(TERMINATED)
+
+class Supervisor(object):
+    '''
+    Starts count workers that each call run_worker(tcp_sock, udp_sock) and
+    keeps them running. sock is the server socket, already bound by the
+    supervisor (after prepare_socket). udp_sock is None unless udp is set.
+    Broadcast messages are passed to on_message(msg) in every worker.
+    '''
+
+    def __init__(self, count, sock, backlog, reuse_port, udp, run_worker, on_message=None):
+        self.count = count
+        self.sock = sock
+        self.backlog = backlog
+        self.reuse_port = reuse_port
+        self.run_worker = run_worker
+        self.on_message = on_message
+        self.addr = sock.getsockname()
+        self.udp_sock = None
+        if not reuse_port:
+            sock.listen(backlog)
+            if udp:
+                self.udp_sock = bind_socket(socket.SOCK_DGRAM, self.addr)
+        self.udp = udp
+        self.context = get_context()
+        self.queues = [self.context.Queue() for i in range(count)] if on_message else []
+        self.processes = [None] * count
+        self.started = [0] * count
+        self.number = None # number of the worker running in this process
+        self.parent_pid = os.getpid()
+
+    def broadcast(self, msg):
+        '''
+        Function called by a worker to deliver msg to every worker, itself
+        included.
+        '''
+        for q in self.queues:
+            q.put(msg)
+
+    def listen(self):
+        q = self.queues[self.number]
+        while True:
+            msg = q.get()
+            try:
+                self.on_message(msg)
+            except Exception as e:
+                print('Worker ' + str(self.number) + ' could not handle ' + repr(msg) + ': ' + str(e))
+
+    def worker_main(self, number):
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # ctrl-c is handled by the supervisor
+        signal.signal(signal.SIGTERM, terminate)
+        self.number = number
+        threads = [threading.Thread(target=watch_parent, args=(self.parent_pid,))]
+        if self.queues:
+            threads.append(threading.Thread(target=self.listen))
+        for t in threads:
+            t.daemon = True
+            t.start()
+        tcp_sock, udp_sock = self.sock, self.udp_sock
+        if self.reuse_port:
+            self.sock.close()
+            tcp_sock = bind_socket(socket.SOCK_STREAM, self.addr, True)
+            tcp_sock.listen(self.backlog)
+            if self.udp:
+                udp_sock = bind_socket(socket.SOCK_DGRAM, self.addr, True)
+        self.run_worker(tcp_sock, udp_sock)
+
+    def start_worker(self, number):
+        p = self.context.Process(target=self.worker_main, args=(number,))
+        p.daemon = True
+        p.start()
+        self.processes[number] = p
+        self.started[number] = time.time()
+
+    def run(self):
+        '''
+        Function that starts the workers and restarts any worker that dies. It
+        returns once a worker exits cleanly, after stopping the others. The
+        workers are also stopped when the supervisor is interrupted or
+        terminated.
+        '''
+        for i in range(self.count):
+            self.start_worker(i)
+        print(str(self.count) + ' worker processes started' +
+              (' (SO_REUSEPORT)' if self.reuse_port else ''))
+        signal.signal(signal.SIGTERM, terminate)
+        try:
+            while True:
+                time.sleep(CHECK_INTERVAL)
+                for i, p in enumerate(self.processes):
+                    if p.is_alive():
+                        continue
+                    p.join()
+                    if p.exitcode == 0:
+                        print('Worker ' + str(i) + ' shut down')
+                        return
+                    print('Worker ' + str(i) + ' (pid ' + str(p.pid) + ') exited with code ' +
+                          str(p.exitcode) + ', restarting it')
+                    if time.time() - self.started[i] < RESTART_DELAY:
+                        time.sleep(RESTART_DELAY)
+                    self.start_worker(i)
+        finally:
+            self.stop()
+
+    def stop(self):
+        '''
+        Function that terminates every worker and waits for them to exit.
+        '''
+        for p in self.processes:
+            if p is not None and p.is_alive():
+                p.terminate()
+        for p in self.processes:
+            if p is not None:
+                p.join(5)
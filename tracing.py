@@ -0,0 +1,237 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: tracing.py
+Description: Request tracing and the slow-query log of the server programs. A
+             traced request records a timestamped span for every step it spent
+             time on: the cache, the root and .com, .org, .gov hops, the log
+             files, waiting for a coalesced request or a pooled connection, and
+             on the root and DNS servers the time it queued for a worker.
+
+             A share of the requests (--trace-sample) is traced and written to
+             <server_id>_trace.log. Their trace id travels with every request
+             sent upstream as a 'TRACE <id> <sampled>' line in front of the
+             message, so the root and DNS servers trace them too and the lines
+             of the three logs can be joined on the id. With --slow-query-ms
+             every request is timed, and one that takes longer is written with
+             its spans to <server_id>_slow.log.
+'''
+
+import time
+import random
+import threading
+import log_writer
+import metrics
+try:
+    import contextvars
+except ImportError: # Python 2 and 3.6
+    contextvars = None
+
+TRACE_KEYWORD = 'TRACE'
+TRACE_FILE = '_trace.log' # appended to the server id to name the trace log
+SLOW_FILE = '_slow.log' # appended to the server id to name the slow-query log
+MAX_LOGGED_MESSAGE = 200 # characters of a request or response written to the logs
+
+server_id = '' # id of the server writing the logs
+sample_rate = 0.0 # share of the requests traced
+slow_seconds = 0 # requests taking longer are written to the slow-query log (0: never)
+writer = log_writer.LogWriter(policy='drop') # tracing never makes a request wait for the disk
+
+if contextvars is not None: # the trace of the running thread or asyncio task
+    current = contextvars.ContextVar('trace', default=None)
+else:
+    current = threading.local()
+
+class Trace(object):
+    '''
+    The spans of one request. Every span is (name, started, seconds).
+    sampled tells whether the request is written to the trace log; a request
+    that isn't is only timed for the slow-query log.
+    '''
+    __slots__ = ('trace_id', 'sampled', 'started', 'spans')
+
+    def __init__(self, trace_id, sampled, started):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.started = started
+        self.spans = []
+
+    def format(self, msg, response, ended):
+        '''
+        Function that returns the log line of the trace: when the request
+        arrived, how long it took, the total time of every kind of span and the
+        spans in the order they started, as name@offset+duration in
+        milliseconds.
+        '''
+        totals = {}
+        for name, started, seconds in self.spans:
+            totals[name] = totals.get(name, 0) + seconds
+        spans = sorted(self.spans, key=lambda span: span[1])
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started))
+        return (stamp + '.%03d' % int(self.started % 1 * 1000) +
+                ' trace=' + self.trace_id + ' server=' + server_id +
+                ' total_ms=' + milliseconds(ended - self.started) +
+                ' breakdown=' + ','.join(name + '=' + milliseconds(totals[name])
+                                         for name in sorted(totals)) +
+                ' spans=' + ','.join(name + '@' + milliseconds(started - self.started) +
+                                     '+' + milliseconds(seconds)
+                                     for name, started, seconds in spans) +
+                ' request=' + shorten(msg) + ' response=' + shorten(response) + '\n')
+
+class Span(object):
+    '''
+    Context manager adding the time spent in its block to a trace, even when
+    the block raises.
+    '''
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, kind, value, tb):
+        self.trace.spans.append((self.name, self.started, time.time() - self.started))
+        return False
+
+class NoSpan(object):
+    '''
+    Context manager used in place of a Span when the request isn't traced.
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, tb):
+        return False
+
+NO_SPAN = NoSpan()
+
+def milliseconds(seconds):
+    return '%.3f' % (seconds * 1000)
+
+def shorten(msg):
+    msg = msg.replace('\n', '|')
+    if len(msg) > MAX_LOGGED_MESSAGE:
+        return msg[:MAX_LOGGED_MESSAGE] + '...'
+    return msg
+
+def get_current():
+    if contextvars is not None:
+        return current.get()
+    return getattr(current, 'trace', None)
+
+def set_current(trace):
+    if contextvars is not None:
+        current.set(trace)
+    else:
+        current.trace = trace
+
+def enabled():
+    return sample_rate > 0 or slow_seconds > 0
+
+def configure(sid, rate=0.0, slow_ms=0):
+    '''
+    Function that sets the id of the server and the share of requests traced
+    (--trace-sample) and the slow-query threshold (--slow-query-ms).
+    '''
+    global server_id, sample_rate, slow_seconds
+    server_id = sid
+    sample_rate = rate
+    slow_seconds = slow_ms / 1000.0
+
+def detach(msg):
+    '''
+    Function that returns the trace id and sampled flag carried by a received
+    message, or None and False when it carries none, and the message without
+    them.
+    '''
+    if not msg.startswith(TRACE_KEYWORD + ' '):
+        return None, False, msg
+    header, _, msg = msg.partition('\n')
+    fields = header.split(' ')
+    return fields[1], fields[2:3] == ['1'], msg
+
+def attach(msg):
+    '''
+    Function that returns msg as it is sent upstream: after the line carrying
+    the trace of the request it is sent for, if the request is traced.
+    '''
+    trace = get_current()
+    if trace is None:
+        return msg
+    return (TRACE_KEYWORD + ' ' + trace.trace_id + ' ' + ('1' if trace.sampled else '0') +
+            '\n' + msg)
+
+def begin(msg, received=None):
+    '''
+    Function that starts the trace of a request message received at time
+    received (default: now) and makes it the trace of the running thread or
+    task. A request that carries a trace id keeps it. On the root and DNS
+    servers the time from receipt to now is the 'queue' span. The trace (None
+    if the request isn't traced) and the message without its trace line are
+    returned.
+    '''
+    trace_id, sampled, msg = detach(msg)
+    trace = None
+    if trace_id is not None:
+        if sampled or slow_seconds > 0:
+            trace = Trace(trace_id, sampled, received or time.time())
+    elif enabled():
+        sampled = sample_rate > 0 and random.random() < sample_rate
+        if sampled or slow_seconds > 0:
+            trace = Trace('%016x' % random.getrandbits(64), sampled, received or time.time())
+    if trace is not None and received is not None:
+        trace.spans.append(('queue', received, time.time() - received))
+    set_current(trace)
+    return trace, msg
+
+def end(trace, msg, response):
+    '''
+    Function that ends the trace of a request that was answered with response
+    and writes it to the trace log if it was sampled and to the slow-query log
+    if it took longer than --slow-query-ms.
+    '''
+    set_current(None)
+    if trace is None:
+        return
+    ended = time.time()
+    slow = slow_seconds > 0 and ended - trace.started >= slow_seconds
+    if not (trace.sampled or slow):
+        return
+    line = trace.format(msg, response, ended)
+    if trace.sampled:
+        writer.write(server_id + TRACE_FILE, line)
+    if slow:
+        writer.write(server_id + SLOW_FILE, line)
+        metrics.inc(metrics.SLOW_QUERIES)
+
+def span(name):
+    '''
+    Function that returns a context manager adding the time spent in its block
+    to the trace of the running request as a span with the given name.
+    '''
+    trace = get_current()
+    if trace is None:
+        return NO_SPAN
+    return Span(trace, name)
+
+def record(name, started):
+    '''
+    Function that adds a span from time started to now to the trace of the
+    running request.
+    '''
+    trace = get_current()
+    if trace is not None:
+        trace.spans.append((name, started, time.time() - started))
+
+def close():
+    '''
+    Function that writes the queued trace and slow-query log lines.
+    '''
+    if writer.thread is not None:
+        writer.close()
@@ -0,0 +1,285 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: upstream_pool.py
+Description: Pool of long-lived TCP connections from the default local DNS server
+             to the root DNS server and the .com, .org, .gov DNS servers so that
+             a cache miss reuses an open connection instead of opening a new one.
+             Pooled connections speak the framed protocol (framing.py).
+
+             Requests made for a client request with a deadline time out when
+             it passes, and a request still unanswered after its hedging delay
+             is sent again on another connection (deadlines.py). Requests of a
+             traced client request carry its trace id (tracing.py).
+'''
+
+import time
+import socket
+import select
+import threading
+import deadlines
+import framing
+import tracing
+
+DEFAULT_POOL_SIZE = 16 # maximum open connections kept per upstream server
+
+class PooledConnection(object):
+    '''
+    A framed connection to an upstream server and the id of its next request.
+    '''
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = framing.FrameReader()
+        self.next_id = 1
+        self.pending = None # id of the request sent and not answered yet
+
+    def send(self, msg, timeout=None):
+        request_id = self.next_id
+        self.next_id = (self.next_id % 0xFFFFFFFF) + 1
+        self.sock.settimeout(timeout)
+        self.sock.sendall(framing.encode_frame(request_id, tracing.attach(msg)))
+        self.pending = request_id
+
+    def receive(self):
+        '''
+        Function that reads what has arrived on the connection and returns the
+        reply to the pending request once it is complete, None until then, or
+        '' if the connection closed. Frames with request id 0 are server
+        notices such as 'shutdown' and are returned in place of the reply.
+        '''
+        data = self.sock.recv(framing.RECV_SIZE)
+        if not data:
+            return ''
+        for reply_id, reply in self.reader.feed(data):
+            if reply_id == self.pending or reply_id == framing.NOTICE_ID:
+                self.pending = None
+                return reply
+        return None
+
+    def request(self, msg, deadline=None):
+        '''
+        Function that sends a request and returns its reply, or '' if the
+        connection closed. Every send and receive times out when the deadline
+        passes.
+        '''
+        self.send(msg, deadlines.seconds_left(deadline))
+        while True:
+            reply = self.receive()
+            if reply is not None:
+                return reply
+            if deadline is not None:
+                self.sock.settimeout(deadline.timeout())
+
+    def close(self):
+        self.sock.close()
+
+class ConnectionPool(object):
+    '''
+    Thread-safe pool of connections keyed by upstream (ip, port). Idle
+    connections are health checked before reuse, broken ones are replaced, and
+    no more than max_size connections are ever open to a single upstream.
+    hedging is the deadlines.HedgePolicy deciding when requests are hedged, or
+    None.
+    '''
+
+    def __init__(self, max_size=DEFAULT_POOL_SIZE, hedging=None):
+        self.max_size = max(1, max_size)
+        self.hedging = hedging
+        self.idle = {}      # (ip, port) -> list of idle connections
+        self.open = {}      # (ip, port) -> number of open connections (idle and in use)
+        self.cond = threading.Condition()
+        self.stats = {'hits': 0, 'misses': 0, 'reconnects': 0, 'discarded': 0,
+                      'timeouts': 0, 'hedged': 0, 'hedge_wins': 0}
+
+    def count(self, stat):
+        with self.cond:
+            self.stats[stat] += 1
+
+    def healthy(self, conn):
+        '''
+        Function that returns True if an idle connection can be reused. An idle
+        connection should never be readable: readability means the upstream
+        closed it (or sent something unexpected) while it sat in the pool.
+        '''
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (select.error, ValueError, socket.error):
+            return False
+        return not readable
+
+    def discard(self, addr, conn):
+        '''
+        Function that closes a connection and frees its slot in the pool.
+        '''
+        try:
+            conn.close()
+        except socket.error:
+            pass
+        with self.cond:
+            self.open[addr] = self.open.get(addr, 1) - 1
+            self.stats['discarded'] += 1
+            self.cond.notify()
+
+    def acquire(self, addr, deadline=None, wait=True):
+        '''
+        Function that returns a connection to addr, reusing a healthy idle one
+        when possible. Blocks while max_size connections to addr are in use,
+        until the deadline passes, or returns None then if wait is False.
+        '''
+        while True:
+            with self.cond:
+                idle = self.idle.setdefault(addr, [])
+                if not idle and self.open.get(addr, 0) >= self.max_size:
+                    if not wait:
+                        return None
+                    with tracing.span('pool-wait'):
+                        while not idle and self.open.get(addr, 0) >= self.max_size:
+                            self.cond.wait(deadlines.seconds_left(deadline))
+                if idle:
+                    conn = idle.pop()
+                else:
+                    self.open[addr] = self.open.get(addr, 0) + 1
+                    self.stats['misses'] += 1
+                    conn = None
+            if conn is None:
+                try:
+                    return PooledConnection(
+                        socket.create_connection(addr, deadlines.seconds_left(deadline)))
+                except (socket.error, deadlines.DeadlineExceeded):
+                    with self.cond:
+                        self.open[addr] -= 1
+                        self.cond.notify()
+                    raise
+            if self.healthy(conn):
+                with self.cond:
+                    self.stats['hits'] += 1
+                return conn
+            self.discard(addr, conn)
+
+    def release(self, addr, conn):
+        '''
+        Function that returns a connection to the pool once its response has
+        been read so that later requests can reuse it.
+        '''
+        with self.cond:
+            self.idle.setdefault(addr, []).append(conn)
+            self.cond.notify()
+
+    def request(self, addr, msg, deadline=None, hedge_addr=None, on_hedge=None):
+        '''
+        Function that sends a request message to the upstream server at addr
+        over a pooled connection and returns its response. A pooled connection
+        that turns out to be broken is replaced and the request retried once.
+        With a deadline the request carries its remaining time and
+        deadlines.DeadlineExceeded is raised if no response came before it
+        passed. A request still unanswered after its hedging delay is sent
+        again to hedge_addr (default: addr) and the first response is returned.
+        on_hedge, if given, is called when the hedge is sent and returns the
+        function to call once it is over.
+        '''
+        delay = self.hedging.delay(addr) if self.hedging is not None else None
+        for attempt in range(2):
+            conn = self.acquire(addr, deadline)
+            started = time.time()
+            try:
+                if delay is None:
+                    response = conn.request(deadlines.attach(msg, deadline), deadline)
+                else:
+                    response = self.hedged_request(conn, msg, deadline, delay, hedge_addr or addr,
+                                                   on_hedge)
+            except (socket.timeout, deadlines.DeadlineExceeded):
+                self.discard(addr, conn)
+                self.count('timeouts')
+                raise deadlines.DeadlineExceeded('No response from upstream server ' + str(addr) +
+                                                 ' before the deadline')
+            except (socket.error, framing.FramingError):
+                response = ''
+            if response:
+                elapsed = time.time() - started
+                if conn.pending is None:
+                    self.release(addr, conn)
+                else: # the hedged request answered first, addr took at least this long
+                    elapsed = max(elapsed, delay)
+                    self.discard(addr, conn)
+                if self.hedging is not None: # the latency of addr, not of its hedge
+                    self.hedging.record(addr, elapsed)
+                return response
+            self.discard(addr, conn)
+            if attempt == 0:
+                self.count('reconnects')
+        raise socket.error('Upstream server ' + str(addr) + ' closed the connection')
+
+    def hedged_request(self, conn, msg, deadline, delay, hedge_addr, on_hedge=None):
+        '''
+        Function that sends msg on conn and, if no response has come delay
+        seconds later, sends it again on a connection to hedge_addr, when one
+        is free. The first response is returned, or '' if every connection
+        broke. The hedge connection is released or discarded here; conn is
+        still pending (conn.pending) if the hedge answered first.
+        '''
+        conn.send(deadlines.attach(msg, deadline), deadlines.seconds_left(deadline))
+        waiting = {conn.sock: conn}
+        hedge = None
+        hedge_done = None # ends the hedge's on_hedge count
+        hedge_at = time.time() + delay
+        try:
+            while waiting:
+                timeout = deadlines.seconds_left(deadline)
+                if hedge_at is not None:
+                    until_hedge = max(0, hedge_at - time.time())
+                    timeout = until_hedge if timeout is None else min(timeout, until_hedge)
+                readable = select.select(list(waiting), [], [], timeout)[0]
+                if not readable and hedge_at is not None and time.time() >= hedge_at:
+                    hedge_at = None
+                    hedge = self.acquire(hedge_addr, deadline, wait=False)
+                    if hedge is not None:
+                        hedge.send(deadlines.attach(msg, deadline), deadlines.seconds_left(deadline))
+                        waiting[hedge.sock] = hedge
+                        self.count('hedged')
+                        if on_hedge is not None:
+                            hedge_done = on_hedge()
+                for sock in readable:
+                    answered = waiting[sock]
+                    try:
+                        response = answered.receive()
+                    except (socket.error, framing.FramingError):
+                        response = ''
+                    if response is None:
+                        continue
+                    if response:
+                        if answered is hedge:
+                            self.count('hedge_wins')
+                            self.release(hedge_addr, hedge)
+                            hedge = None
+                        return response
+                    del waiting[sock] # the connection broke
+            return ''
+        finally:
+            if hedge is not None:
+                self.discard(hedge_addr, hedge)
+            if hedge_done is not None:
+                hedge_done()
+
+    def get_stats(self):
+        '''
+        Function that returns a snapshot of the pool hit/miss counters and the
+        number of open connections to every upstream.
+        '''
+        with self.cond:
+            stats = dict(self.stats)
+            stats['open'] = dict((str(addr[0]) + ':' + str(addr[1]), count)
+                                 for addr, count in self.open.items())
+        return stats
+
+    def close_all(self):
+        '''
+        Function that closes every idle connection in the pool.
+        '''
+        with self.cond:
+            for addr in self.idle:
+                for conn in self.idle[addr]:
+                    conn.close()
+                    self.open[addr] -= 1
+                self.idle[addr] = []
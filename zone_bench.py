@@ -0,0 +1,136 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: zone_bench.py
+Description: Benchmark of loading large mapping files into the .com, .org, .gov
+             DNS server. A synthetic .dat file is generated for every size and
+             loaded by a fresh process, which reports the load time, the resident
+             memory before and after loading and the lookup rate. The file is also
+             compiled with zone_compile.py and the compiled zone measured
+             ('mapped'). With --dict the original plain dict of strings is
+             measured as well for comparison.
+'''
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+WORDS = ['mail', 'shop', 'cdn', 'api', 'static', 'news', 'blog', 'dev', 'app', 'img']
+
+def hostname_of(i):
+    '''
+    Function that returns the i-th synthetic hostname of a zone.
+    '''
+    return 'www.' + WORDS[i % len(WORDS)] + str(i) + '.example' + str(i % 1000) + '.com'
+
+def generate(filename, records):
+    '''
+    Function that writes a mapping file of records synthetic hostnames.
+    '''
+    f = open(filename, 'w')
+    try:
+        lines = []
+        for i in range(records):
+            lines.append(hostname_of(i) + ' 10.' + str((i >> 16) & 255) + '.' +
+                         str((i >> 8) & 255) + '.' + str(i & 255) + '\n')
+            if len(lines) == 100000:
+                f.write(''.join(lines))
+                lines = []
+        f.write(''.join(lines))
+    finally:
+        f.close()
+
+def rss_mb():
+    '''
+    Function that returns the resident memory of this process in MB.
+    '''
+    try:
+        f = open('/proc/self/statm', 'r')
+        try:
+            pages = int(f.read().split()[1])
+        finally:
+            f.close()
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+    except (IOError, OSError, ValueError):
+        import resource # peak rather than current memory, but portable
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage / (1024.0 * 1024.0) if sys.platform == 'darwin' else usage / 1024.0
+
+def measure(filename, records, structure, lookups):
+    '''
+    Function run in a child process: loads filename into the chosen structure
+    and prints the measurements on one line.
+    '''
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import dns_servers
+    import zone_index
+    before = rss_mb()
+    start = time.time()
+    if structure in ('index', 'mapped'):
+        dns_servers.preprocess_server(filename)
+        mappings = dns_servers.mappings
+    else:
+        mappings = dict(zone_index.read_mapping_file(filename))
+    load_time = time.time() - start
+    after = rss_mb()
+
+    rand = random.Random(1)
+    names = [dns_servers.format_hostname(hostname_of(rand.randrange(records)))
+             for i in range(lookups)]
+    start = time.time()
+    for name in names:
+        if mappings.get(name) is None:
+            raise SystemExit('lookup of ' + name + ' failed')
+    lookup_time = time.time() - start
+
+    print('%-6s %10d records  load %8.2fs  rss %8.1f MB  (%6.1f bytes/record)  %9d lookups/s' %
+          (structure, records, load_time, after - before,
+           (after - before) * 1024 * 1024 / max(1, records), lookups / max(lookup_time, 1e-9)))
+    sys.stdout.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description='.com, .org, .gov zone loading benchmark')
+    parser.add_argument('--sizes', default='1000000,10000000,50000000',
+                        help='comma separated record counts')
+    parser.add_argument('--dict', action='store_true',
+                        help='also measure the plain dict the server used to load into')
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--dir', default=None, help='where to write the generated .dat files')
+    parser.add_argument('--measure', nargs=3, metavar=('FILE', 'RECORDS', 'STRUCTURE'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure[0], int(args.measure[1]), args.measure[2], args.lookups)
+        return 0
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    directory = args.dir or tempfile.mkdtemp()
+    for records in [int(size) for size in args.sizes.split(',')]:
+        filename = os.path.join(directory, 'zone' + str(records) + '.dat')
+        start = time.time()
+        generate(filename, records)
+        print('generated %s in %.2fs' % (filename, time.time() - start))
+        zone_filename = filename[:-len('.dat')] + '.zone'
+        subprocess.call([sys.executable, os.path.join(here, 'zone_compile.py'),
+                         filename, zone_filename])
+        runs = [('index', filename), ('mapped', zone_filename)]
+        if args.dict:
+            runs.append(('dict', filename))
+        for structure, path in runs:
+            code = subprocess.call([sys.executable, os.path.abspath(__file__),
+                                    '--lookups', str(args.lookups),
+                                    '--measure', path, str(records), structure])
+            if code != 0:
+                print('%-6s %10d records  failed (exit code %d)' % (structure, records, code))
+        os.remove(filename)
+        os.remove(zone_filename)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
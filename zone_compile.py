@@ -0,0 +1,33 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: zone_compile.py
+Description: Offline compiler that turns a text mapping file (com.dat, org.dat,
+             gov.dat) into a compiled zone file the .com, .org, .gov DNS server
+             maps into memory at startup instead of parsing the text file:
+
+             python zone_compile.py com.dat com.zone
+             python dns_servers.py com 5678 com.zone server.dat
+'''
+
+import sys
+import time
+import argparse
+import zone_index
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile a DNS mapping file into a zone file')
+    parser.add_argument('mapping_file')
+    parser.add_argument('zone_file')
+    args = parser.parse_args()
+
+    start = time.time()
+    index = zone_index.ZoneIndex.build(zone_index.read_mapping_file(args.mapping_file))
+    index.save(args.zone_file)
+    print('Compiled ' + str(len(index)) + ' records into ' + args.zone_file + ' in ' +
+          str(round(time.time() - start, 2)) + 's')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,472 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: zone_index.py
+Description: Compact read-only index of the hostname mappings of a .com, .org or
+             .gov zone. Hostnames are stored with their labels reversed
+             ('www.example.com' -> 'com.example.www') in one sorted byte string
+             with an array of offsets, and ip addresses are packed into 4 bytes
+             each, so a record costs about the length of its name plus 8 bytes
+             instead of two Python strings and a dict slot. Exact lookups go
+             through an open addressing hash table of record numbers (4 bytes
+             per slot, at most half full); the sorted order keeps related names
+             together and lets runs be merged.
+
+             Besides exact matches the index answers wildcard records
+             ('*.example.com' matches any name under example.com, the most
+             specific wildcard winning) and longest-suffix matches.
+
+             Large zones are built in sorted runs that are merged at the end, so
+             the whole zone is never held as Python objects at once. Changes to a
+             loaded zone are kept in a small overlay of added, changed and deleted
+             names (diff, with_overlay) instead of rebuilding the index.
+
+             An index can be compiled to a binary zone file (zone_compile.py)
+             that holds the same arrays. A compiled zone is served straight from
+             a read-only memory map, so opening it doesn't depend on the zone's
+             size and every process serving it shares the OS page cache copy.
+
+             Text mapping files are read by read_mapping_file, shared by the
+             server and the offline tools (zone_compile.py, zone_split.py).
+'''
+
+import os
+import sys
+import copy
+import mmap
+import zlib
+import heapq
+import itertools
+import socket
+import struct
+import query
+from array import array
+
+DEFAULT_RUN_SIZE = 1000000 # records sorted in memory at a time while building
+ADDRESS = struct.Struct('!I')
+ZONE_MAGIC = b'DNSZONE1'
+ZONE_HEADER = struct.Struct('<8sII4Q') # magic, offset width, unused, records, slots,
+                                       # names size, texts size
+WORD = struct.Struct('<I')
+WILDCARD = b'.*' # key suffix of a wildcard record ('*.example.com' -> 'com.example.*')
+READ_CHUNK = 65536 # lines of a mapping file normalized at a time
+
+def wide_offsets(offsets):
+    '''
+    Function that returns offsets copied into an array of 8 byte integers, for
+    zones whose names take more than 4 GB.
+    '''
+    for typecode in ('L', 'Q'):
+        try:
+            if array(typecode).itemsize == 8:
+                return array(typecode, offsets)
+        except ValueError: # 'Q' is missing on Python 2
+            pass
+    raise OverflowError('Zone too large to index')
+
+def reverse_name(hostname):
+    '''
+    Function that returns the index key of a hostname: its labels in reverse
+    order, as bytes.
+    '''
+    labels = hostname.split('.')
+    labels.reverse()
+    key = '.'.join(labels)
+    return key if isinstance(key, bytes) else key.encode('utf-8')
+
+def align(offset):
+    return (offset + 7) & ~7
+
+def write_array(f, values):
+    '''
+    Function that writes an array in little-endian order followed by the
+    padding that keeps the next section 8 byte aligned.
+    '''
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    size = values.itemsize * len(values)
+    f.write(values.tobytes() if hasattr(values, 'tobytes') else values.tostring())
+    f.write(b'\x00' * (align(size) - size))
+
+def is_compiled(filename):
+    '''
+    Function that returns True if filename is a compiled zone file rather than
+    a text mapping file.
+    '''
+    f = open(filename, 'rb')
+    try:
+        return f.read(len(ZONE_MAGIC)) == ZONE_MAGIC
+    finally:
+        f.close()
+
+def unreverse_name(key):
+    '''
+    Function that returns the hostname of an index key.
+    '''
+    labels = key.decode('utf-8').split('.')
+    labels.reverse()
+    return str('.'.join(labels))
+
+def pack_address(ip):
+    '''
+    Function that returns a dotted-quad ip address as a 32 bit integer, or None
+    if the mapping holds something else (which is then stored as text).
+    '''
+    try:
+        packed = socket.inet_aton(ip)
+    except (socket.error, UnicodeError, TypeError):
+        return None
+    if socket.inet_ntoa(packed) != ip:
+        return None
+    return ADDRESS.unpack(packed)[0]
+
+def read_mapping_file(filename):
+    '''
+    Function that yields the (hostname, ip) pair of every line of a .dat file,
+    with the hostname formatted the way queries are. Lines are read and their
+    hostnames normalized a chunk at a time.
+    '''
+    file = open(filename, "r");
+    try:
+        while True:
+            lines = [line.strip("\n").strip("\r").split(" ")
+                     for line in itertools.islice(file, READ_CHUNK)]
+            if not lines:
+                break
+            lines = [line for line in lines if len(line) >= 2]
+            for hostname, line in zip(query.zone_names([line[0] for line in lines]), lines):
+                yield hostname, line[1]
+    finally:
+        file.close()
+
+class ZoneIndex(object):
+    '''
+    Sorted, immutable hostname -> ip address index of a zone, with an optional
+    overlay of changes made since it was built.
+    '''
+
+    def __init__(self):
+        self.names = bytearray()    # reversed hostnames, sorted and concatenated
+        self.offsets = array('I', [0]) # start of every name, plus the end of the last
+        self.addresses = array('I') # packed ip address of every name
+        self.texts = {}             # record number -> ip text that isn't a dotted quad
+        self.slots = array('I', [0]) # hash table of record number + 1 (0 = empty slot)
+        self.overlay = {}           # key -> ip, or None for a deleted name
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __contains__(self, hostname):
+        return self.value_of(reverse_name(hostname)) is not None
+
+    def append(self, key, address, text=None):
+        '''
+        Function that adds a record to the end of the index. Keys must be
+        appended in sorted order.
+        '''
+        if text is not None:
+            self.texts[len(self.addresses)] = text
+        self.names.extend(key)
+        self.addresses.append(address)
+        end = len(self.names)
+        if end > 0xFFFFFFFF and self.offsets.typecode == 'I':
+            self.offsets = wide_offsets(self.offsets)
+        self.offsets.append(end)
+
+    def key(self, i):
+        return bytes(self.names[self.offsets[i]:self.offsets[i + 1]])
+
+    def value(self, i):
+        if self.texts:
+            text = self.texts.get(i)
+            if text is not None:
+                return text
+        return socket.inet_ntoa(ADDRESS.pack(self.addresses[i]))
+
+    def value_of(self, key):
+        '''
+        Function that returns the ip address of key, or None.
+        '''
+        if self.overlay and key in self.overlay:
+            return self.overlay[key]
+        i = self.find(key)
+        return self.value(i) if i >= 0 else None
+
+    def items(self):
+        '''
+        Function that yields the (hostname, ip) pair of every indexed record,
+        ignoring the overlay.
+        '''
+        for i in range(len(self)):
+            yield unreverse_name(self.key(i)), self.value(i)
+
+    def records(self, tag=0):
+        '''
+        Function that yields every (key, tag, address, text) record in order.
+        '''
+        for i in range(len(self.addresses)):
+            yield self.key(i), tag, self.addresses[i], self.texts.get(i)
+
+    def finish(self):
+        '''
+        Function that builds the hash table once every record has been added.
+        '''
+        size = 8
+        while size < 2 * len(self.addresses):
+            size *= 2
+        slots = array('I', [0]) * size
+        mask = size - 1
+        for i in range(len(self.addresses)):
+            slot = zlib.crc32(self.key(i)) & mask
+            while slots[slot]:
+                slot = (slot + 1) & mask
+            slots[slot] = i + 1
+        self.slots = slots
+        return self
+
+    def find(self, key):
+        '''
+        Function that returns the record number of key, or -1.
+        '''
+        names = self.names
+        offsets = self.offsets
+        slots = self.slots
+        mask = len(slots) - 1
+        slot = zlib.crc32(key) & mask
+        while True:
+            i = slots[slot] - 1
+            if i < 0:
+                return -1
+            if names[offsets[i]:offsets[i + 1]] == key:
+                return i
+            slot = (slot + 1) & mask
+
+    def get(self, hostname, default=None):
+        '''
+        Function that returns the ip address mapped to exactly hostname.
+        '''
+        ip = self.value_of(reverse_name(hostname))
+        return default if ip is None else ip
+
+    def lookup(self, hostname):
+        '''
+        Function that returns the ip address of hostname, falling back to the
+        most specific wildcard record covering it. Returns None if neither
+        exists.
+        '''
+        key = reverse_name(hostname)
+        ip = self.value_of(key)
+        while ip is None:
+            dot = key.rfind(b'.')
+            if dot < 0:
+                return None
+            key = key[:dot]
+            ip = self.value_of(key + WILDCARD)
+        return ip
+
+    def longest_suffix(self, hostname):
+        '''
+        Function that returns the (name, ip address) record of the longest
+        mapped name that is hostname itself or a parent domain of it, or None.
+        '''
+        labels = hostname.split('.')
+        for start in range(len(labels)):
+            name = '.'.join(labels[start:])
+            ip = self.value_of(reverse_name(name))
+            if ip is not None:
+                return name, ip
+        return None
+
+    def diff(self, records):
+        '''
+        Function that compares the zone with a new version of it, given as an
+        iterable of (hostname, ip) pairs, and returns the changes as a dict of
+        key -> new ip, or None for a name that was removed.
+        '''
+        seen = bytearray(len(self)) # indexed records present in the new version
+        seen_overlay = set()        # names added by the overlay present in the new version
+        changes = {}
+        for hostname, ip in records:
+            key = reverse_name(hostname)
+            i = self.find(key)
+            if i >= 0:
+                seen[i] = 1
+            elif key in self.overlay:
+                seen_overlay.add(key)
+            if self.value_of(key) != ip:
+                changes[key] = ip
+            else: # a later line of the same name may undo an earlier change
+                changes.pop(key, None)
+        i = seen.find(b'\x00')
+        while i >= 0:
+            key = self.key(i)
+            if self.value_of(key) is not None:
+                changes[key] = None
+            i = seen.find(b'\x00', i + 1)
+        for key, ip in self.overlay.items():
+            if ip is not None and key not in seen_overlay and self.find(key) < 0:
+                changes[key] = None
+        return changes
+
+    def with_overlay(self, changes):
+        '''
+        Function that returns a copy of the index sharing its arrays, with
+        changes (as returned by diff) applied on top of the current overlay.
+        '''
+        overlay = dict(self.overlay)
+        for key, ip in changes.items():
+            if ip is None and self.find(key) < 0:
+                overlay.pop(key, None) # only ever added by the overlay
+            else:
+                overlay[key] = ip
+        index = copy.copy(self)
+        index.overlay = overlay
+        return index
+
+    def size_bytes(self):
+        '''
+        Function that returns the memory held by the index arrays.
+        '''
+        size = len(self.names) + self.offsets.itemsize * len(self.offsets) + \
+            self.addresses.itemsize * len(self.addresses)
+        return size + self.slots.itemsize * len(self.slots)
+
+    def save(self, filename):
+        '''
+        Function that writes the index to a compiled zone file. The file is
+        written next to its final name and renamed into place, so a server never
+        maps a partially written zone.
+        '''
+        texts = b''.join((str(i) + ' ' + self.texts[i] + '\n').encode('utf-8')
+                         for i in sorted(self.texts))
+        tmp_filename = filename + '.tmp'
+        f = open(tmp_filename, 'wb')
+        try:
+            f.write(ZONE_HEADER.pack(ZONE_MAGIC, self.offsets.itemsize, 0, len(self),
+                                     len(self.slots), len(self.names), len(texts)))
+            write_array(f, self.offsets)
+            write_array(f, self.addresses)
+            write_array(f, self.slots)
+            f.write(bytes(self.names))
+            f.write(b'\x00' * (align(len(self.names)) - len(self.names)))
+            f.write(texts)
+        finally:
+            f.close()
+        os.rename(tmp_filename, filename)
+
+    @classmethod
+    def from_dict(cls, mappings):
+        '''
+        Function that builds a single sorted run from a key -> ip dict.
+        '''
+        index = cls()
+        for key in sorted(mappings):
+            ip = mappings[key]
+            address = pack_address(ip)
+            if address is None:
+                index.append(key, 0, ip)
+            else:
+                index.append(key, address)
+        return index
+
+    @classmethod
+    def build(cls, records, run_size=DEFAULT_RUN_SIZE):
+        '''
+        Function that builds the index of an iterable of (hostname, ip) pairs.
+        When a hostname appears more than once the last ip address wins, as
+        with a dict.
+        '''
+        runs = []
+        pending = {}
+        for hostname, ip in records:
+            pending[reverse_name(hostname)] = ip
+            if len(pending) >= run_size:
+                runs.append(cls.from_dict(pending))
+                pending = {}
+        if pending or not runs:
+            runs.append(cls.from_dict(pending))
+        pending = None
+        if len(runs) == 1:
+            return runs[0].finish()
+
+        # merge the runs; equal keys come out in run order, so keep the last one
+        index = cls()
+        merged = heapq.merge(*[run.records(tag) for tag, run in enumerate(runs)])
+        previous = None
+        for key, tag, address, text in merged:
+            if previous is not None and previous[0] != key:
+                index.append(previous[0], previous[2], previous[3])
+            previous = (key, tag, address, text)
+        if previous is not None:
+            index.append(previous[0], previous[2], previous[3])
+        return index.finish()
+
+class MappedZoneIndex(ZoneIndex):
+    '''
+    ZoneIndex served from a memory mapped compiled zone file. Records are read
+    from the mapped pages on demand; only the few ip values that aren't dotted
+    quads are decoded when the file is opened.
+    '''
+
+    def __init__(self, filename):
+        f = open(filename, 'rb')
+        try:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        self.overlay = {}
+        magic, width, unused, self.count, self.slot_count, names_size, texts_size = \
+            ZONE_HEADER.unpack_from(self.map, 0)
+        if magic != ZONE_MAGIC or width not in (4, 8):
+            self.map.close()
+            raise ValueError(filename + ' is not a compiled zone file')
+        self.offset_pair = struct.Struct('<II' if width == 4 else '<QQ')
+        self.width = width
+        self.offsets_start = ZONE_HEADER.size
+        self.addresses_start = self.offsets_start + align(width * (self.count + 1))
+        self.slots_start = self.addresses_start + align(4 * self.count)
+        self.names_start = self.slots_start + align(4 * self.slot_count)
+        texts_start = self.names_start + align(names_size)
+        self.texts = {}
+        for line in self.map[texts_start:texts_start + texts_size].decode('utf-8').split('\n'):
+            if line:
+                i, text = line.split(' ', 1)
+                self.texts[int(i)] = str(text)
+
+    def __len__(self):
+        return self.count
+
+    def key(self, i):
+        start, end = self.offset_pair.unpack_from(self.map, self.offsets_start + self.width * i)
+        return self.map[self.names_start + start:self.names_start + end]
+
+    def value(self, i):
+        if self.texts:
+            text = self.texts.get(i)
+            if text is not None:
+                return text
+        return socket.inet_ntoa(ADDRESS.pack(WORD.unpack_from(self.map, self.addresses_start + 4 * i)[0]))
+
+    def records(self, tag=0):
+        for i in range(self.count):
+            yield self.key(i), tag, WORD.unpack_from(self.map, self.addresses_start + 4 * i)[0], \
+                self.texts.get(i)
+
+    def find(self, key):
+        mask = self.slot_count - 1
+        slot = zlib.crc32(key) & mask
+        while True:
+            i = WORD.unpack_from(self.map, self.slots_start + 4 * slot)[0] - 1
+            if i < 0:
+                return -1
+            if self.key(i) == key:
+                return i
+            slot = (slot + 1) & mask
+
+    def size_bytes(self):
+        return len(self.map)
+
+    def close(self):
+        self.map.close()
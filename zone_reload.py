@@ -0,0 +1,148 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: zone_reload.py
+Description: Reloading of the mapping files and server.dat of the root and .com,
+             .org, .gov DNS servers while they keep serving queries. A watcher
+             thread notices when a file changes (or a 'reload' message asks for
+             it) and a reloader thread rebuilds the server's tables in the
+             background, which the server then swaps in with a single assignment.
+
+             Names whose answers changed are sent to the default local DNS server
+             in an invalidation message, 'INVALIDATE <id>' followed by one
+             hostname per line, so it drops them from its cache.
+'''
+
+import os
+import time
+import socket
+import threading
+import framing
+
+INVALIDATE_KEYWORD = 'INVALIDATE'
+RELOAD_MESSAGE = 'reload'
+DEFAULT_SERVER = ('127.0.0.1', 5352) # default local DNS server, as in the shutdown broadcast
+MAX_NAMES_PER_MESSAGE = 10000
+
+def is_invalidation(msg):
+    '''
+    Function that returns True if msg is an invalidation message.
+    '''
+    return msg.startswith(INVALIDATE_KEYWORD + ' ')
+
+def encode_invalidation(sender_id, hostnames):
+    '''
+    Function that returns the invalidation message for a list of hostnames.
+    '''
+    return '\n'.join([INVALIDATE_KEYWORD + ' ' + sender_id] + list(hostnames))
+
+def decode_invalidation(msg):
+    '''
+    Function that returns the sender id and hostnames of an invalidation
+    message.
+    '''
+    lines = msg.split('\n')
+    return lines[0][len(INVALIDATE_KEYWORD) + 1:], [line for line in lines[1:] if line]
+
+def notify_changed(sender_id, hostnames, addr=DEFAULT_SERVER):
+    '''
+    Function that tells the default local DNS server which hostnames changed,
+    over one framed connection. A default server that isn't running has nothing
+    cached, so failing to connect is ignored.
+    '''
+    hostnames = list(hostnames)
+    if not hostnames:
+        return
+    try:
+        s = socket.create_connection(addr)
+    except socket.error:
+        return
+    try:
+        reader = framing.FrameReader()
+        for start in range(0, len(hostnames), MAX_NAMES_PER_MESSAGE):
+            msg = encode_invalidation(sender_id, hostnames[start:start + MAX_NAMES_PER_MESSAGE])
+            framing.request(s, reader, start // MAX_NAMES_PER_MESSAGE + 1, msg)
+    except (socket.error, framing.FramingError) as e:
+        print('Could not send invalidations to the default local DNS server: ' + str(e))
+    finally:
+        s.close()
+
+def file_signature(filename):
+    '''
+    Function that returns what identifies the current contents of a file, or
+    None if it doesn't exist (e.g. while it is being replaced).
+    '''
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+class Reloader(object):
+    '''
+    Runs reload(filename) for the server's files in a background thread, one
+    file at a time. Files requested while a reload is running are reloaded once
+    it finishes.
+    '''
+
+    def __init__(self, reload, filenames):
+        self.reload = reload
+        self.filenames = filenames
+        self.pending = []
+        self.running = False
+        self.lock = threading.Lock()
+
+    def request(self, filenames=None):
+        '''
+        Function that asks for filenames (by default all of the server's files)
+        to be reloaded.
+        '''
+        if filenames is None:
+            filenames = self.filenames
+        with self.lock:
+            for filename in filenames:
+                if filename not in self.pending:
+                    self.pending.append(filename)
+            if self.running:
+                return
+            self.running = True
+        t = threading.Thread(target=self.run)
+        t.daemon = True
+        t.start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.running = False
+                    return
+                filename = self.pending.pop(0)
+            start = time.time()
+            try:
+                self.reload(filename)
+                print('Reloaded ' + filename + ' in ' + str(round(time.time() - start, 3)) + 's')
+            except Exception as e: # keep serving the tables already loaded
+                print('Reloading ' + filename + ' failed: ' + str(e))
+
+def watch_files(reloader, interval):
+    '''
+    Function that starts a thread checking every interval seconds whether any
+    of the reloader's files changed and asking it to reload the ones that did.
+    '''
+    filenames = reloader.filenames
+    def watch():
+        signatures = dict((filename, file_signature(filename)) for filename in filenames)
+        while True:
+            time.sleep(interval)
+            changed = []
+            for filename in filenames:
+                signature = file_signature(filename)
+                if signature is not None and signature != signatures[filename]:
+                    signatures[filename] = signature
+                    changed.append(filename)
+            if changed:
+                reloader.request(changed)
+    t = threading.Thread(target=watch)
+    t.daemon = True
+    t.start()
@@ -0,0 +1,98 @@
+'''
+Name: Carlos Alvarenga
+Student id: 5197501
+Email: alvar357@umn.edu
+Filename: zone_split.py
+Description: Offline tool that splits a mapping file (com.dat, org.dat, gov.dat)
+             into one file per shard, com.<shard>.dat, with the consistent hash
+             ring the root and default local servers route queries with
+             (shard_ring.py). Wildcard records are copied to every shard. Each
+             shard is then served by its own dns_servers.py, listed in server.dat
+             with the shard name as a fourth column:
+
+             python zone_split.py com.dat com0,com1,com2
+             python dns_servers.py com 5678 com.com0.dat server.dat
+
+             With --from OLD,SHARDS it also reports how many names move when the
+             shards were OLD,SHARDS before, e.g. to add a shard:
+
+             python zone_split.py com.dat com0,com1,com2,com3 --from com0,com1,com2
+'''
+
+import os
+import sys
+import time
+import argparse
+import itertools
+import query
+import shard_ring
+import zone_index
+
+def split(mapping_file, ring, out_dir, old_ring=None):
+    '''
+    Function that writes the lines of a mapping file to the file of the shard
+    owning each hostname, a chunk of lines at a time, and returns the number of
+    records written to every shard, the number of wildcard records and the
+    number of names whose shard differs on old_ring.
+    '''
+    stem = os.path.splitext(os.path.basename(mapping_file))[0]
+    outputs = dict((shard, open(os.path.join(out_dir, stem + '.' + shard + '.dat'), 'w'))
+                   for shard in ring.shards)
+    counts = dict((shard, 0) for shard in ring.shards)
+    wildcards = moved = 0
+    file = open(mapping_file, 'r')
+    try:
+        while True:
+            lines = [line.rstrip('\r\n') for line in itertools.islice(file, zone_index.READ_CHUNK)]
+            if not lines:
+                break
+            lines = [line for line in lines if len(line.split(' ')) >= 2]
+            names = query.zone_names([line.split(' ', 1)[0] for line in lines])
+            for name, line in zip(names, lines):
+                if shard_ring.is_wildcard(name):
+                    wildcards += 1
+                    for shard in ring.shards:
+                        outputs[shard].write(line + '\n')
+                        counts[shard] += 1
+                    continue
+                shard = ring.owner(name)
+                outputs[shard].write(line + '\n')
+                counts[shard] += 1
+                if old_ring is not None and old_ring.owner(name) != shard:
+                    moved += 1
+    finally:
+        file.close()
+        for output in outputs.values():
+            output.close()
+    return counts, wildcards, moved
+
+def main():
+    parser = argparse.ArgumentParser(description='Split a DNS mapping file into shards')
+    parser.add_argument('mapping_file')
+    parser.add_argument('shards', help='comma separated shard names, as listed in server.dat')
+    parser.add_argument('--from', dest='old_shards', default=None,
+                        help='comma separated shard names before resharding, to count '
+                             'the names that move')
+    parser.add_argument('--out-dir', default='.', help='directory the shard files are written to')
+    args = parser.parse_args()
+
+    ring = shard_ring.HashRing([shard for shard in args.shards.split(',') if shard])
+    old_ring = None
+    if args.old_shards:
+        old_ring = shard_ring.HashRing([shard for shard in args.old_shards.split(',') if shard])
+    start = time.time()
+    counts, wildcards, moved = split(args.mapping_file, ring, args.out_dir, old_ring)
+    stem = os.path.splitext(os.path.basename(args.mapping_file))[0]
+    for shard in ring.shards:
+        print(os.path.join(args.out_dir, stem + '.' + shard + '.dat') + ': ' +
+              str(counts[shard]) + ' records')
+    names = sum(counts.values()) - wildcards * len(ring.shards)
+    print('Split ' + str(names) + ' names and ' + str(wildcards) + ' wildcard records into ' +
+          str(len(ring.shards)) + ' shards in ' + str(round(time.time() - start, 2)) + 's')
+    if old_ring is not None:
+        print(str(moved) + ' names (' + str(round(moved * 100.0 / (names or 1), 1)) +
+              '%) move from the shards ' + args.old_shards)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())